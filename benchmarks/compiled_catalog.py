@@ -0,0 +1,65 @@
+""" Compares reading the books from the JSON data files with reading them from a compiled catalog file.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.compiled_catalog [number of books]
+
+Synthetic data files of 1M books (by default) are written to a temporary directory, as in the json_import
+benchmark, and compiled into a catalog file as `flask compile-catalog` does. Reading is timed from the data files,
+as populate parses them, and from the catalog file, both creating every Book with its publisher name and authors.
+Mapping the catalog, which is all a SharedCatalogRepository does before serving requests, is timed as well.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.json_import import write_data_files
+from library.adapters.json_data_reader import BooksJSONReader, BOOK_FIELDS, garbage_collection_paused
+from library.adapters.shared_catalog import SharedCatalog
+from library.adapters.shared_catalog_repository import compile_shared_catalog
+
+DEFAULT_NUMBER_OF_BOOKS = 1_000_000
+
+
+def seconds_to_read(read_book_batches) -> float:
+    start = time.perf_counter()
+    with garbage_collection_paused():
+        number_of_books = sum(len(batch) for batch in read_book_batches())
+    seconds = time.perf_counter() - start
+    assert number_of_books > 0
+    return seconds
+
+
+def main(number_of_books: int):
+    with tempfile.TemporaryDirectory() as directory:
+        books_path, authors_path = write_data_files(Path(directory), number_of_books)
+        # Named as the data files are, so the catalog can be compiled from the directory
+        books_path = books_path.rename(Path(directory) / 'comic_books_excerpt.json')
+        authors_path = authors_path.rename(Path(directory) / 'book_authors_excerpt.json')
+
+        catalog_path = Path(directory) / 'catalog.bin'
+        start = time.perf_counter()
+        compile_shared_catalog(Path(directory), catalog_path)
+        compile_seconds = time.perf_counter() - start
+
+        json_seconds = seconds_to_read(
+            BooksJSONReader(str(books_path), str(authors_path), fields=BOOK_FIELDS).read_book_batches)
+        catalog_seconds = seconds_to_read(SharedCatalog(catalog_path).read_book_batches)
+
+        start = time.perf_counter()
+        SharedCatalog(catalog_path)
+        map_seconds = time.perf_counter() - start
+
+        print(f'{number_of_books} books, data files {books_path.stat().st_size / 2 ** 20:.0f} MiB, '
+              f'catalog {catalog_path.stat().st_size / 2 ** 20:.0f} MiB, compiled in {compile_seconds:.1f}s')
+        print(f'{"source":>20}  {"seconds":>8}  {"us per book":>11}  {"speedup":>7}')
+        for source, seconds in [('data files', json_seconds), ('catalog', catalog_seconds),
+                                ('catalog mapping', map_seconds)]:
+            print(f'{source:>20}  {seconds:>8.3f}  {seconds / number_of_books * 1e6:>11.2f}  '
+                  f'{json_seconds / seconds:>7.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUMBER_OF_BOOKS)
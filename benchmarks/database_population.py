@@ -0,0 +1,93 @@
+""" Compares populating a database one object at a time through SqlAlchemyRepository with populating it in bulk.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.database_population [number of books]
+
+Synthetic data files of 10k books (by default) are written to a temporary directory, as in the json_import
+benchmark, with one user for every ten books and one review for every two. The users file has hashed passwords, so
+neither population spends its time hashing them. Each population writes a new SQLite database file: one adding
+Books, Authors and Publishers through the repository a batch at a time and users and reviews one at a time, as
+populate used to, and one written by populate_in_bulk in a single transaction.
+"""
+
+import csv
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+from werkzeug.security import generate_password_hash
+
+from benchmarks.json_import import write_data_files
+from library.adapters.database_import import populate_in_bulk
+from library.adapters.database_repository import SqlAlchemyRepository
+from library.adapters.json_data_importer import load_books_authors_and_publishers, load_users, load_reviews
+from library.adapters.orm import metadata, map_model_to_tables
+from library.adapters.password_hashes import PASSWORD_HASH_COLUMN
+
+DEFAULT_NUMBER_OF_BOOKS = 10_000
+
+
+def write_users_and_reviews(data_path: Path, number_of_books: int):
+    rng = random.Random(number_of_books)
+    number_of_users = number_of_books // 10 + 1
+    # Every user has the same hash, as hashing isn't what is measured
+    password_hash = generate_password_hash('password')
+    with open(data_path / 'users.csv', 'w', newline='') as users_file:
+        writer = csv.writer(users_file)
+        writer.writerow(['id', 'username', PASSWORD_HASH_COLUMN])
+        writer.writerows([user_id, f'user{user_id}', password_hash] for user_id in range(number_of_users))
+    with open(data_path / 'reviews.csv', 'w', newline='') as reviews_file:
+        writer = csv.writer(reviews_file)
+        writer.writerow(['id', 'author-id', 'book-id', 'review-text', 'rating'])
+        writer.writerows([review_id, rng.randrange(number_of_users), rng.randrange(number_of_books),
+                          f'Review {review_id}', rng.randint(1, 5)] for review_id in range(number_of_books // 2))
+
+
+def seconds_to_populate_one_object_at_a_time(data_path: Path, database_path: Path) -> float:
+    clear_mappers()
+    engine = create_engine(f'sqlite:///{database_path}')
+    metadata.create_all(engine)
+    map_model_to_tables()
+    repo = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    start = time.perf_counter()
+    load_books_authors_and_publishers(data_path, repo, True)
+    load_reviews(data_path, repo, load_users(data_path, repo))
+    seconds = time.perf_counter() - start
+    repo.close_session()
+    return seconds
+
+
+def seconds_to_populate_in_bulk(data_path: Path, database_path: Path) -> float:
+    engine = create_engine(f'sqlite:///{database_path}')
+    metadata.create_all(engine)
+    start = time.perf_counter()
+    populate_in_bulk(data_path, engine)
+    return time.perf_counter() - start
+
+
+def main(number_of_books: int):
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = Path(directory)
+        books_path, authors_path = write_data_files(data_path, number_of_books)
+        # Named as the data files are, so the database can be populated from the directory
+        books_path.rename(data_path / 'comic_books_excerpt.json')
+        authors_path.rename(data_path / 'book_authors_excerpt.json')
+        write_users_and_reviews(data_path, number_of_books)
+
+        per_object_seconds = seconds_to_populate_one_object_at_a_time(data_path, data_path / 'per_object.db')
+        bulk_seconds = seconds_to_populate_in_bulk(data_path, data_path / 'bulk.db')
+
+        print(f'{number_of_books} books, {number_of_books // 10 + 1} users, {number_of_books // 2} reviews')
+        print(f'{"population":>20}  {"seconds":>8}  {"us per book":>11}  {"speedup":>7}')
+        for name, seconds in [('one object at a time', per_object_seconds), ('in bulk', bulk_seconds)]:
+            print(f'{name:>20}  {seconds:>8.2f}  {seconds / number_of_books * 1e6:>11.1f}  '
+                  f'{per_object_seconds / seconds:>7.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUMBER_OF_BOOKS)
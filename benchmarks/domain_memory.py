@@ -0,0 +1,57 @@
+""" Measures the memory used per Book by the domain model, with tracemalloc.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.domain_memory [number of books ...]
+
+Each Book gets a title, description, release year, page count, image url, a publisher shared by 100 books and
+an author shared by 10 books, as in the data files. Strings are built per book, so they are counted as well.
+"""
+
+import gc
+import sys
+import tracemalloc
+
+from library.domain.model import Publisher, Author, Book, make_author_association, make_publisher_association
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+
+def make_books(number_of_books: int):
+    publishers = [Publisher(f'Publisher {number}') for number in range(number_of_books // 100 + 1)]
+    authors = [Author(number, f'Author {number}') for number in range(number_of_books // 10 + 1)]
+
+    books = []
+    for book_id in range(number_of_books):
+        book = Book(book_id, f'Book title {book_id}')
+        book.description = f'Description of book {book_id}'
+        book.release_year = 1950 + book_id % 70
+        book.num_pages = 20 + book_id % 300
+        book.image_url = f'https://images.example.com/{book_id}.jpg'
+        make_publisher_association(book, publishers[book_id // 100])
+        make_author_association(book, authors[book_id // 10])
+        books.append(book)
+    return books, authors, publishers
+
+
+def bytes_per_book(number_of_books: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        catalog = make_books(number_of_books)
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del catalog
+    return allocated / number_of_books
+
+
+def main(sizes):
+    print(f'{"books":>10}  {"bytes per book":>14}')
+    for number_of_books in sizes:
+        print(f'{number_of_books:>10}  {bytes_per_book(number_of_books):>14.1f}')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
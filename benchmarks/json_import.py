@@ -0,0 +1,75 @@
+""" Measures how the time taken by BooksJSONReader.read_json_files grows with the size of the data files.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.json_import [number of books ...]
+
+Synthetic books and authors files are written to a temporary directory. There is one author for every two books
+and each book has one to three authors, as in the data files. The time per book stays constant when reading
+scales linearly.
+"""
+
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from library.adapters.json_data_reader import BooksJSONReader
+
+DEFAULT_SIZES = (25_000, 50_000, 100_000, 200_000)
+
+
+def write_data_files(directory: Path, number_of_books: int):
+    rng = random.Random(number_of_books)
+    number_of_authors = number_of_books // 2 + 1
+
+    authors_path = directory / 'authors.json'
+    with open(authors_path, 'w', encoding='UTF-8') as authors_file:
+        for author_id in range(number_of_authors):
+            authors_file.write(json.dumps({'author_id': str(author_id), 'name': f'Author {author_id}'}) + '\n')
+
+    books_path = directory / 'books.json'
+    with open(books_path, 'w', encoding='UTF-8') as books_file:
+        for book_id in range(number_of_books):
+            authors = [{'author_id': str(author_id), 'role': ''}
+                       for author_id in rng.sample(range(number_of_authors), rng.randint(1, 3))]
+            books_file.write(json.dumps({
+                'book_id': str(book_id),
+                'title': f'Book title {book_id}',
+                'description': f'Description of book {book_id}',
+                'publisher': f'Publisher {book_id % 1000}',
+                'publication_year': str(1950 + book_id % 70),
+                'is_ebook': 'false',
+                'num_pages': str(20 + book_id % 300),
+                'image_url': f'https://images.example.com/{book_id}.jpg',
+                'authors': authors
+            }) + '\n')
+
+    return books_path, authors_path
+
+
+def seconds_to_read(number_of_books: int, repeat: int = 3) -> float:
+    """ Returns the fastest of repeat reads, which is the least affected by other activity on the machine """
+    with tempfile.TemporaryDirectory() as directory:
+        books_path, authors_path = write_data_files(Path(directory), number_of_books)
+        timings = []
+        for _ in range(repeat):
+            reader = BooksJSONReader(str(books_path), str(authors_path))
+            start = time.perf_counter()
+            reader.read_json_files()
+            timings.append(time.perf_counter() - start)
+            del reader
+        return min(timings)
+
+
+def main(sizes):
+    print(f'{"books":>10}  {"seconds":>8}  {"us per book":>11}')
+    for number_of_books in sizes:
+        seconds = seconds_to_read(number_of_books)
+        print(f'{number_of_books:>10}  {seconds:>8.2f}  {seconds / number_of_books * 1e6:>11.1f}')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
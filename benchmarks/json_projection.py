@@ -0,0 +1,56 @@
+""" Compares decoding whole lines of the books file with decoding only the fields read into Books.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.json_projection [books file]
+
+By default the books file in tests/data is used, whose lines have every field of the Goodreads data, including
+the popular_shelves and similar_books lists which are never read. For each decoder the time per line is the
+fastest of several passes over the file, and the memory is the size of the objects allocated while decoding it.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from library.adapters.json_data_reader import FieldProjection, BOOK_FIELDS
+from utils import get_project_root
+
+DEFAULT_BOOKS_FILE = get_project_root() / 'tests' / 'data' / 'comic_books_excerpt.json'
+
+
+def microseconds_per_line(decode, lines, repeat: int = 20) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            decode(line)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(lines) * 1e6
+
+
+def bytes_allocated_per_line(decode, lines) -> float:
+    tracemalloc.start()
+    try:
+        decoded = [decode(line) for line in lines]
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del decoded
+    return allocated / len(lines)
+
+
+def main(books_file_name):
+    with open(books_file_name, encoding='UTF-8') as books_file:
+        lines = books_file.readlines()
+
+    print(f'{len(lines)} lines of {sum(map(len, lines)) / len(lines):.0f} characters on average')
+    print(f'{"decoder":>16}  {"us per line":>11}  {"bytes per line":>14}')
+    for name, decode in [('json.loads', json.loads), ('FieldProjection', FieldProjection(BOOK_FIELDS))]:
+        print(f'{name:>16}  {microseconds_per_line(decode, lines):>11.1f}  '
+              f'{bytes_allocated_per_line(decode, lines):>14.0f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BOOKS_FILE)
@@ -0,0 +1,54 @@
+""" Measures the speedup of reading the books file with several worker processes.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.parallel_import [number of books] [worker counts ...]
+
+A synthetic books file is written to a temporary directory, as in the json_import benchmark, and read with
+BooksJSONReader.read_book_batches using each number of workers (by default 1 up to the number of cores). The
+speedup per core is the speedup over one worker divided by the number of workers.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.json_import import write_data_files
+from library.adapters.json_data_reader import BooksJSONReader, garbage_collection_paused
+
+DEFAULT_NUMBER_OF_BOOKS = 200_000
+
+
+def seconds_to_read(reader: BooksJSONReader, workers: int, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with garbage_collection_paused():
+            books = [book for batch in reader.read_book_batches(workers=workers) for book in batch]
+        timings.append(time.perf_counter() - start)
+        del books
+    return min(timings)
+
+
+def main(number_of_books: int, worker_counts):
+    with tempfile.TemporaryDirectory() as directory:
+        books_path, authors_path = write_data_files(Path(directory), number_of_books)
+        reader = BooksJSONReader(str(books_path), str(authors_path))
+
+        print(f'{number_of_books} books, {os.cpu_count()} cores')
+        print(f'{"workers":>7}  {"seconds":>8}  {"speedup":>7}  {"per core":>8}')
+        serial_seconds = None
+        for workers in worker_counts:
+            seconds = seconds_to_read(reader, workers)
+            if serial_seconds is None:
+                serial_seconds = seconds if workers == 1 else seconds_to_read(reader, 1)
+            speedup = serial_seconds / seconds
+            print(f'{workers:>7}  {seconds:>8.2f}  {speedup:>7.2f}  {speedup / workers:>8.2f}')
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    main(arguments[0] if len(arguments) > 0 else DEFAULT_NUMBER_OF_BOOKS,
+         arguments[1:] or range(1, (os.cpu_count() or 1) + 1))
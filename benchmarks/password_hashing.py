@@ -0,0 +1,56 @@
+""" Measures the time taken to load users, hashing their passwords in one process, in a process pool, and from a cache.
+
+Run from the project directory with:
+
+    $ python -m benchmarks.password_hashing [number of users] [number of processes]
+
+A synthetic users file of 200 users (by default) is written to a temporary directory and loaded into a
+MemoryRepository with load_users: hashing every password in this process, in a pool of one process per core (by
+default), and then taking every hash from a PasswordHashCache filled by an earlier load.
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from library.adapters.json_data_importer import load_users
+from library.adapters.memory_repository import MemoryRepository
+from library.adapters.password_hashes import PasswordHashCache
+
+DEFAULT_NUMBER_OF_USERS = 200
+
+
+def seconds_to_load(data_path: Path, workers: int = 1, password_hashes: PasswordHashCache = None) -> float:
+    start = time.perf_counter()
+    load_users(data_path, MemoryRepository(), workers, password_hashes)
+    return time.perf_counter() - start
+
+
+def main(number_of_users: int, workers: int):
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = Path(directory)
+        with open(data_path / 'users.csv', 'w', newline='') as users_file:
+            writer = csv.writer(users_file)
+            writer.writerow(['id', 'username', 'password'])
+            writer.writerows([user_id, f'user{user_id}', f'password{user_id}'] for user_id in range(number_of_users))
+
+        cache_path = data_path / 'password_hashes.csv'
+        seconds_to_load(data_path, workers, PasswordHashCache(cache_path, 'secret key'))
+
+        print(f'{number_of_users} users, {os.cpu_count()} cores')
+        print(f'{"passwords":>28}  {"seconds":>8}  {"ms per user":>11}')
+        for name, seconds in [
+            ('hashed by this process', seconds_to_load(data_path)),
+            (f'hashed by a pool of {workers}', seconds_to_load(data_path, workers)),
+            ('cached', seconds_to_load(data_path, password_hashes=PasswordHashCache(cache_path, 'secret key')))
+        ]:
+            print(f'{name:>28}  {seconds:>8.2f}  {seconds / number_of_users * 1e3:>11.2f}')
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    main(arguments[0] if len(arguments) > 0 else DEFAULT_NUMBER_OF_USERS,
+         arguments[1] if len(arguments) > 1 else os.cpu_count() or 1)
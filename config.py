@@ -10,7 +10,27 @@ class Config:
     SECRET_KEY = environ.get('SECRET_KEY')
     TESTING = environ.get('TESTING')
     REPOSITORY = environ.get('REPOSITORY')
+    # Optional path of a binary snapshot used to warm-start the memory repository
+    MEMORY_SNAPSHOT = environ.get('MEMORY_SNAPSHOT')
+    # Optional path of a catalog file which is shared by every worker process using the memory repository
+    SHARED_CATALOG = environ.get('SHARED_CATALOG')
+    # Optional path of a catalog file compiled from the data files with `flask compile-catalog`, which repositories
+    # are populated from instead of the data files while it is newer than them
+    COMPILED_CATALOG = environ.get('COMPILED_CATALOG')
+    # Optional path of a write-ahead log which keeps the memory repository's users, reviews and favourites
+    MEMORY_LOG = environ.get('MEMORY_LOG')
+    # Number of processes which parse the books file when populating a repository, 1 parses it in this process
+    IMPORT_WORKERS = int(environ.get('IMPORT_WORKERS') or 1)
+    # Optional path of a file of the password hashes computed for the users in the data files, reused at each start
+    PASSWORD_HASH_CACHE = environ.get('PASSWORD_HASH_CACHE')
+    # Whether the repository is loaded in a background thread, so the application accepts requests while it loads
+    BACKGROUND_WARMUP = (environ.get('BACKGROUND_WARMUP') or '').lower().strip() == 'true'
     # Database configuration
+    # Whether an existing database is brought up to date with the data files, writing only the books which changed
+    INCREMENTAL_IMPORT = (environ.get('INCREMENTAL_IMPORT') or '').lower().strip() == 'true'
+    # Whether the database is populated in batches which are committed with a checkpoint, so an import which
+    # stops part way through is resumed from its last checkpoint rather than started again
+    RESUMABLE_IMPORT = (environ.get('RESUMABLE_IMPORT') or '').lower().strip() == 'true'
     SQLALCHEMY_DATABASE_URI = environ.get('SQLALCHEMY_DATABASE_URI')
 
     echo_string = environ.get('SQLALCHEMY_ECHO')
@@ -1,6 +1,10 @@
 """Initialize Flask app"""
 
+import atexit
+import time
 from pathlib import Path
+
+import click
 from flask import Flask
 
 from sqlalchemy import create_engine
@@ -8,8 +12,17 @@ from sqlalchemy.orm import sessionmaker, clear_mappers
 from sqlalchemy.pool import NullPool
 
 import library.adapters.repository as repo
-from library.adapters import memory_repository, database_repository, repository_populate
+from library.adapters import memory_repository, database_repository, repository_populate, memory_snapshot, \
+    shared_catalog_repository
+from library.adapters.database_import import import_changed_books, import_in_progress, populate_resumably, \
+    add_rating_aggregate_columns
+from library.adapters.file_lock import hold_file_lock
+from library.adapters.json_data_importer import load_users, load_reviews, write_hashed_users_file
 from library.adapters.orm import metadata, map_model_to_tables
+from library.adapters.password_hashes import PasswordHashCache
+from library.adapters.shared_catalog import catalog_is_current
+from library.adapters.write_ahead_log import WriteAheadLog, WriteAheadLogInUseException
+from library.health.health import RepositoryWarmup
 
 
 def create_app(test_config=None):
@@ -25,42 +38,176 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config)
         data_path = app.config['TEST_DATA_PATH']
 
-    if app.config['REPOSITORY'] == 'memory':
-        # Create the MemoryRepository implementation for a memory-based repository
-        repo.repo_instance = memory_repository.MemoryRepository()
-        database_mode = False
-        repository_populate.populate(data_path, repo.repo_instance, database_mode)
-
-    elif app.config['REPOSITORY'] == 'database':
-        # Configure database
-        database_uri = app.config['SQLALCHEMY_DATABASE_URI']
-        database_echo = app.config['SQLALCHEMY_ECHO']
-        database_engine = create_engine(database_uri, connect_args={"check_same_thread": False}, poolclass=NullPool,
-                                        echo=database_echo)
-        session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
-        repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
-
-        if app.config['TESTING'] == 'True' or len(database_engine.table_names()) == 0:
-            print("REPOPULATING DATABASE...")
-            # For testing, or first-time use of the web application, reinitialise the database
-            clear_mappers()
-            metadata.create_all(database_engine)  # Conditionally create database tables
-            for table in reversed(metadata.sorted_tables):  # Remove any data from the tables
-                database_engine.execute(table.delete())
-
-            # Generate mappings that map domain model classes to the database tables
-            map_model_to_tables()
-
-            database_mode = True
-            repository_populate.populate(data_path, repo.repo_instance, database_mode)
-            print("REPOPULATING DATABASE... FINISHED")
-
-        else:
-            # Solely generate mappings that map domain model classes to the database tables
-            map_model_to_tables()
+    # Number of processes which parse the books file when a repository is populated
+    import_workers = app.config.get('IMPORT_WORKERS', 1)
+
+    # Password hashes of the users in the data files computed by earlier starts, so they are not computed again
+    password_hashes = None
+    if app.config.get('PASSWORD_HASH_CACHE'):
+        password_hashes = PasswordHashCache(app.config['PASSWORD_HASH_CACHE'], app.config['SECRET_KEY'])
+
+    # Repositories are populated from a catalog compiled from the data files, while it is newer than all of them and
+    # in the current format
+    compiled_catalog = app.config.get('COMPILED_CATALOG')
+    if compiled_catalog and not catalog_is_current(compiled_catalog, data_path):
+        compiled_catalog = None
+
+    def open_memory_log():
+        # The write-ahead log of MEMORY_LOG, or None if it isn't set or another worker process writes the log
+        if not app.config.get('MEMORY_LOG'):
+            return None
+        try:
+            return WriteAheadLog(app.config['MEMORY_LOG'])
+        except WriteAheadLogInUseException:
+            # Only one process can write the log, the others run without it and leave its snapshot alone
+            app.logger.warning(f"{app.config['MEMORY_LOG']} is in use by another process, so the users, reviews "
+                               f"and favourites added through this process won't be kept. MEMORY_LOG needs a "
+                               f"single worker process")
+            return None
+
+    def load_repository():
+        # The repository is only published once it is loaded, so requests served while it loads in the background
+        # never see one which is partly loaded, or whose ORM mappings are being replaced
+        repository = repo.repo_instance
+        if app.config['REPOSITORY'] == 'memory' and app.config.get('SHARED_CATALOG'):
+            catalog_path = app.config['SHARED_CATALOG']
+            if not catalog_is_current(catalog_path, data_path):
+                # Build the catalog file from the data files, every worker then maps the same file
+                shared_catalog_repository.compile_shared_catalog(data_path, catalog_path, import_workers)
+
+            # Users and reviews are private to each process, so they are loaded on top of the shared catalog
+            repository = shared_catalog_repository.SharedCatalogRepository(catalog_path)
+            with repository.batch():
+                users = load_users(data_path, repository, import_workers, password_hashes)
+                load_reviews(data_path, repository, users)
+
+            log = open_memory_log()
+            if log is not None:
+                # Replay the users, reviews and favourites added since the data files were loaded, and log new ones
+                repository.replay_log(log)
+                atexit.register(log.close)
+
+        elif app.config['REPOSITORY'] == 'memory':
+            # Create the MemoryRepository implementation for a memory-based repository
+            repository = memory_repository.MemoryRepository()
+            database_mode = False
+            snapshot_path = app.config.get('MEMORY_SNAPSHOT')
+            restored = False
+
+            if snapshot_path and memory_snapshot.snapshot_is_current(snapshot_path, data_path):
+                try:
+                    # Restore the repository from the snapshot rather than repopulating it from the data files
+                    repository.load_snapshot(snapshot_path)
+                    restored = True
+                except memory_snapshot.SnapshotException:
+                    # The snapshot can't be used, so it is replaced below
+                    pass
+
+            if not restored:
+                repository_populate.populate(data_path, repository, database_mode, import_workers,
+                                             compiled_catalog, password_hashes)
+
+            log = open_memory_log()
+            if log is not None:
+                # Replay the users, reviews and favourites added since the data files were loaded (those folded
+                # into the snapshot too, if it was not restored), and log new ones. The log is folded into the
+                # snapshot when compacted, and the snapshot is saved with the replayed changes if it was replaced
+                repository.replay_log(log, snapshot_path)
+                atexit.register(log.close)
+                if snapshot_path and not restored:
+                    repository.fold_log()
+            elif snapshot_path and not app.config.get('MEMORY_LOG'):
+                if not restored:
+                    repository.save_snapshot(snapshot_path)
+                if hold_file_lock(f'{snapshot_path}.lock'):
+                    # Save again on exit so new users, reviews and favourites are kept. Each worker process has its
+                    # own repository, so only the first to start saves on exit rather than each replacing the
+                    # others' snapshot
+                    atexit.register(repository.save_snapshot, snapshot_path)
+
+        if app.config['REPOSITORY'] == 'database':
+            # Configure database
+            database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+            database_echo = app.config['SQLALCHEMY_ECHO']
+            database_engine = create_engine(database_uri, connect_args={"check_same_thread": False}, poolclass=NullPool,
+                                            echo=database_echo)
+            session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
+            repository = database_repository.SqlAlchemyRepository(session_factory)
+            # Databases created before Books' rating aggregates were stored get their columns before they are read
+            add_rating_aggregate_columns(database_engine)
+
+            if app.config.get('RESUMABLE_IMPORT') and (app.config['TESTING'] == 'True'
+                                                       or len(database_engine.table_names()) == 0
+                                                       or import_in_progress(database_engine)):
+                print("REPOPULATING DATABASE...")
+                # Resumes an import which was stopped, otherwise clears the tables and imports from the beginning
+                clear_mappers()
+                populate_resumably(data_path, database_engine, workers=import_workers, password_hashes=password_hashes)
+                map_model_to_tables()
+                print("REPOPULATING DATABASE... FINISHED")
+
+            elif app.config['TESTING'] == 'True' or len(database_engine.table_names()) == 0:
+                print("REPOPULATING DATABASE...")
+                # For testing, or first-time use of the web application, reinitialise the database
+                clear_mappers()
+                metadata.create_all(database_engine)  # Conditionally create database tables
+                for table in reversed(metadata.sorted_tables):  # Remove any data from the tables
+                    database_engine.execute(table.delete())
+
+                # Generate mappings that map domain model classes to the database tables
+                map_model_to_tables()
+
+                database_mode = True
+                repository_populate.populate(data_path, repository, database_mode, import_workers,
+                                             compiled_catalog, password_hashes)
+                print("REPOPULATING DATABASE... FINISHED")
+
+            elif app.config.get('INCREMENTAL_IMPORT'):
+                print("IMPORTING CHANGED BOOKS...")
+                # Create any tables added since the database was created, then write the books which have changed
+                metadata.create_all(database_engine)
+                map_model_to_tables()
+                summary = import_changed_books(data_path, database_engine, import_workers)
+                print(f"IMPORTING CHANGED BOOKS... FINISHED ({summary.new_books} new, {summary.changed_books} changed, "
+                      f"{summary.unchanged_books} unchanged)")
+
+            else:
+                # Solely generate mappings that map domain model classes to the database tables
+                map_model_to_tables()
+
+        repo.repo_instance = repository
+
+    if app.config.get('BACKGROUND_WARMUP'):
+        # Accept requests right away and load the repository in a background thread, the repository's routes
+        # answer 503 Service Unavailable until it is loaded
+        repo.repo_instance = None
+        app.extensions['repository_warmup'] = RepositoryWarmup(load_repository)
+        app.extensions['repository_warmup'].start()
+    else:
+        load_repository()
+
+    @app.cli.command('compile-catalog')
+    @click.argument('catalog_path', type=click.Path(dir_okay=False))
+    def compile_catalog(catalog_path):
+        """Compile the books, authors and publishers in the data files into a binary catalog file."""
+        start = time.perf_counter()
+        shared_catalog_repository.compile_shared_catalog(data_path, catalog_path, import_workers)
+        click.echo(f'Compiled {catalog_path} in {time.perf_counter() - start:.1f}s')
+
+    @app.cli.command('hash-users')
+    @click.argument('users_path', type=click.Path(dir_okay=False))
+    def hash_users(users_path):
+        """Write the users in the data files to a users file whose passwords are hashed."""
+        start = time.perf_counter()
+        write_hashed_users_file(data_path, users_path, import_workers, password_hashes)
+        click.echo(f'Hashed the passwords in {users_path} in {time.perf_counter() - start:.1f}s')
 
     with app.app_context():
         # Register blueprints
+        from .health import health
+        app.register_blueprint(health.health_blueprint)
+        app.before_request(health.unavailable_until_ready)
+
         from .home import home
         app.register_blueprint(home.home_blueprint)
 
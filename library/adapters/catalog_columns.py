@@ -0,0 +1,123 @@
+import array
+from typing import Iterable, List
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, without it the columns are stored in array.array buffers and filtered in Python
+    numpy = None
+
+from library.domain.model import Book
+
+# Stored in place of None for release_year, num_pages and ebook
+MISSING = -1
+
+
+class CatalogColumns:
+    """ Column-oriented copy of the numeric fields of a set of Books.
+
+    Each field is stored in its own array, with one row per Book in the order the Books were given, so
+    filters work on whole columns at once rather than on each Book object.
+    """
+
+    def __init__(self, books: Iterable[Book] = ()):
+        self.__rows = dict()
+        self.__publisher_codes = dict()
+
+        book_ids, release_years, num_pages, ebooks, publishers = [], [], [], [], []
+        for row, book in enumerate(books):
+            self.__rows[book.book_id] = row
+            book_ids.append(book.book_id)
+            release_years.append(MISSING if book.release_year is None else book.release_year)
+            num_pages.append(MISSING if book.num_pages is None else book.num_pages)
+            ebooks.append(MISSING if book.ebook is None else int(book.ebook))
+            publisher_name = None if book.publisher is None else book.publisher.name
+            publishers.append(self.__publisher_codes.setdefault(publisher_name, len(self.__publisher_codes)))
+
+        self.__book_id = self.__column('q', book_ids)
+        self.__release_year = self.__column('l', release_years)
+        self.__num_pages = self.__column('l', num_pages)
+        self.__ebook = self.__column('b', ebooks)
+        self.__publisher = self.__column('l', publishers)
+
+    @classmethod
+    def from_buffers(cls, rows, book_ids, release_years, num_pages, ebooks, publishers, publisher_codes) \
+            -> 'CatalogColumns':
+        """ Wraps columns which are already stored in buffers, such as those of a SharedCatalog, without copying.
+
+        rows maps each book id to its row, and publisher_codes maps each publisher name to the code stored for it
+        in publishers.
+        """
+        columns = cls()
+        columns.__rows = rows
+        columns.__publisher_codes = publisher_codes
+        columns.__book_id = cls.__wrap(book_ids)
+        columns.__release_year = cls.__wrap(release_years)
+        columns.__num_pages = cls.__wrap(num_pages)
+        columns.__ebook = cls.__wrap(ebooks)
+        columns.__publisher = cls.__wrap(publishers)
+        return columns
+
+    @staticmethod
+    def __column(typecode: str, values: list):
+        if numpy is not None:
+            return numpy.array(values, dtype={'q': numpy.int64, 'l': numpy.int32, 'b': numpy.int8}[typecode])
+        return array.array(typecode, values)
+
+    @staticmethod
+    def __wrap(buffer: memoryview):
+        if numpy is not None:
+            return numpy.frombuffer(buffer, dtype=buffer.format)
+        return buffer
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def __contains__(self, book_id):
+        return book_id in self.__rows
+
+    def __select_rows(self, book_ids):
+        if book_ids is None:
+            return range(len(self.__rows))
+        # Rows follow the order the Books were given in, so sorting them keeps that order
+        return sorted({self.__rows[book_id] for book_id in book_ids if book_id in self.__rows})
+
+    def filter(self, book_ids=None, year=None, publisher_names=None, min_pages=None, max_pages=None, ebook=None) \
+            -> List[int]:
+        """ Returns the ids of Books which match every filter that is not None """
+        rows = self.__select_rows(book_ids)
+        publisher_codes = None
+        if publisher_names is not None:
+            publisher_codes = [self.__publisher_codes[name] for name in publisher_names
+                               if name in self.__publisher_codes]
+
+        if numpy is not None:
+            rows = numpy.asarray(rows, dtype=numpy.int64)
+            mask = numpy.ones(len(rows), dtype=bool)
+            if year is not None:
+                mask &= self.__release_year[rows] == year
+            if publisher_codes is not None:
+                mask &= numpy.isin(self.__publisher[rows], publisher_codes)
+            if min_pages is not None or max_pages is not None:
+                pages = self.__num_pages[rows]
+                mask &= pages != MISSING
+                if min_pages is not None:
+                    mask &= pages >= min_pages
+                if max_pages is not None:
+                    mask &= pages <= max_pages
+            if ebook is not None:
+                mask &= self.__ebook[rows] == int(ebook)
+            return self.__book_id[rows[mask]].tolist()
+
+        if publisher_codes is not None:
+            publisher_codes = set(publisher_codes)
+        matching_ids = []
+        for row in rows:
+            pages = self.__num_pages[row]
+            if ((year is None or self.__release_year[row] == year)
+                    and (publisher_codes is None or self.__publisher[row] in publisher_codes)
+                    and (min_pages is None or (pages != MISSING and pages >= min_pages))
+                    and (max_pages is None or (pages != MISSING and pages <= max_pages))
+                    and (ebook is None or self.__ebook[row] == int(ebook))):
+                matching_ids.append(self.__book_id[row])
+        return matching_ids
@@ -0,0 +1,89 @@
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+
+class CoauthorGraph:
+    """ Graph of the authors who have written a book together, stored as compressed sparse row (CSR) arrays.
+
+    author_ids holds every author id in ascending order. The coauthors of the author at position i are stored in
+    coauthors[offsets[i]:offsets[i + 1]] as positions in author_ids, so they are also in ascending id order. The
+    graph never changes once built, so the results of related-author searches are cached.
+    """
+
+    # Number of related-author searches whose results are kept
+    CACHE_SIZE = 1024
+
+    def __init__(self, author_ids_of_books: Iterable[Iterable[int]]):
+        # Single pass over the books, collecting the distinct coauthors of each author
+        adjacency = dict()
+        for author_ids in author_ids_of_books:
+            author_ids = set(author_ids)
+            for author_id in author_ids:
+                adjacency.setdefault(author_id, set()).update(author_ids)
+
+        self.__author_ids = array('q', sorted(adjacency))
+        positions = {author_id: position for position, author_id in enumerate(self.__author_ids)}
+
+        self.__offsets = array('q', [0])
+        self.__coauthors = array('q')
+        for author_id in self.__author_ids:
+            neighbours = adjacency.pop(author_id)
+            neighbours.discard(author_id)
+            self.__coauthors.extend(sorted(positions[neighbour] for neighbour in neighbours))
+            self.__offsets.append(len(self.__coauthors))
+
+        self.__related = lru_cache(maxsize=self.CACHE_SIZE)(self.__search)
+
+    def __position(self, author_id: int):
+        position = bisect_left(self.__author_ids, author_id)
+        if position < len(self.__author_ids) and self.__author_ids[position] == author_id:
+            return position
+        return None
+
+    def __len__(self):
+        return len(self.__author_ids)
+
+    def coauthor_ids(self, author_id: int) -> List[int]:
+        """ Returns the ids of the authors who have written a book with the given author, in ascending order """
+        position = self.__position(author_id)
+        if position is None:
+            return []
+        author_ids = self.__author_ids
+        return [author_ids[neighbour]
+                for neighbour in self.__coauthors[self.__offsets[position]:self.__offsets[position + 1]]]
+
+    def related_author_ids(self, author_id: int, max_depth: int = 2) -> List[int]:
+        """ Returns the ids of the authors at most max_depth coauthorships away from the given author.
+
+        The nearest authors come first, and authors at the same distance are in ascending id order.
+        """
+        if max_depth < 1:
+            return []
+        return list(self.__related(author_id, max_depth))
+
+    def __search(self, author_id: int, max_depth: int) -> Tuple[int, ...]:
+        # Breadth-first search, one level of the graph at a time
+        start = self.__position(author_id)
+        if start is None:
+            return ()
+
+        offsets = self.__offsets
+        coauthors = self.__coauthors
+        seen = {start}
+        level = [start]
+        related = []
+        for _ in range(max_depth):
+            next_level = set()
+            for position in level:
+                next_level.update(coauthors[offsets[position]:offsets[position + 1]])
+            next_level.difference_update(seen)
+            if len(next_level) == 0:
+                break
+            seen.update(next_level)
+            level = sorted(next_level)
+            related.extend(level)
+
+        author_ids = self.__author_ids
+        return tuple(author_ids[position] for position in related)
@@ -0,0 +1,417 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+from sqlalchemy import select, bindparam, inspect, func, text
+from sqlalchemy.engine import Connection, Engine
+
+from library.adapters.json_data_importer import publisher_name_or_default, author_record, read_csv_file, \
+    user_password_hashes
+from library.adapters.json_data_reader import BooksJSONReader, BOOK_FIELDS, BATCH_SIZE, garbage_collection_paused
+from library.adapters.orm import metadata, books_table, authors_table, publishers_table, book_authors_table, \
+    book_content_hashes_table, import_checkpoints_table, users_table, reviews_table
+from library.adapters.password_hashes import PasswordHashCache
+from library.adapters.shared_catalog import SharedCatalog
+from library.domain.model import User, Review
+
+# Stages of a resumable import, in the order they are run
+STAGES = ('books', 'users', 'reviews', 'finished')
+
+# Largest number of values in an IN clause, which older versions of SQLite limit to 999
+MAX_IN_VALUES = 500
+
+
+class ImportSummary(NamedTuple):
+    new_books: int
+    changed_books: int
+    unchanged_books: int
+
+
+def content_hash(book_record: tuple, publisher_name: str, author_records: list) -> str:
+    """ Returns a hash of everything stored about a Book when it is imported """
+    content = json.dumps([book_record, publisher_name, author_records], ensure_ascii=False)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def books_reader(data_path: Path) -> BooksJSONReader:
+    # Only the fields which are stored are decoded
+    return BooksJSONReader(str(data_path / "comic_books_excerpt.json"), str(data_path / "book_authors_excerpt.json"),
+                           fields=BOOK_FIELDS)
+
+
+class CatalogWriter:
+    """ Writes batches of books read by BooksJSONReader to the database, skipping the ones which haven't changed.
+
+    The content hash of each Book is compared with the one recorded when it was last written, and only new or
+    changed Books are written, together with their new or renamed Authors and new Publishers. Users, reviews,
+    favourites and the rating aggregates of Books are left untouched.
+    """
+
+    def __init__(self, connection: Connection):
+        self.__book_ids = {row[0] for row in connection.execute(select([books_table.c.id]))}
+        self.__hashes = dict(connection.execute(select([book_content_hashes_table.c.book_id,
+                                                        book_content_hashes_table.c.content_hash])).fetchall())
+        self.__publisher_names = {row[0] for row in connection.execute(select([publishers_table.c.name]))}
+        self.__author_names = dict(connection.execute(select([authors_table.c.id,
+                                                              authors_table.c.full_name])).fetchall())
+        # Id of the last Author written
+        self.last_author_id = None
+
+    def write_batch(self, connection: Connection, batch: List[tuple]) -> ImportSummary:
+        # Keyed by book id, a later Book in the file replaces an earlier one as it would in the repository
+        books = dict()
+        new_publishers = []
+        new_authors = []
+        renamed_authors = []
+        unchanged_books = 0
+
+        for book, publisher_name, authors in batch:
+            book_record = (book.book_id, book.title, book.description, book.release_year, book.ebook,
+                           book.num_pages, book.image_url)
+            publisher_name = publisher_name_or_default(publisher_name)
+            author_records = [author_record(author_id, author_name) for author_id, author_name in authors]
+            book_hash = content_hash(book_record, publisher_name, author_records)
+            if self.__hashes.get(book.book_id) == book_hash and book.book_id not in books:
+                unchanged_books += 1
+                continue
+
+            if publisher_name not in self.__publisher_names:
+                self.__publisher_names.add(publisher_name)
+                new_publishers.append({'name': publisher_name})
+            for author_id, author_name in author_records:
+                stored_name = self.__author_names.get(author_id)
+                if stored_name is None:
+                    new_authors.append({'id': author_id, 'full_name': author_name})
+                    self.last_author_id = author_id
+                elif stored_name != author_name:
+                    renamed_authors.append({'author_id': author_id, 'full_name': author_name})
+                    self.last_author_id = author_id
+                self.__author_names[author_id] = author_name
+
+            is_new = books[book.book_id][1] if book.book_id in books else book.book_id not in self.__book_ids
+            books[book.book_id] = (book_record, is_new, publisher_name, author_records, book_hash)
+            self.__book_ids.add(book.book_id)
+
+        book_rows = {True: [], False: []}
+        book_author_rows = []
+        new_hash_rows = []
+        changed_hash_rows = []
+        for book_id, (book_record, is_new, publisher_name, author_records, book_hash) in books.items():
+            _, title, description, release_year, ebook, num_pages, image_url = book_record
+            # New Books are inserted with their id, changed ones are updated where their id is book_id
+            book_rows[is_new].append({'id' if is_new else 'book_id': book_id, 'title': title,
+                                      'description': description, 'publisher_name': publisher_name,
+                                      'release_year': release_year, 'ebook': ebook, 'num_pages': num_pages,
+                                      'image_url': image_url})
+            book_author_rows.extend({'book_id': book_id, 'author_id': author_id} for author_id, _ in author_records)
+            if book_id in self.__hashes:
+                changed_hash_rows.append({'hashed_book_id': book_id, 'content_hash': book_hash})
+            else:
+                new_hash_rows.append({'book_id': book_id, 'content_hash': book_hash})
+            self.__hashes[book_id] = book_hash
+
+        if len(new_publishers) > 0:
+            connection.execute(publishers_table.insert(), new_publishers)
+        if len(new_authors) > 0:
+            connection.execute(authors_table.insert(), new_authors)
+        if len(renamed_authors) > 0:
+            connection.execute(authors_table.update().where(authors_table.c.id == bindparam('author_id')),
+                               renamed_authors)
+        if len(book_rows[True]) > 0:
+            connection.execute(books_table.insert(), book_rows[True])
+        if len(book_rows[False]) > 0:
+            # Books keep their rating aggregates, which are only changed by reviews
+            connection.execute(books_table.update().where(books_table.c.id == bindparam('book_id')), book_rows[False])
+            connection.execute(book_authors_table.delete().where(book_authors_table.c.book_id == bindparam('book_id')),
+                               [{'book_id': row['book_id']} for row in book_rows[False]])
+        if len(book_author_rows) > 0:
+            connection.execute(book_authors_table.insert(), book_author_rows)
+        if len(new_hash_rows) > 0:
+            connection.execute(book_content_hashes_table.insert(), new_hash_rows)
+        if len(changed_hash_rows) > 0:
+            connection.execute(book_content_hashes_table.update()
+                               .where(book_content_hashes_table.c.book_id == bindparam('hashed_book_id')),
+                               changed_hash_rows)
+
+        return ImportSummary(len(book_rows[True]), len(book_rows[False]), unchanged_books)
+
+
+def add_rating_aggregate_columns(engine: Engine):
+    """ Adds the rating aggregate columns to a books table created before they were, computing them from the
+    reviews. Does nothing if there is no books table or it has the columns already. """
+    inspector = inspect(engine)
+    if not inspector.has_table(books_table.name):
+        return
+    existing_columns = {column['name'] for column in inspector.get_columns(books_table.name)}
+    missing_columns = [column for column in
+                       [books_table.c.rating_count, books_table.c.rating_total, books_table.c.rating_histogram]
+                       if column.name not in existing_columns]
+    if len(missing_columns) == 0:
+        return
+
+    with engine.begin() as connection:
+        for column in missing_columns:
+            connection.execute(text(f"ALTER TABLE {books_table.name} ADD COLUMN {column.name} "
+                                    f"{column.type.compile(dialect=engine.dialect)} NOT NULL "
+                                    f"DEFAULT '{column.server_default.arg}'"))
+
+        ratings = dict()
+        for book_id, rating, count in connection.execute(
+                select([reviews_table.c.book_id, reviews_table.c.rating, func.count()])
+                .group_by(reviews_table.c.book_id, reviews_table.c.rating)):
+            book_ratings = ratings.setdefault(book_id, [0, 0, [0, 0, 0, 0, 0]])
+            book_ratings[0] += count
+            book_ratings[1] += rating * count
+            book_ratings[2][rating - 1] += count
+
+        if len(ratings) > 0:
+            connection.execute(books_table.update().where(books_table.c.id == bindparam('book_id')), [
+                {'book_id': book_id, 'rating_count': count, 'rating_total': total,
+                 'rating_histogram': tuple(histogram)}
+                for book_id, (count, total, histogram) in ratings.items()])
+
+
+def import_changed_books(data_path: Path, engine: Engine, workers: int = 1, batch_size: int = BATCH_SIZE) \
+        -> ImportSummary:
+    """ Brings the books, authors and publishers in the database up to date with the data files.
+
+    Only new or changed Books are written, see CatalogWriter, and each batch of Books is written in its own
+    transaction. Books which are no longer in the books file are left in place. Books imported before their
+    hashes were recorded are all written once.
+
+    The database is written directly, so this should run before a SqlAlchemyRepository reads from it.
+    """
+    add_rating_aggregate_columns(engine)
+    with engine.connect() as connection:
+        writer = CatalogWriter(connection)
+
+    new_books = changed_books = unchanged_books = 0
+    with garbage_collection_paused():
+        for batch in books_reader(data_path).read_book_batches(batch_size, workers):
+            with engine.begin() as connection:
+                summary = writer.write_batch(connection, batch)
+            new_books += summary.new_books
+            changed_books += summary.changed_books
+            unchanged_books += summary.unchanged_books
+
+    return ImportSummary(new_books, changed_books, unchanged_books)
+
+
+def data_files_hash(data_path: Path) -> str:
+    """ Returns a hash of the size and modification time of each data file, which changes when any of them does """
+    file_names = ["comic_books_excerpt.json", "book_authors_excerpt.json", "users.csv", "reviews.csv"]
+    stats = [(Path(data_path) / file_name).stat() for file_name in file_names]
+    content = json.dumps([[file_name, stat.st_size, stat.st_mtime_ns] for file_name, stat in zip(file_names, stats)])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def read_checkpoint(engine: Engine):
+    """ Returns the checkpoint of the last import into the database, or None if there is none """
+    if not inspect(engine).has_table(import_checkpoints_table.name):
+        return None
+    with engine.connect() as connection:
+        return connection.execute(select([import_checkpoints_table])).fetchone()
+
+
+def import_in_progress(engine: Engine) -> bool:
+    """ Returns True if an import into the database was started and hasn't finished """
+    checkpoint = read_checkpoint(engine)
+    return checkpoint is not None and checkpoint['stage'] != 'finished'
+
+
+class ThroughputReport:
+    """ Reports how many rows a stage of an import has loaded, and how many it loads per second """
+
+    def __init__(self, stage: str, report: Callable[[str], None]):
+        self.__stage = stage
+        self.__report = report
+        self.__start = time.perf_counter()
+        self.__loaded = 0
+
+    def __call__(self, loaded: int, position: str = ''):
+        self.__loaded += loaded
+        seconds = max(time.perf_counter() - self.__start, 1e-9)
+        self.__report(f'{self.__stage}: {self.__loaded} loaded in {seconds:.1f}s ({self.__loaded / seconds:.0f}/s)'
+                      f'{position}')
+
+
+def populate_resumably(data_path: Path, engine: Engine, batch_size: int = BATCH_SIZE,
+                       report: Callable[[str], None] = print, workers: int = 1,
+                       password_hashes: PasswordHashCache = None):
+    """ Populates the database from the data files, committing each batch with a checkpoint of the progress made.
+
+    The books, users and reviews are loaded in turn. After each batch the checkpoint records the stage, the byte
+    offset in the books file up to which books have been loaded, the id of the last Author written and the number
+    of users and reviews loaded, in the same transaction as the batch. If the database has the checkpoint of an
+    unfinished import of the same data files, the import resumes from it. Otherwise every table is cleared and the
+    import starts from the beginning. The number of rows loaded per second is passed to report after each batch.
+    Passwords are hashed by that many processes, unless their hashes are in password_hashes.
+    """
+    metadata.create_all(engine)
+    source = data_files_hash(data_path)
+    checkpoint = read_checkpoint(engine)
+
+    if checkpoint is None or checkpoint['source'] != source or checkpoint['stage'] == 'finished':
+        with engine.begin() as connection:
+            for table in reversed(metadata.sorted_tables):
+                connection.execute(table.delete())
+            connection.execute(import_checkpoints_table.insert(), {
+                'id': 1, 'source': source, 'stage': STAGES[0], 'books_offset': 0, 'last_author_id': None,
+                'users_loaded': 0, 'reviews_loaded': 0})
+        checkpoint = read_checkpoint(engine)
+    else:
+        report(f'Resuming the import at the {checkpoint["stage"]} stage: books loaded up to byte '
+               f'{checkpoint["books_offset"]}, last author {checkpoint["last_author_id"]}, '
+               f'{checkpoint["users_loaded"]} users and {checkpoint["reviews_loaded"]} reviews loaded')
+
+    update_checkpoint = import_checkpoints_table.update().where(import_checkpoints_table.c.id == 1)
+    stage = checkpoint['stage']
+
+    if stage == 'books':
+        with engine.connect() as connection:
+            writer = CatalogWriter(connection)
+        writer.last_author_id = checkpoint['last_author_id']
+        reader = books_reader(data_path)
+        books_file_size = (data_path / "comic_books_excerpt.json").stat().st_size
+        throughput = ThroughputReport('books', report)
+        with garbage_collection_paused():
+            for offset, batch in reader.read_book_batches_from(checkpoint['books_offset'], batch_size):
+                with engine.begin() as connection:
+                    writer.write_batch(connection, batch)
+                    connection.execute(update_checkpoint.values(books_offset=offset,
+                                                                last_author_id=writer.last_author_id))
+                throughput(len(batch), f', {offset} of {books_file_size} bytes')
+        stage = advance_stage(engine, stage)
+
+    if stage == 'users':
+        load_user_rows(data_path, engine, checkpoint['users_loaded'], batch_size, ThroughputReport('users', report),
+                       workers, password_hashes)
+        stage = advance_stage(engine, stage)
+
+    if stage == 'reviews':
+        load_review_rows(data_path, engine, checkpoint['reviews_loaded'], batch_size,
+                         ThroughputReport('reviews', report))
+        advance_stage(engine, stage)
+
+
+def advance_stage(engine: Engine, stage: str) -> str:
+    next_stage = STAGES[STAGES.index(stage) + 1]
+    with engine.begin() as connection:
+        connection.execute(import_checkpoints_table.update().where(import_checkpoints_table.c.id == 1)
+                           .values(stage=next_stage))
+    return next_stage
+
+
+def read_csv_batches(file_name: Path, skip: int, batch_size: int):
+    """ Yields the rows of a CSV file after the first skip rows, in lists of at most batch_size rows """
+    batch = []
+    for row_number, row in enumerate(read_csv_file(str(file_name))):
+        if row_number < skip:
+            continue
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def load_user_rows(data_path: Path, engine: Engine, users_loaded: int, batch_size: int,
+                   throughput: ThroughputReport, workers: int = 1, password_hashes: PasswordHashCache = None):
+    update_checkpoint = import_checkpoints_table.update().where(import_checkpoints_table.c.id == 1)
+    users_filename = data_path / "users.csv"
+    for batch in read_csv_batches(users_filename, users_loaded, batch_size):
+        password_hashes_of_batch = user_password_hashes(str(users_filename), batch, workers, password_hashes)
+        with engine.begin() as connection:
+            insert_users(connection, batch, password_hashes_of_batch)
+            users_loaded += len(batch)
+            connection.execute(update_checkpoint.values(users_loaded=users_loaded))
+        throughput(len(batch))
+
+
+def insert_users(connection: Connection, rows: List[list], password_hashes: List[str]):
+    # Users are validated as they would be when added to the repository
+    users = [User(user_name=row[1], password=password_hash) for row, password_hash in zip(rows, password_hashes)]
+    if len(users) > 0:
+        connection.execute(users_table.insert(),
+                           [{'user_name': user.user_name, 'password': user.password} for user in users])
+
+
+def user_ids_by_csv_id(data_path: Path, connection: Connection) -> Dict[str, int]:
+    # Reviews refer to users by their id in users.csv, which may differ from their id in the database
+    database_ids = dict(connection.execute(select([users_table.c.user_name, users_table.c.id])).fetchall())
+    return {row[0]: database_ids[User(row[1], None).user_name]
+            for row in read_csv_file(str(data_path / "users.csv"))}
+
+
+def load_review_rows(data_path: Path, engine: Engine, reviews_loaded: int, batch_size: int,
+                     throughput: ThroughputReport):
+    update_checkpoint = import_checkpoints_table.update().where(import_checkpoints_table.c.id == 1)
+    with engine.connect() as connection:
+        user_ids = user_ids_by_csv_id(data_path, connection)
+
+    for batch in read_csv_batches(data_path / "reviews.csv", reviews_loaded, batch_size):
+        with engine.begin() as connection:
+            insert_reviews(connection, batch, user_ids)
+            reviews_loaded += len(batch)
+            connection.execute(update_checkpoint.values(reviews_loaded=reviews_loaded))
+        throughput(len(batch))
+
+
+def insert_reviews(connection: Connection, rows: List[list], user_ids: Dict[str, int]):
+    # Reviews are validated as they would be when made, and their Books' rating aggregates are updated
+    reviews = [(user_ids[row[1]], int(row[2]), Review(None, None, row[3], int(row[4]))) for row in rows]
+    book_ids = sorted({book_id for _, book_id, _ in reviews})
+    ratings = dict()
+    for start in range(0, len(book_ids), MAX_IN_VALUES):
+        for book_id, count, total, histogram in connection.execute(
+                select([books_table.c.id, books_table.c.rating_count, books_table.c.rating_total,
+                        books_table.c.rating_histogram])
+                .where(books_table.c.id.in_(book_ids[start:start + MAX_IN_VALUES]))):
+            ratings[book_id] = [count, total, list(histogram)]
+    for _, book_id, review in reviews:
+        if book_id not in ratings:
+            raise ValueError(f'Review of book {book_id}, which is not in the database')
+        book_ratings = ratings[book_id]
+        book_ratings[0] += 1
+        book_ratings[1] += review.rating
+        book_ratings[2][review.rating - 1] += 1
+
+    if len(reviews) > 0:
+        connection.execute(reviews_table.insert(), [
+            {'user_id': user_id, 'book_id': book_id, 'review_text': review.review_text,
+             'rating': review.rating, 'timestamp': review.timestamp} for user_id, book_id, review in reviews])
+        connection.execute(books_table.update().where(books_table.c.id == bindparam('book_id')), [
+            {'book_id': book_id, 'rating_count': count, 'rating_total': total, 'rating_histogram': tuple(histogram)}
+            for book_id, (count, total, histogram) in ratings.items()])
+
+
+def populate_in_bulk(data_path: Path, engine: Engine, workers: int = 1, catalog_path: Path = None,
+                     password_hashes: PasswordHashCache = None):
+    """ Populates an empty database from the data files in a single transaction.
+
+    Every table is written with executemany inserts of whole batches, rather than through a session one object at a
+    time: Books with their Authors, Publishers and content hashes by CatalogWriter, then users and reviews, whose
+    users and books are resolved to ids from the rows already written rather than loaded by queries of their own.
+    Passwords are hashed before the transaction begins, by that many processes unless their hashes are in
+    password_hashes. Books are read from a catalog file compiled from the data files if one is given.
+    """
+    users_filename = data_path / "users.csv"
+    user_rows = list(read_csv_file(str(users_filename)))
+    user_password_hashes_by_row = user_password_hashes(str(users_filename), user_rows, workers, password_hashes)
+
+    if catalog_path is not None:
+        batches = SharedCatalog(catalog_path).read_book_batches()
+    else:
+        batches = books_reader(data_path).read_book_batches(workers=workers)
+
+    with garbage_collection_paused(), engine.begin() as connection:
+        writer = CatalogWriter(connection)
+        for batch in batches:
+            writer.write_batch(connection, batch)
+        insert_users(connection, user_rows, user_password_hashes_by_row)
+        user_ids = user_ids_by_csv_id(data_path, connection)
+        for batch in read_csv_batches(data_path / "reviews.csv", 0, BATCH_SIZE):
+            insert_reviews(connection, batch, user_ids)
@@ -1,13 +1,20 @@
 from datetime import date
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
 from typing import List
 
-from sqlalchemy import desc, asc, func
+from sqlalchemy import desc, func, case
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from sqlalchemy.orm import scoped_session
 from flask import _app_ctx_stack
 
 from library.domain.model import User, Book, Review, Author, Publisher
+from library.adapters.coauthor_graph import CoauthorGraph
+from library.adapters.database_import import populate_in_bulk, MAX_IN_VALUES
+from library.adapters.orm import books_table, reviews_table
+from library.adapters.password_hashes import PasswordHashCache
 from library.adapters.repository import AbstractRepository
 
 
@@ -47,6 +54,8 @@ class SqlAlchemyRepository(AbstractRepository):
 
     def __init__(self, session_factory):
         self._session_cm = SessionContextManager(session_factory)
+        # Authors who have written a Book together, built when first needed after Books or Authors are added
+        self.__coauthor_graph = None
 
     def close_session(self):
         self._session_cm.close_current_session()
@@ -54,6 +63,13 @@ class SqlAlchemyRepository(AbstractRepository):
     def reset_session(self):
         self._session_cm.reset_session()
 
+    def populate_in_bulk(self, data_path: Path, workers: int = 1, catalog_path: Path = None,
+                         password_hashes: PasswordHashCache = None):
+        """ Populates the empty database from the data files in a single transaction, see database_import """
+        self._session_cm.close_current_session()
+        populate_in_bulk(data_path, self._session_cm.session.get_bind(), workers, catalog_path, password_hashes)
+        self.__coauthor_graph = None
+
     def add_user(self, user: User):
         with self._session_cm as scm:
             scm.session.add(user)
@@ -84,6 +100,13 @@ class SqlAlchemyRepository(AbstractRepository):
         with self._session_cm as scm:
             scm.session.add(book)
             scm.commit()
+        self.__coauthor_graph = None
+
+    def add_books(self, books: List[Book]):
+        with self._session_cm as scm:
+            scm.session.add_all(books)
+            scm.commit()
+        self.__coauthor_graph = None
 
     def get_book(self, id: int) -> Book:
         book = None
@@ -147,6 +170,26 @@ class SqlAlchemyRepository(AbstractRepository):
                 book_ids.append(book_id)
         return book_ids
 
+    def __get_coauthor_graph(self) -> CoauthorGraph:
+        if self.__coauthor_graph is None:
+            # Built from the book_authors table in a single query, rather than joining it for every request
+            rows = self._session_cm.session.execute(
+                'SELECT book_id, author_id FROM book_authors ORDER BY book_id').fetchall()
+            self.__coauthor_graph = CoauthorGraph(
+                [author_id for _, author_id in book_rows] for _, book_rows in groupby(rows, key=itemgetter(0)))
+        return self.__coauthor_graph
+
+    def __get_authors_in_order(self, author_ids: List[int]) -> List[Author]:
+        authors = self._session_cm.session.query(Author).filter(Author._Author__unique_id.in_(author_ids)).all()
+        authors_by_id = {author.unique_id: author for author in authors}
+        return [authors_by_id[author_id] for author_id in author_ids if author_id in authors_by_id]
+
+    def get_coauthors(self, author_id: int) -> List[Author]:
+        return self.__get_authors_in_order(self.__get_coauthor_graph().coauthor_ids(author_id))
+
+    def get_related_authors(self, author_id: int, max_depth: int = 2) -> List[Author]:
+        return self.__get_authors_in_order(self.__get_coauthor_graph().related_author_ids(author_id, max_depth))
+
     def get_book_ids_by_publisher(self, publisher: Publisher):
         if not isinstance(publisher, Publisher):
             return []
@@ -183,10 +226,71 @@ class SqlAlchemyRepository(AbstractRepository):
                 return [id[0] for id in book_ids]
         return []
 
+    def filter_book_ids(self, book_ids=None, year: int = None, publisher_names: List[str] = None,
+                        min_pages: int = None, max_pages: int = None, ebook: bool = None):
+        if year is not None and not isinstance(year, int):
+            return []
+
+        query = self._session_cm.session.query(Book._Book__book_id)
+        if year is not None:
+            query = query.filter(Book._Book__release_year == year)
+        if publisher_names is not None:
+            query = query.filter(books_table.c.publisher_name.in_(list(publisher_names)))
+        if min_pages is not None:
+            query = query.filter(Book._Book__num_pages >= min_pages)
+        if max_pages is not None:
+            query = query.filter(Book._Book__num_pages <= max_pages)
+        if ebook is not None:
+            query = query.filter(Book._Book__ebook == ebook)
+
+        if book_ids is None:
+            return [row[0] for row in query.order_by(Book._Book__book_id).all()]
+        return sorted(row[0] for book_ids_part in self.__in_parts(book_ids)
+                      for row in query.filter(Book._Book__book_id.in_(book_ids_part)).all())
+
+    def sort_book_ids(self, book_ids, sort_by: str):
+        book_id = Book._Book__book_id
+        release_year = Book._Book__release_year
+
+        # Ascending sort keys, ending with the id to break ties, which are selected and sorted here as the ids are
+        # queried in several parts
+        if sort_by == 'ascending' or sort_by == 'descending':
+            year = func.coalesce(release_year, 0)
+            keys = [case((release_year.is_(None), 1), else_=0), year if sort_by == 'ascending' else -year]
+        elif sort_by == 'best_reviewed' or sort_by == 'most_reviewed':
+            # Ordered by the stored rating aggregates, rather than by aggregating every review
+            rating_count = books_table.c.rating_count
+            if sort_by == 'best_reviewed':
+                keys = [-case((rating_count > 0, books_table.c.rating_total * 1.0 / rating_count), else_=0)]
+            else:
+                keys = [-rating_count]
+        else:
+            # Sort by title (alphabetical) by default
+            keys = [Book._Book__title]
+
+        keys = [key.label(f'key_{number}') for number, key in enumerate(keys)]
+        query = self._session_cm.session.query(*keys, book_id)
+        rows = [tuple(row) for book_ids_part in self.__in_parts(book_ids)
+                for row in query.filter(book_id.in_(book_ids_part)).all()]
+        return [row[-1] for row in sorted(rows)]
+
+    @staticmethod
+    def __in_parts(book_ids) -> List[list]:
+        # Each id once, in parts small enough for an IN clause
+        book_ids = list(set(book_ids))
+        return [book_ids[start:start + MAX_IN_VALUES] for start in range(0, len(book_ids), MAX_IN_VALUES)]
+
     def add_author(self, author: Author):
         with self._session_cm as scm:
             scm.session.add(author)
             scm.commit()
+        self.__coauthor_graph = None
+
+    def add_authors(self, authors: List[Author]):
+        with self._session_cm as scm:
+            scm.session.add_all(authors)
+            scm.commit()
+        self.__coauthor_graph = None
 
     def get_author(self, author_id: int) -> Author:
         author = None
@@ -214,6 +318,11 @@ class SqlAlchemyRepository(AbstractRepository):
             scm.session.add(publisher)
             scm.commit()
 
+    def add_publishers(self, publishers: List[Publisher]):
+        with self._session_cm as scm:
+            scm.session.add_all(publishers)
+            scm.commit()
+
     def get_publisher(self, publisher_name: str) -> Publisher:
         publisher = None
         try:
@@ -242,6 +351,15 @@ class SqlAlchemyRepository(AbstractRepository):
             scm.session.add(review)
             scm.commit()
 
+    def get_reviews_for_book(self, book_id: int, offset: int = 0, limit: int = None) -> List[Review]:
+        query = self._session_cm.session.query(Review) \
+            .filter(reviews_table.c.book_id == book_id) \
+            .order_by(desc(reviews_table.c.id)) \
+            .offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
     def get_reviews(self):
         reviews = self._session_cm.session.query(Review).all()
         return reviews
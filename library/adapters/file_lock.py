@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the app isn't run with several worker processes (gunicorn is POSIX only)
+    fcntl = None
+
+# Descriptors of the lock files held by this process, which keep their locks until the process exits
+_held_locks = dict()
+
+
+def hold_file_lock(path: Path) -> bool:
+    """ Takes an exclusive lock on the file at path (creating it) for the rest of this process's life.
+
+    Returns False, without waiting, if another process holds the lock. The lock is released by the operating
+    system when the process exits, however it exits, so a crashed process never leaves it held.
+    """
+    path = str(path)
+    if path in _held_locks:
+        return True
+    if fcntl is None:
+        return True
+
+    file_number = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(file_number, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(file_number)
+        return False
+    _held_locks[path] = file_number
+    return True
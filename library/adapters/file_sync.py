@@ -0,0 +1,18 @@
+import os
+from pathlib import Path
+
+
+def sync_directory(path: Path):
+    """ Flushes the directory at path to disk, so the files renamed into it since are still there after a crash.
+
+    A file replaced with os.replace is only durable once both its contents and its directory entry are flushed.
+    Directories can't be opened for flushing on Windows, where this does nothing.
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+
+    file_number = os.open(str(path), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(file_number)
+    finally:
+        os.close(file_number)
@@ -1,10 +1,11 @@
 import csv
 from pathlib import Path
+from typing import List
 
-from werkzeug.security import generate_password_hash
-
-from library.adapters.json_data_reader import BooksJSONReader
+from library.adapters.json_data_reader import BooksJSONReader, BOOK_FIELDS, garbage_collection_paused
+from library.adapters.password_hashes import PasswordHashCache, PASSWORD_HASH_COLUMN, hash_passwords
 from library.adapters.repository import AbstractRepository
+from library.adapters.shared_catalog import SharedCatalog
 from library.domain.model import User, Book, Author, Publisher, make_review, make_author_association, \
     make_publisher_association
 
@@ -22,53 +23,131 @@ def read_csv_file(filename: str):
             yield row
 
 
-def load_books_authors_and_publishers(data_path: Path, repo: AbstractRepository, database_mode: bool):
-    author_file = str(data_path / "book_authors_excerpt.json")
-    book_file = str(data_path / "comic_books_excerpt.json")
-
-    reader = BooksJSONReader(book_file, author_file)
-    reader.read_json_files()
-
-    for book in reader.dataset_of_books:
-        repo.add_book(book)
-
-    for publisher_name in reader.publisher_book_associations:
-        publisher = Publisher(publisher_name)
-        for book_id in reader.publisher_book_associations[publisher_name]:
-            book = repo.get_book(int(book_id))
-            if database_mode is True:
-                # the ORM takes care of the association between books and publishers
-                book.publisher = publisher
-            else:
-                make_publisher_association(book, publisher)
-        repo.add_publisher(publisher)
-
-    for author_id in reader.author_book_associations:
-        author = Author(int(author_id), reader.author_book_associations[author_id][0])
-        for i in range(1, len(reader.author_book_associations[author_id])):
-            book = repo.get_book(int(reader.author_book_associations[author_id][i]))
-            if database_mode is True:
-                # the ORM takes care of the association between books and authors
-                book.add_author(author)
-            else:
-                make_author_association(book, author)
-        repo.add_author(author)
-
-
-def load_users(data_path: Path, repo: AbstractRepository):
+def publisher_name_or_default(publisher_name) -> str:
+    # Publishers without a name are stored as "N/A", as the Publisher setter does
+    return (publisher_name.strip() if isinstance(publisher_name, str) else "") or "N/A"
+
+
+def author_record(author_id: str, author_name) -> tuple:
+    """ Validates an author of a book, returning the arguments of Author.from_trusted_record """
+    if int(author_id) < 0 or not isinstance(author_name, str) or author_name.strip() == "":
+        raise ValueError
+    return int(author_id), author_name.strip()
+
+
+def load_books_authors_and_publishers(data_path: Path, repo: AbstractRepository, database_mode: bool,
+                                      workers: int = 1, catalog_path: Path = None) -> List[int]:
+    """ Adds the books, authors and publishers in the data files (or a catalog compiled from them) to repo, and
+    returns the ids of the Books in the order they were read """
+    if catalog_path is not None:
+        # Read from a catalog file compiled from the data files, rather than parsing them
+        batches = SharedCatalog(catalog_path).read_book_batches()
+    else:
+        author_file = str(data_path / "book_authors_excerpt.json")
+        book_file = str(data_path / "comic_books_excerpt.json")
+
+        # Only the fields which are read into Books are decoded
+        batches = BooksJSONReader(book_file, author_file, fields=BOOK_FIELDS).read_book_batches(workers=workers)
+
+    # Publishers and Authors are created when they are first seen, and kept to associate with later Books
+    publishers = dict()
+    authors = dict()
+    book_ids = []
+
+    # Everything loaded is kept by the repository, so there is nothing for the collector to free
+    with garbage_collection_paused():
+        for batch in batches:
+            new_publishers = []
+            new_authors = []
+
+            for book, publisher_name, book_authors in batch:
+                publisher_name = publisher_name_or_default(publisher_name)
+                publisher = publishers.get(publisher_name)
+                if publisher is None:
+                    publisher = publishers[publisher_name] = Publisher.from_trusted_record(publisher_name)
+                    new_publishers.append(publisher)
+                if database_mode is True:
+                    # the ORM takes care of the association between books and publishers
+                    book.publisher = publisher
+                else:
+                    make_publisher_association(book, publisher)
+
+                for author_id, author_name in book_authors:
+                    author = authors.get(author_id)
+                    if author is None:
+                        author = authors[author_id] = Author.from_trusted_record(*author_record(author_id, author_name))
+                        new_authors.append(author)
+                    if database_mode is True:
+                        # the ORM takes care of the association between books and authors
+                        book.add_author(author)
+                    else:
+                        make_author_association(book, author)
+
+                # Link the Authors of the Book as coauthors of one another
+                for author in book.authors:
+                    for coauthor in book.authors:
+                        author.add_coauthor(coauthor)
+
+            repo.add_books([book for book, _, _ in batch])
+            book_ids.extend(book.book_id for book, _, _ in batch)
+            if len(new_publishers) > 0:
+                repo.add_publishers(new_publishers)
+            if len(new_authors) > 0:
+                repo.add_authors(new_authors)
+
+    return book_ids
+
+
+def user_password_hashes(users_filename: str, rows: List[list], workers: int = 1,
+                         password_hashes: PasswordHashCache = None) -> List[str]:
+    """ Returns the password hash of each of the given rows of a users file.
+
+    The passwords of a users file whose password column is headed password_hash are already hashed. Otherwise
+    the hashes are taken from password_hashes where they have been computed before, and the rest are computed by
+    that many processes and added to it.
+    """
+    with open(users_filename, encoding='utf-8-sig') as infile:
+        headers = next(csv.reader(infile))
+    if headers[2].strip() == PASSWORD_HASH_COLUMN:
+        return [row[2] for row in rows]
+
+    if password_hashes is None:
+        return hash_passwords([row[2] for row in rows], workers)
+
+    keys = [password_hashes.key(row[1], row[2]) for row in rows]
+    missing = {key: row[2] for key, row in zip(keys, rows) if password_hashes.get(key) is None}
+    if len(missing) > 0:
+        password_hashes.update(dict(zip(missing.keys(), hash_passwords(list(missing.values()), workers))))
+    return [password_hashes.get(key) for key in keys]
+
+
+def load_users(data_path: Path, repo: AbstractRepository, workers: int = 1,
+               password_hashes: PasswordHashCache = None):
     users = dict()
 
     users_filename = str(Path(data_path) / "users.csv")
-    for data_row in read_csv_file(users_filename):
+    rows = list(read_csv_file(users_filename))
+    for data_row, password_hash in zip(rows, user_password_hashes(users_filename, rows, workers, password_hashes)):
         user = User(
             user_name=data_row[1],
-            password=generate_password_hash(data_row[2])
+            password=password_hash
         )
         repo.add_user(user)
         users[data_row[0]] = user
     return users
 
 
+def write_hashed_users_file(data_path: Path, path: Path, workers: int = 1, password_hashes: PasswordHashCache = None):
+    """ Writes the users in the users file of the data files to a users file whose passwords are hashed """
+    users_filename = str(Path(data_path) / "users.csv")
+    rows = list(read_csv_file(users_filename))
+    hashes = user_password_hashes(users_filename, rows, workers, password_hashes)
+    with open(path, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['id', 'username', PASSWORD_HASH_COLUMN])
+        writer.writerows([row[0], row[1], password_hash] for row, password_hash in zip(rows, hashes))
+
+
 def load_reviews(data_path: Path, repo: AbstractRepository, users):
     reviews_filename = str(Path(data_path) / "reviews.csv")
     for data_row in read_csv_file(reviews_filename):
@@ -1,13 +1,144 @@
+import gc
+import io
 import json
-from typing import List
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from json.decoder import JSONDecoder
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 from library.domain.model import Publisher, Author, Book
 
+# Values of is_ebook in the books file, any other value leaves it unknown
+EBOOK_VALUES = {'false': False, 'true': True}
+
+# Decodes the JSON value starting at an index of a string, returning the value and the index after it
+SCAN_VALUE = JSONDecoder().scan_once
+
+# Number of books yielded at a time by BooksJSONReader.read_book_batches
+BATCH_SIZE = 10_000
+
+# Fields of the books file which are used to create Books and their associations
+BOOK_FIELDS = ('book_id', 'title', 'publication_year', 'is_ebook', 'description', 'num_pages', 'image_url',
+               'publisher', 'authors')
+
+# Approximate size of the parts of the books file parsed by each task when it is read by several processes
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+@contextmanager
+def garbage_collection_paused():
+    """ Pauses the cyclic garbage collector, which otherwise rescans every object kept by a large import.
+
+    The collector is only paused on the main thread, as pausing it affects the whole process, and an import in a
+    background thread would pause it for requests served meanwhile too.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """ Returns a pool of that many processes, which are forked when the pool is made on the main thread.
+
+    On any other thread, such as a background warm-up, the processes are spawned instead, as a process forked
+    while other threads run inherits the locks they hold, and can deadlock on them.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return ProcessPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+class FieldProjection:
+    """ Decodes only the given top-level fields of a line holding a JSON object.
+
+    Each field's key is found with str.find and only its value is decoded, so the other values, such as the long
+    popular_shelves lists of the books file, are never turned into Python objects. A key can only appear
+    unescaped outside a string as a key, so this relies on each field being a key of the top-level object only,
+    as in the data files. A line where a field can't be found this way is decoded in full, and the field then
+    raises KeyError if it is missing, as it would after json.loads.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.__keys = [(field, f'"{field}":') for field in fields]
+
+    def __call__(self, line: str) -> dict:
+        values = dict()
+        for field, key in self.__keys:
+            position = line.find(key)
+            if position < 1 or line[position - 1] == '\\':
+                return self.__decode_all(line)
+            start = position + len(key)
+            while line[start] in ' \t\r\n':
+                start += 1
+            try:
+                values[field] = SCAN_VALUE(line, start)[0]
+            except StopIteration:
+                # Not a valid value, decoding the whole line reports where the error is
+                return self.__decode_all(line)
+        return values
+
+    def __decode_all(self, line: str) -> dict:
+        book_json = json.loads(line)
+        return {field: book_json[field] for field, _ in self.__keys}
+
+
+def compact_record(book_json: dict) -> tuple:
+    """ Returns the (book record, publisher name, author ids) of a book, see BooksJSONReader.book_record """
+    return BooksJSONReader.book_record(book_json), book_json['publisher'], \
+        [author['author_id'] for author in book_json['authors']]
+
+
+def read_compact_records(file_name: str, start: int, end: int, decode: Callable[[str], dict] = json.loads) \
+        -> List[tuple]:
+    """ Returns the compact records of the books between two byte offsets of a books file.
+
+    Run in worker processes, which return plain tuples rather than Books, as they are much cheaper to send back.
+    """
+    with open(file_name, 'rb') as books_file:
+        books_file.seek(start)
+        data = books_file.read(end - start)
+    # Lines are split as they are when iterating over a text file, so the records match a serial read
+    return [compact_record(decode(line)) for line in io.StringIO(data.decode('UTF-8'), newline=None)]
+
+
+def split_lines(file_name: str, number_of_ranges: int) -> List[Tuple[int, int]]:
+    """ Splits a file into at most number_of_ranges (start, end) byte ranges, each ending after a newline """
+    size = os.path.getsize(file_name)
+    byte_ranges = []
+    with open(file_name, 'rb') as books_file:
+        start = 0
+        for number in range(1, number_of_ranges + 1):
+            if start >= size:
+                break
+            books_file.seek(max(start, size * number // number_of_ranges))
+            if number < number_of_ranges:
+                # Move to the start of the next line
+                books_file.readline()
+            end = books_file.tell() if number < number_of_ranges else size
+            if end > start:
+                byte_ranges.append((start, end))
+            start = end
+    return byte_ranges
+
 
 class BooksJSONReader:
 
-    def __init__(self, books_file_name: str, authors_file_name: str):
+    def __init__(self, books_file_name: str, authors_file_name: str, fields: Iterable[str] = None):
         self.__books_file_name = books_file_name
+        # Lines of the books file are decoded in full unless only some of their fields are needed
+        self.__decode = json.loads if fields is None else FieldProjection(fields)
         self.__authors_file_name = authors_file_name
         self.__dataset_of_books = list()
         self.__author_book_associations = dict()
@@ -25,13 +156,24 @@ class BooksJSONReader:
     def publisher_book_associations(self):
         return self.__publisher_book_associations
 
-    def read_books_file(self) -> list:
-        books_json = []
+    def iter_books_file(self) -> Iterator[dict]:
+        """ Yields the books in the books file one at a time, so the file is never held in memory """
         with open(self.__books_file_name, encoding='UTF-8') as books_jsonfile:
             for line in books_jsonfile:
-                book_entry = json.loads(line)
-                books_json.append(book_entry)
-        return books_json
+                yield self.__decode(line)
+
+    def read_books_file(self) -> list:
+        return list(self.iter_books_file())
+
+    def read_author_names(self) -> Dict[str, str]:
+        """ Returns the name of each author id in the authors file, read in a single pass over the file """
+        author_names = dict()
+        with open(self.__authors_file_name, encoding='UTF-8') as authors_jsonfile:
+            for line in authors_jsonfile:
+                author_entry = json.loads(line)
+                # The first entry for an author id is used, as when the file was searched in order
+                author_names.setdefault(author_entry['author_id'], author_entry['name'])
+        return author_names
 
     def read_authors_file(self) -> list:
         authors_json = []
@@ -41,48 +183,122 @@ class BooksJSONReader:
                 authors_json.append(author_entry)
         return authors_json
 
-    def read_json_files(self):
-        authors_json = self.read_authors_file()
-        books_json = self.read_books_file()
-
-        for book_json in books_json:
-            book_instance = Book(int(book_json['book_id']), book_json['title'])
-
-            if book_json['publication_year'] != "":
-                book_instance.release_year = int(book_json['publication_year'])
-
-            if book_json['is_ebook'].lower() == 'false':
-                book_instance.ebook = False
-            else:
-                if book_json['is_ebook'].lower() == 'true':
-                    book_instance.ebook = True
-
-            book_instance.description = book_json['description']
-            if book_json['num_pages'] != "":
-                book_instance.num_pages = int(book_json['num_pages'])
-
-            if book_json['image_url'] != "":
-                book_instance.image_url = book_json['image_url']
-
-            if book_json['publisher'] not in self.__publisher_book_associations:
-                self.__publisher_book_associations[book_json['publisher']] = list()
-            self.__publisher_book_associations[book_json['publisher']].append(book_json['book_id'])
-
-            # Extract the author ids:
-            list_of_authors = book_json['authors']
-            for author in list_of_authors:
-                author_id = author['author_id']
-                # We assume book authors are available in the authors file,
-                # otherwise more complex handling is required
-                author_name = None
-                for author_json in authors_json:
-                    if author_json['author_id'] == author_id:
-                        author_name = author_json['name']
-                        break
-
-                if author_id not in self.__author_book_associations:
-                    self.__author_book_associations[author_id] = [author_name]
-                self.__author_book_associations[author_id].append(book_json['book_id'])
-
-            self.__dataset_of_books.append(book_instance)
+    @staticmethod
+    def book_record(book_json: dict) -> tuple:
+        """ Validates a book read from the books file, returning the arguments of Book.from_trusted_record.
+
+        The values are checked and normalised as the Book setters would, so the Book can be created without them.
+        """
+        book_id = int(book_json['book_id'])
+        title = book_json['title']
+        title = title.strip() if isinstance(title, str) else ""
+        if book_id < 0 or title == "":
+            raise ValueError
+
+        release_year = book_json['publication_year']
+        release_year = int(release_year) if release_year != "" else None
+        if release_year is not None and release_year < 0:
+            raise ValueError
+
+        num_pages = book_json['num_pages']
+        num_pages = int(num_pages) if num_pages != "" else None
+        if num_pages is not None and num_pages <= 0:
+            num_pages = None
+
+        description = book_json['description']
+        if isinstance(description, str):
+            description = description.strip()
+        else:
+            description = None
+
+        image_url = book_json['image_url']
+        if not isinstance(image_url, str) or image_url == "":
+            image_url = None
+
+        return book_id, title, description, release_year, EBOOK_VALUES.get(book_json['is_ebook'].lower()), \
+            num_pages, image_url
 
+    def read_book_batches(self, batch_size: int = BATCH_SIZE, workers: int = 1) -> Iterator[List[tuple]]:
+        """ Yields the books in the books file in lists of at most batch_size (book, publisher name, authors) records.
+
+        Each Book is validated and created with Book.from_trusted_record, and authors is a list of its (author id,
+        author name) pairs. Only the current batch and the author names are held in memory.
+
+        With more than one worker, the books file is parsed by a pool of that many processes, see
+        read_compact_records. The batches are the same as when it is read by this process.
+        """
+        author_names = self.read_author_names()
+
+        if workers > 1:
+            compact_records = self.__read_compact_records_in_parallel(workers)
+        else:
+            compact_records = (compact_record(book_json) for book_json in self.iter_books_file())
+
+        batch = []
+        for record in compact_records:
+            batch.append(self.__batch_entry(record, author_names))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if len(batch) > 0:
+            yield batch
+
+    def read_book_batches_from(self, offset: int = 0, batch_size: int = BATCH_SIZE) \
+            -> Iterator[Tuple[int, List[tuple]]]:
+        """ Yields the books after a byte offset of the books file in (end offset, batch) pairs.
+
+        The batches are those of read_book_batches, and end offset is the byte offset just past the last line of
+        the batch, so reading can be resumed from it. The file is read by this process.
+        """
+        author_names = self.read_author_names()
+
+        batch = []
+        with open(self.__books_file_name, 'rb') as books_file:
+            books_file.seek(offset)
+            for line in books_file:
+                offset += len(line)
+                batch.append(self.__batch_entry(compact_record(self.__decode(line.decode('UTF-8'))), author_names))
+                if len(batch) == batch_size:
+                    yield offset, batch
+                    batch = []
+
+        if len(batch) > 0:
+            yield offset, batch
+
+    @staticmethod
+    def __batch_entry(record: tuple, author_names: Dict[str, str]) -> tuple:
+        book_record, publisher_name, author_ids = record
+        book = Book.from_trusted_record(*book_record)
+        # We assume book authors are available in the authors file,
+        # otherwise more complex handling is required
+        authors = [(author_id, author_names.get(author_id)) for author_id in author_ids]
+        return book, publisher_name, authors
+
+    def __read_compact_records_in_parallel(self, workers: int) -> Iterator[tuple]:
+        byte_ranges = split_lines(self.__books_file_name, max(workers, os.path.getsize(self.__books_file_name)
+                                                              // CHUNK_SIZE))
+        with process_pool(workers) as executor:
+            # Only a few ranges are parsed ahead of the one being used, which bounds the memory used by results.
+            # Results are used in file order, so the records come in the same order as when read serially
+            pending = deque()
+            for start, end in byte_ranges:
+                pending.append(executor.submit(read_compact_records, self.__books_file_name, start, end,
+                                               self.__decode))
+                if len(pending) > 2 * workers:
+                    yield from pending.popleft().result()
+            while len(pending) > 0:
+                yield from pending.popleft().result()
+
+    def read_json_files(self):
+        # Everything read is kept until the import finishes, so there is nothing for the collector to free
+        with garbage_collection_paused():
+            for batch in self.read_book_batches():
+                for book, publisher_name, authors in batch:
+                    book_id = str(book.book_id)
+                    self.__publisher_book_associations.setdefault(publisher_name, []).append(book_id)
+                    for author_id, author_name in authors:
+                        if author_id not in self.__author_book_associations:
+                            self.__author_book_associations[author_id] = [author_name]
+                        self.__author_book_associations[author_id].append(book_id)
+                    self.__dataset_of_books.append(book)
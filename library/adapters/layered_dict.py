@@ -0,0 +1,170 @@
+from math import sqrt
+from typing import Iterable, Iterator, List
+
+# Value in the changes of a LayeredDict of a key which was removed from its base
+_REMOVED = object()
+_MISSING = object()
+
+
+class LayeredDict:
+    """ Mapping made of a base dict and the changes made to it since it was shared with a copy.
+
+    copy() shares the base and the changes between the copy and the original. Until one of them writes, neither
+    is changed: the first write of each copies only the changes, which are folded into a new base once there are
+    more than about the square root of the number of entries. A write therefore costs O(sqrt(n)) on average
+    however large the mapping is, and never changes what a copy reads. A LayeredDict which hasn't been copied
+    since its base was built writes to its base directly, as a dict would.
+
+    Keys are iterated in insertion order, except that a key which is removed and then added again before the
+    changes are folded keeps its old place.
+    """
+
+    MIN_CHANGES = 512
+
+    def __init__(self, items: Iterable = ()):
+        self.__base = dict(items)
+        self.__changes = dict()
+        # Whether the base or changes are this mapping's own, rather than shared with a copy
+        self.__owns_base = True
+        self.__owns_changes = True
+        self.__length = len(self.__base)
+
+    def __writable_changes(self) -> dict:
+        if not self.__owns_changes:
+            self.__changes = dict(self.__changes)
+            self.__owns_changes = True
+        return self.__changes
+
+    def __fold_changes(self):
+        if len(self.__changes) <= max(self.MIN_CHANGES, int(sqrt(len(self.__base)))):
+            return
+        base = dict(self.__base)
+        for key, value in self.__changes.items():
+            if value is _REMOVED:
+                del base[key]
+            else:
+                base[key] = value
+        self.__base = base
+        self.__changes = dict()
+        self.__owns_base = self.__owns_changes = True
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.__changes.get(key, _MISSING)
+        if value is _MISSING:
+            return self.__base.get(key, default)
+        return default if value is _REMOVED else value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items_of(self, keys: Iterable) -> List[tuple]:
+        """ Returns (key, value) for each of keys which is in the mapping, looked up together """
+        if len(self.__changes) == 0:
+            base = self.__base
+            return [(key, base[key]) for key in keys if key in base]
+        get = self.get
+        return [(key, value) for key, value in zip(keys, map(get, keys, [_MISSING] * len(keys)))
+                if value is not _MISSING]
+
+    def __setitem__(self, key, value):
+        if self.__owns_base:
+            self.__length += key not in self.__base
+            self.__base[key] = value
+            return
+
+        if key not in self:
+            self.__length += 1
+        self.__writable_changes()[key] = value
+        self.__fold_changes()
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        self[key] = default
+        return default
+
+    def update(self, items: Iterable = ()):
+        """ Sets the value of each (key, value) in items, or of each key of a mapping """
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = dict(items)
+        if self.__owns_base:
+            self.__base.update(items)
+            self.__length = len(self.__base)
+            return
+
+        self.__length += sum(1 for key in items if key not in self)
+        self.__writable_changes().update(items)
+        self.__fold_changes()
+
+    def pop(self, key, *default):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(key)
+
+        self.__length -= 1
+        if self.__owns_base:
+            del self.__base[key]
+        elif key in self.__base:
+            self.__writable_changes()[key] = _REMOVED
+            self.__fold_changes()
+        else:
+            del self.__writable_changes()[key]
+        return value
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __len__(self):
+        return self.__length
+
+    def items(self) -> Iterable[tuple]:
+        if len(self.__changes) == 0:
+            return self.__base.items()
+        return self.__layered_items()
+
+    def __layered_items(self) -> Iterator[tuple]:
+        changes = self.__changes
+        for key, value in self.__base.items():
+            value = changes.get(key, value)
+            if value is not _REMOVED:
+                yield key, value
+        base = self.__base
+        for key, value in changes.items():
+            if value is not _REMOVED and key not in base:
+                yield key, value
+
+    def keys(self) -> Iterable:
+        if len(self.__changes) == 0:
+            return self.__base.keys()
+        return (key for key, _ in self.__layered_items())
+
+    def values(self) -> Iterable:
+        if len(self.__changes) == 0:
+            return self.__base.values()
+        return (value for _, value in self.__layered_items())
+
+    def __iter__(self) -> Iterator:
+        return iter(self.keys())
+
+    def copy(self) -> 'LayeredDict':
+        layered_dict = LayeredDict()
+        layered_dict.__base = self.__base
+        layered_dict.__changes = self.__changes
+        layered_dict.__length = self.__length
+        # Both now share the base and the changes
+        layered_dict.__owns_base = layered_dict.__owns_changes = False
+        self.__owns_base = self.__owns_changes = False
+        return layered_dict
+
+    def __repr__(self):
+        return f'LayeredDict({dict(self.items())!r})'
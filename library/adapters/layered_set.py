@@ -0,0 +1,92 @@
+from itertools import chain
+from math import sqrt
+from typing import Iterable, Iterator
+
+
+class LayeredSet:
+    """ Set made of a base set and the items added to and removed from it since it was shared with a copy.
+
+    Copies are made and written as with LayeredDict: the first write of a copy or the original copies only the
+    added and removed items, which are folded into a new base once there are more than about the square root of
+    the number of items.
+    """
+
+    __slots__ = ('__base', '__added', '__removed', '__owns_base', '__owns_changes')
+
+    MIN_CHANGES = 512
+
+    def __init__(self, items: Iterable = ()):
+        self.__base = set(items)
+        # Items added which are not in the base, and items of the base which were removed
+        self.__added = set()
+        self.__removed = set()
+        self.__owns_base = True
+        self.__owns_changes = True
+
+    def __write_changes(self):
+        if not self.__owns_changes:
+            self.__added = set(self.__added)
+            self.__removed = set(self.__removed)
+            self.__owns_changes = True
+
+    def __fold_changes(self):
+        if len(self.__added) + len(self.__removed) <= max(self.MIN_CHANGES, int(sqrt(len(self.__base)))):
+            return
+        self.__base = self.__base.difference(self.__removed).union(self.__added)
+        self.__added = set()
+        self.__removed = set()
+        self.__owns_base = self.__owns_changes = True
+
+    def add(self, item):
+        self.update((item,))
+
+    def update(self, items: Iterable):
+        if self.__owns_base:
+            self.__base.update(items)
+            return
+
+        items = set(items)
+        self.__write_changes()
+        self.__removed.difference_update(items)
+        self.__added.update(items.difference(self.__base))
+        self.__fold_changes()
+
+    def discard(self, item):
+        if self.__owns_base:
+            self.__base.discard(item)
+        elif item in self.__added:
+            self.__write_changes()
+            self.__added.discard(item)
+        elif item in self.__base and item not in self.__removed:
+            self.__write_changes()
+            self.__removed.add(item)
+            self.__fold_changes()
+
+    def __contains__(self, item) -> bool:
+        return item in self.__added or (item in self.__base and item not in self.__removed)
+
+    def intersection(self, items: set) -> set:
+        """ Returns the items in items which are also in this set """
+        result = self.__base.intersection(items)
+        if len(self.__removed) > 0:
+            result.difference_update(self.__removed)
+        if len(self.__added) > 0:
+            result.update(self.__added.intersection(items))
+        return result
+
+    def __iter__(self) -> Iterator:
+        base = self.__base if len(self.__removed) == 0 else self.__base.difference(self.__removed)
+        return chain(base, self.__added)
+
+    def __len__(self):
+        return len(self.__base) - len(self.__removed) + len(self.__added)
+
+    def copy(self) -> 'LayeredSet':
+        layered_set = LayeredSet()
+        layered_set.__base = self.__base
+        layered_set.__added = self.__added
+        layered_set.__removed = self.__removed
+        # Both now share the base and the changes
+        layered_set.__owns_base = layered_set.__owns_changes = False
+        self.__owns_base = self.__owns_changes = False
+        return layered_set
@@ -1,6 +1,8 @@
 import csv
 import json
-from bisect import insort_left
+import threading
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime
 from pathlib import Path
 from typing import List
@@ -8,63 +10,379 @@ from typing import List
 from werkzeug.security import generate_password_hash
 
 from library.adapters.json_data_reader import BooksJSONReader
+from library.adapters.catalog_columns import CatalogColumns
+from library.adapters.layered_dict import LayeredDict
+from library.adapters.coauthor_graph import CoauthorGraph
+from library.adapters.memory_snapshot import save_snapshot, load_snapshot, read_snapshot_log, SnapshotException
 from library.adapters.repository import AbstractRepository, RepositoryException
+from library.adapters.review_log import ReviewLog
+from library.adapters.sort_orders import SortOrder, SORT_KEYS, REVIEW_SORT_ORDERS
+from library.adapters.sorted_list import SortedList
+from library.adapters.title_index import TitleIndex
+from library.adapters.write_ahead_log import WriteAheadLog, compact_records
 from library.domain.model import Publisher, Author, Book, User, Review, make_review
 
 
+class _Snapshot:
+    """ One published version of the repository's collections.
+
+    Collections reachable from a published snapshot are never modified. Writers modify copies and publish a new
+    snapshot, so a reader holding a snapshot never sees a partly applied write to the collections.
+
+    Only the collections are versioned, not the domain objects they hold, which every snapshot shares. The
+    favourites of a User, and the reviews, users who favourited and rating aggregates of a Book, are changed in
+    place: by update_favourites under the write lock, and by make_review before the Review is added. A reader may
+    see those changes before the snapshot which publishes them, or see a Book's aggregates partly updated.
+    """
+
+    __slots__ = ('books', 'books_index', 'users', 'authors', 'publishers', 'reviews', 'book_ids_by_year',
+                 'book_ids_by_author', 'book_ids_by_publisher', 'title_index', 'sort_orders')
+
+    def __init__(self, **collections):
+        for name in self.__slots__:
+            setattr(self, name, collections.get(name))
+
+    def replace(self, **collections) -> '_Snapshot':
+        snapshot = _Snapshot(**{name: getattr(self, name) for name in self.__slots__})
+        for name, collection in collections.items():
+            setattr(snapshot, name, collection)
+        return snapshot
+
+
+class _Draft:
+    """ The next version of the repository's collections, copied from a snapshot as each collection is written.
+
+    The collections copy only the parts of themselves which are written after being copied, so a write costs
+    about as much as the change it makes rather than the size of the catalog.
+    """
+
+    def __init__(self, snapshot: _Snapshot):
+        self.__snapshot = snapshot
+        self.__copies = dict()
+        # Sort orders copied by this draft, the others are shared with the snapshot
+        self.__copied_sort_orders = set()
+
+    def __getattr__(self, name):
+        try:
+            return self.__copies[name]
+        except KeyError:
+            return getattr(self.__snapshot, name)
+
+    def write(self, name):
+        if name not in self.__copies:
+            self.__copies[name] = getattr(self.__snapshot, name).copy()
+        return self.__copies[name]
+
+    def write_sort_order(self, sort_by: str) -> SortOrder:
+        sort_orders = self.write('sort_orders')
+        if sort_by not in self.__copied_sort_orders:
+            sort_orders[sort_by] = sort_orders[sort_by].copy()
+            self.__copied_sort_orders.add(sort_by)
+        return sort_orders[sort_by]
+
+    def publish(self) -> _Snapshot:
+        if 'title_index' in self.__copies:
+            self.__copies['title_index'].share()
+        for sort_by in self.__copied_sort_orders:
+            self.__copies['sort_orders'][sort_by].prepare()
+        return self.__snapshot.replace(**self.__copies)
+
+
 class MemoryRepository(AbstractRepository):
+    """ Repository which holds everything in memory.
+
+    Readers take the current snapshot without locking. Writers are serialised by a lock, apply their changes to
+    a draft and then publish it as the new snapshot with a single assignment.
+    """
 
     def __init__(self):
-        self.__books = list()
-        self.__books_index = dict()
-        self.__users = list()
-        self.__authors = list()
-        self.__publishers = set()
-        self.__reviews = list()
+        self.__snapshot = _Snapshot(
+            # Books in ascending id order
+            books=SortedList(),
+            books_index=LayeredDict(),
+            users=LayeredDict(),
+            authors=LayeredDict(),
+            publishers=LayeredDict(),
+            reviews=ReviewLog(),
+            # Secondary indexes, kept up to date by add_book so lookups don't have to scan every Book
+            book_ids_by_year=dict(),
+            # keyed by Author unique id and Publisher name, of which there can be too many to copy on each write
+            book_ids_by_author=LayeredDict(),
+            book_ids_by_publisher=LayeredDict(),
+            title_index=TitleIndex(),
+            # Book ids in the order of each SortForm option
+            sort_orders={sort_by: SortOrder() for sort_by in SORT_KEYS}
+        )
+
+        # Structures derived from a snapshot's collections, built when first needed, with the collections they
+        # were built from. Snapshots are never modified, so these are kept here rather than on the snapshot, and
+        # are rebuilt once a published snapshot has different collections:
+        # the columnar copy of the catalog used for filtering, built from the Books and their Publishers
+        self.__cached_columns = (None, None, None)
+        # and the Authors who have written a Book together, built from the Books and Authors
+        self.__cached_coauthor_graph = (None, None, None)
+
+        self.__write_lock = threading.RLock()
+        # (thread id, draft) of the write in progress, so the writing thread reads its own changes
+        self.__draft = None
+
+        # Write-ahead log which changes to users, reviews and favourites are recorded in, and the snapshot it is
+        # folded into when compacted, see replay_log
+        self.__log = None
+        self.__log_snapshot_path = None
+        # Sequence number of the last log record folded into the snapshot this repository was loaded from
+        self.__loaded_log_sequence = None
+
+    def __view(self):
+        draft = self.__draft
+        if draft is not None and draft[0] == threading.get_ident():
+            return draft[1]
+        return self.__snapshot
+
+    @contextmanager
+    def __write(self):
+        with self.__write_lock:
+            if self.__draft is not None:
+                # Nested write, which becomes part of the enclosing one
+                yield self.__draft[1]
+                return
+
+            draft = _Draft(self.__snapshot)
+            self.__draft = (threading.get_ident(), draft)
+            try:
+                yield draft
+                self.__snapshot = draft.publish()
+            finally:
+                self.__draft = None
+
+    @contextmanager
+    def batch(self):
+        with self.__write():
+            yield
+
+    def save_snapshot(self, path: Path):
+        """ Saves the repository's contents to a binary snapshot file, see memory_snapshot """
+        save_snapshot(path, self)
+
+    def load_snapshot(self, path: Path):
+        """ Adds the contents of a binary snapshot file to the repository, see memory_snapshot """
+        self.__loaded_log_sequence = load_snapshot(path, self)
+
+    def replay_log(self, log: WriteAheadLog, snapshot_path: Path = None):
+        """ Applies the changes recorded in a write-ahead log, then records every later change in it.
+
+        With snapshot_path, the log is folded into that snapshot when it is compacted (see fold_log), and the
+        changes already folded into it are applied first, unless the repository was loaded from it.
+        """
+        with self.__write():
+            sequence = self.__loaded_log_sequence
+            if sequence is None:
+                sequence, records = self.__folded_log_records(snapshot_path)
+                for record in records:
+                    self.__apply_log_record(record)
+            for record in log.records(after=sequence):
+                self.__apply_log_record(record)
+        self.__log = log
+        self.__log_snapshot_path = snapshot_path
+
+    @staticmethod
+    def __folded_log_records(snapshot_path: Path):
+        """ Returns the sequence number and records of the log records folded into the snapshot file """
+        if snapshot_path is None or not Path(snapshot_path).exists():
+            return 0, []
+        try:
+            return read_snapshot_log(snapshot_path)
+        except SnapshotException:
+            # The snapshot can't be read, so only the changes still in the log are kept
+            return 0, []
+
+    def fold_log(self):
+        """ Saves the repository, with every change recorded in its log, to the log's snapshot, then removes
+        those changes from the log.
+
+        The snapshot keeps the log records folded into it, so they are applied again if the repository is
+        repopulated from newer data files. Writers wait while the snapshot is saved, readers don't.
+        """
+        with self.__write_lock:
+            sequence, records = self.__folded_log_records(self.__log_snapshot_path)
+            records.extend(self.__log.records(after=sequence))
+            records = [records[index] for index in compact_records(records)]
+            # save_snapshot returns once the snapshot is on disk, so the log is only truncated once a crash can no
+            # longer lose the records folded into it
+            save_snapshot(self.__log_snapshot_path, self, self.__log.sequence, records)
+            self.__log.truncate(self.__log.sequence)
+
+    def __apply_log_record(self, record: dict):
+        user = self.get_user(record['user_name'])
+        if record['type'] == 'user':
+            if user is None:
+                self.add_user(User(record['user_name'], record['password']))
+            return
+
+        book = self.get_book(record['book_id'])
+        if user is None or book is None:
+            # The user or book is no longer in the data files
+            return
+
+        if record['type'] == 'review':
+            timestamp = datetime.fromisoformat(record['timestamp'])
+            review = Review(user, book, record['review_text'], record['rating'], timestamp)
+            user.add_review(review)
+            book.add_review(review)
+            self.add_review(review)
+        elif record['type'] == 'favourite' and (book in user.favourites) != record['favourite']:
+            self.update_favourites(user, book)
+
+    def __log_change(self, record: dict):
+        # Called while holding the write lock, so records are logged in the order the changes are applied
+        if self.__log is None:
+            return None
+        return self.__log.append(record)
+
+    def __sync_log(self, sequence):
+        # Called after releasing the write lock, so other writers can log their changes during the fsync
+        if sequence is None:
+            return
+        self.__log.sync(sequence)
+
+        if self.__log.compaction_due():
+            with self.__write_lock:
+                # Changes are only compacted between writes, which another thread may have done already
+                if self.__draft is not None or not self.__log.compaction_due():
+                    return
+                if self.__log_snapshot_path is not None:
+                    self.fold_log()
+                else:
+                    self.__log.compact()
 
     # User methods
     def add_user(self, user: User):
-        self.__users.append(user)
+        sequence = None
+        with self.__write() as draft:
+            # User names are stored in lowercase by the domain model, keep the first user added for a name
+            if user.user_name not in draft.users:
+                draft.write('users')[user.user_name] = user
+                sequence = self.__log_change({'type': 'user', 'user_name': user.user_name,
+                                              'password': user.password})
+        self.__sync_log(sequence)
 
     def get_user(self, user_name) -> User:
         if isinstance(user_name, str):
-            return next((user for user in self.__users if user.user_name == user_name.lower()), None)
+            return self.__view().users.get(user_name.lower())
         return None
 
+    def get_users(self):
+        return list(self.__view().users.values())
+
     def update_favourites(self, user: User, book: Book):
         # Add the book to favourites if it isn't in favourites, remove if it is
         # Domain model will not add book if it is already in user's favourites
-        if book in user.favourites:
-            user.unfavourite_a_book(book)
-            book.remove_user(user)
-        else:
-            user.favourite_a_book(book)
-            book.add_user(user)
+        # The User and Book are changed in place, readers may see the change before it is published, see _Snapshot
+        with self.__write():
+            if book in user.favourites:
+                user.unfavourite_a_book(book)
+                book.remove_user(user)
+            else:
+                user.favourite_a_book(book)
+                book.add_user(user)
+            sequence = self.__log_change({'type': 'favourite', 'user_name': user.user_name, 'book_id': book.book_id,
+                                          'favourite': book in user.favourites})
+        self.__sync_log(sequence)
 
     # Book methods
     def add_book(self, book: Book):
-        insort_left(self.__books, book)
-        self.__books_index[book.book_id] = book
+        with self.__write() as draft:
+            books = draft.write('books')
+            books_index = draft.write('books_index')
+
+            if book.book_id in books_index:
+                # Replacing a Book, so remove its old entries from the indexes first
+                self.__unindex_book(draft, books_index[book.book_id])
+                books.remove(books_index[book.book_id])
+
+            books.add(book)
+            books_index[book.book_id] = book
+            self.__index_books(draft, [book])
+
+    def add_books(self, books: List[Book]):
+        # A later Book replaces an earlier one with the same id, as it would with add_book
+        new_books = {book.book_id: book for book in books}
+        if len(new_books) == 0:
+            return
+
+        with self.__write() as draft:
+            sorted_books = draft.write('books')
+            books_index = draft.write('books_index')
+
+            for book_id in new_books:
+                if book_id in books_index:
+                    self.__unindex_book(draft, books_index[book_id])
+                    sorted_books.remove(books_index[book_id])
+
+            # The sorted structures are built once for all the Books rather than once per Book
+            sorted_books.update(new_books.values())
+            books_index.update(new_books)
+            self.__index_books(draft, list(new_books.values()))
+
+    @staticmethod
+    def __index_books(draft: _Draft, books: List[Book]):
+        draft.write('title_index').update({book.book_id: book.title for book in books})
+
+        for sort_by, sort_key in SORT_KEYS.items():
+            draft.write_sort_order(sort_by).update({book.book_id: sort_key(book) for book in books})
+
+        new_entries = {'book_ids_by_year': dict(), 'book_ids_by_author': dict(), 'book_ids_by_publisher': dict()}
+        for book in books:
+            for name, key in MemoryRepository.__index_keys(book):
+                new_entries[name].setdefault(key, []).append(book.book_id)
+
+        for name, book_ids_by_new_key in new_entries.items():
+            if len(book_ids_by_new_key) > 0:
+                book_ids_by_key = draft.write(name)
+                for key, book_ids in book_ids_by_new_key.items():
+                    # The list for a key is replaced rather than changed, as the published snapshot shares it
+                    book_ids_by_key[key] = sorted(book_ids_by_key.get(key, []) + book_ids)
+
+    @staticmethod
+    def __unindex_book(draft: _Draft, book: Book):
+        draft.write('title_index').remove(book.book_id)
+        for sort_by in SORT_KEYS:
+            draft.write_sort_order(sort_by).remove(book.book_id)
+        for name, key in MemoryRepository.__index_keys(book):
+            book_ids_by_key = draft.write(name)
+            book_ids_by_key[key] = [book_id for book_id in book_ids_by_key.get(key, []) if book_id != book.book_id]
+
+    @staticmethod
+    def __index_keys(book: Book):
+        """ Yields the name of each secondary index which has an entry for the Book, with the entry's key """
+        if book.release_year is not None:
+            yield 'book_ids_by_year', book.release_year
+        for author in book.authors:
+            yield 'book_ids_by_author', author.unique_id
+        if book.publisher is not None:
+            yield 'book_ids_by_publisher', book.publisher.name
 
     def get_book(self, book_id: int) -> Book:
         book = None
         try:
-            book = self.__books_index[book_id]
+            book = self.__view().books_index[book_id]
         except KeyError:
             pass  # Ignore exception and return None
 
         return book
 
     def get_books(self, id_list):
+        books_index = self.__view().books_index
+
         # Strip out any ids in id_list that don't represent Book ids in the repository
-        existing_ids = [book_id for book_id in id_list if book_id in self.__books_index]
+        existing_ids = [book_id for book_id in id_list if book_id in books_index]
 
         # Fetch the Books
-        books = [self.__books_index[book_id] for book_id in existing_ids]
+        books = [books_index[book_id] for book_id in existing_ids]
         return books
 
     def get_number_of_books(self):
-        return len(self.__books)
+        return len(self.__view().books)
 
     def partial_search_books_by_title(self, title_string: str):
         matching_book_ids = []
@@ -72,36 +390,68 @@ class MemoryRepository(AbstractRepository):
         if not isinstance(title_string, str) or len(title_string.strip()) == 0:
             return matching_book_ids
 
-        title_string = title_string.strip()
-
-        for book in self.__books:
-            if title_string.lower() in book.title.lower():
-                matching_book_ids.append(book.book_id)
-        return matching_book_ids
+        return self.__view().title_index.search(title_string.strip())
 
     def get_all_book_ids(self):
-        return [book.book_id for book in self.__books]
+        return [book.book_id for book in self.__view().books]
+
+    def filter_book_ids(self, book_ids=None, year: int = None, publisher_names: List[str] = None,
+                        min_pages: int = None, max_pages: int = None, ebook: bool = None):
+        if year is not None and not isinstance(year, int):
+            return []
+
+        snapshot = self.__view()
+        books, publishers, columns = self.__cached_columns
+        if books is not snapshot.books or publishers is not snapshot.publishers:
+            columns = CatalogColumns(snapshot.books)
+            if isinstance(snapshot, _Snapshot):
+                # A draft's collections may still change, so only structures built from a snapshot are kept
+                self.__cached_columns = (snapshot.books, snapshot.publishers, columns)
+
+        return columns.filter(book_ids, year, publisher_names, min_pages, max_pages, ebook)
+
+    def sort_book_ids(self, book_ids, sort_by: str):
+        sort_orders = self.__view().sort_orders
+        if sort_by not in sort_orders:
+            # Sort by title (alphabetical) by default
+            sort_by = 'alphabetical'
+        return sort_orders[sort_by].order(book_ids)
 
     def get_book_ids_by_year(self, year: int):
         if isinstance(year, int):
-            return [book.book_id for book in self.__books if year == book.release_year]
+            return list(self.__view().book_ids_by_year.get(year, []))
         return []
 
     # Author methods
     def add_author(self, author: Author):
-        self.__authors.append(author)
+        with self.__write() as draft:
+            draft.write('authors')[author.unique_id] = author
+
+    def add_authors(self, authors: List[Author]):
+        with self.__write() as draft:
+            draft.write('authors').update((author.unique_id, author) for author in authors)
 
     def get_author(self, author_id: int):
-        for author in self.__authors:
-            if author.unique_id == author_id:
-                return author
-        return None
+        return self.__view().authors.get(author_id)
 
     def get_authors(self):
-        return self.__authors
+        return list(self.__view().authors.values())
 
     def get_book_ids_by_author(self, author: Author):
-        return [book.book_id for book in self.__books if author in book.authors]
+        if not isinstance(author, Author):
+            return []
+
+        snapshot = self.__view()
+        book_ids = set(snapshot.book_ids_by_author.get(author.unique_id, []))
+
+        # Associations made after a Book was added are only on the repository's copy of the Author
+        stored_author = snapshot.authors.get(author.unique_id)
+        if stored_author is not None:
+            book_ids.update(book.book_id for book in stored_author.books
+                            if snapshot.books_index.get(book.book_id) is book)
+
+        # The Book's authors may have changed since it was added
+        return sorted(book_id for book_id in book_ids if author in snapshot.books_index[book_id].authors)
 
     def get_book_ids_by_multiple_authors(self, author_list: List[Author]):
         book_ids = []
@@ -118,27 +468,69 @@ class MemoryRepository(AbstractRepository):
 
         author_string = author_string.strip()
 
-        for author in self.__authors:
+        for author in self.__view().authors.values():
             if author_string.lower() in author.full_name.lower():
                 matching_authors.append(author)
         return matching_authors
 
+    def __coauthor_graph(self) -> CoauthorGraph:
+        snapshot = self.__view()
+        books, authors, coauthor_graph = self.__cached_coauthor_graph
+        if books is not snapshot.books or authors is not snapshot.authors:
+            coauthor_graph = CoauthorGraph([author.unique_id for author in book.authors] for book in snapshot.books)
+            if isinstance(snapshot, _Snapshot):
+                self.__cached_coauthor_graph = (snapshot.books, snapshot.authors, coauthor_graph)
+        return coauthor_graph
+
+    def get_coauthors(self, author_id: int) -> List[Author]:
+        authors = self.__view().authors
+        return [authors[coauthor_id] for coauthor_id in self.__coauthor_graph().coauthor_ids(author_id)
+                if coauthor_id in authors]
+
+    def get_related_authors(self, author_id: int, max_depth: int = 2) -> List[Author]:
+        authors = self.__view().authors
+        return [authors[related_id] for related_id in self.__coauthor_graph().related_author_ids(author_id, max_depth)
+                if related_id in authors]
+
     # Publisher methods
     def add_publisher(self, publisher: Publisher):
-        self.__publishers.add(publisher)
+        with self.__write() as draft:
+            # Publishers are unique by name, so an existing Publisher is not replaced
+            if publisher.name not in draft.publishers:
+                draft.write('publishers')[publisher.name] = publisher
+
+    def add_publishers(self, publishers: List[Publisher]):
+        with self.__write() as draft:
+            new_publishers = [publisher for publisher in publishers if publisher.name not in draft.publishers]
+            if len(new_publishers) > 0:
+                stored_publishers = draft.write('publishers')
+                for publisher in new_publishers:
+                    stored_publishers.setdefault(publisher.name, publisher)
 
     def get_publisher(self, publisher_name: str):
-        for publisher in self.__publishers:
-            if publisher.name == publisher_name:
-                return publisher
+        if isinstance(publisher_name, str):
+            return self.__view().publishers.get(publisher_name)
         return None
 
     def get_publishers(self):
         # Do not return publisher with name "N/A"
-        return [publisher for publisher in self.__publishers if publisher.name != "N/A"]
+        return [publisher for publisher in self.__view().publishers.values() if publisher.name != "N/A"]
 
     def get_book_ids_by_publisher(self, publisher: Publisher):
-        return [book.book_id for book in self.__books if publisher == book.publisher]
+        if not isinstance(publisher, Publisher):
+            return []
+
+        snapshot = self.__view()
+        book_ids = set(snapshot.book_ids_by_publisher.get(publisher.name, []))
+
+        # Associations made after a Book was added are only on the repository's copy of the Publisher
+        stored_publisher = snapshot.publishers.get(publisher.name)
+        if stored_publisher is not None:
+            book_ids.update(book.book_id for book in stored_publisher.books
+                            if snapshot.books_index.get(book.book_id) is book)
+
+        # The Book's publisher may have changed since it was added
+        return sorted(book_id for book_id in book_ids if snapshot.books_index[book_id].publisher == publisher)
 
     def get_book_ids_by_multiple_publishers(self, publisher_list: List[Publisher]):
         book_ids = []
@@ -155,7 +547,7 @@ class MemoryRepository(AbstractRepository):
 
         publisher_string = publisher_string.strip()
 
-        for publisher in self.__publishers:
+        for publisher in self.__view().publishers.values():
             if publisher_string.lower() in publisher.name.lower():
                 matching_publishers.append(publisher)
         return matching_publishers
@@ -164,7 +556,30 @@ class MemoryRepository(AbstractRepository):
     def add_review(self, review: Review):
         # Call parent class first, add_review relies on implementation of code common to all derived classes
         super().add_review(review)
-        self.__reviews.insert(0, review)
+
+        # The review was attached to its Book and User in place by make_review, only the review log and sort orders
+        # are published with the snapshot, see _Snapshot
+        with self.__write() as draft:
+            draft.write('reviews').append(review)
+
+            # Move the reviewed Book to its new place in the review-based sort orders
+            book = review.book
+            if draft.books_index.get(book.book_id) is book:
+                for sort_by in REVIEW_SORT_ORDERS:
+                    draft.write_sort_order(sort_by).set(book.book_id, SORT_KEYS[sort_by](book))
+
+            sequence = self.__log_change({'type': 'review', 'user_name': review.user.user_name,
+                                          'book_id': book.book_id, 'review_text': review.review_text,
+                                          'rating': review.rating, 'timestamp': review.timestamp.isoformat()})
+        self.__sync_log(sequence)
+
+    def get_reviews_for_book(self, book_id: int, offset: int = 0, limit: int = None) -> List[Review]:
+        book = self.get_book(book_id)
+        if book is None:
+            return []
+        stop = None if limit is None else offset + limit
+        return list(islice(book.reviews, offset, stop))
 
     def get_reviews(self):
-        return self.__reviews
\ No newline at end of file
+        # Newest first
+        return list(self.__view().reviews)
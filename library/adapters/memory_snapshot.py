@@ -0,0 +1,274 @@
+import json
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Tuple
+
+from library.adapters.file_sync import sync_directory
+from library.domain.model import Publisher, Author, Book, User, Review
+
+# Snapshot files start with MAGIC, the format version, the payload length and a CRC-32 checksum of the payload
+MAGIC = b'SPINEBND'
+FORMAT_VERSION = 2
+# Version 1 snapshots have no write-ahead log section, and are read as holding no log records
+READABLE_VERSIONS = (1, FORMAT_VERSION)
+HEADER = struct.Struct('<8sHQI')
+
+# Stored in place of None for numbers and strings
+MISSING = -1
+
+# Review timestamps are stored as microseconds since this date, which keeps naive datetimes exact
+EPOCH = datetime(1, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class SnapshotException(Exception):
+    pass
+
+
+class _Writer:
+
+    def __init__(self):
+        self.__parts = []
+
+    def number(self, fmt: str, value):
+        self.__parts.append(struct.pack('<' + fmt, value))
+
+    def string(self, value: str):
+        if value is None:
+            self.number('i', MISSING)
+        else:
+            encoded = value.encode('utf-8')
+            self.number('i', len(encoded))
+            self.__parts.append(encoded)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.__parts)
+
+
+class _Reader:
+
+    def __init__(self, payload: bytes):
+        self.__payload = memoryview(payload)
+        self.__offset = 0
+
+    def number(self, fmt: str):
+        fmt = struct.Struct('<' + fmt)
+        value, = fmt.unpack_from(self.__payload, self.__offset)
+        self.__offset += fmt.size
+        return value
+
+    def string(self):
+        length = self.number('i')
+        if length == MISSING:
+            return None
+        value = str(self.__payload[self.__offset:self.__offset + length], 'utf-8')
+        self.__offset += length
+        return value
+
+
+def _optional_number(value):
+    return MISSING if value is None else int(value)
+
+
+def save_snapshot(path: Path, repo: 'MemoryRepository', log_sequence: int = 0, log_records: List[dict] = ()):
+    """ Writes the Books, Authors, Publishers, Users, Reviews and favourites in repo to a snapshot file.
+
+    log_records are the write-ahead log records, up to log_sequence, of the changes folded into repo, which are
+    kept so they can be applied again if the repository is repopulated from newer data files.
+    """
+    writer = _Writer()
+
+    writer.number('Q', log_sequence)
+    writer.string(json.dumps(list(log_records), separators=(',', ':')))
+
+    publishers = list(repo.get_publishers())
+    if repo.get_publisher("N/A") is not None:
+        publishers.append(repo.get_publisher("N/A"))
+    publisher_numbers = {publisher.name: number for number, publisher in enumerate(publishers)}
+    writer.number('I', len(publishers))
+    for publisher in publishers:
+        writer.string(publisher.name)
+
+    authors = repo.get_authors()
+    writer.number('I', len(authors))
+    for author in authors:
+        writer.number('q', author.unique_id)
+        writer.string(author.full_name)
+
+    books = repo.get_books(repo.get_all_book_ids())
+    writer.number('I', len(books))
+    for book in books:
+        writer.number('q', book.book_id)
+        writer.string(book.title)
+        writer.string(book.description)
+        writer.number('i', MISSING if book.publisher is None else publisher_numbers.get(book.publisher.name, MISSING))
+        writer.number('i', _optional_number(book.release_year))
+        writer.number('b', _optional_number(book.ebook))
+        writer.number('i', _optional_number(book.num_pages))
+        writer.string(book.image_url)
+        writer.number('I', len(book.authors))
+        for author in book.authors:
+            writer.number('q', author.unique_id)
+
+    users = {user.user_name: user for user in repo.get_users()}
+    reviews = list(repo.get_reviews())
+    for review in reviews:
+        users.setdefault(review.user.user_name, review.user)
+
+    book_ids = {book.book_id for book in books}
+    user_numbers = {user_name: number for number, user_name in enumerate(users)}
+    writer.number('I', len(users))
+    for user in users.values():
+        writer.string(user.user_name)
+        writer.string(user.password)
+        favourite_ids = [book.book_id for book in user.favourites if book.book_id in book_ids]
+        writer.number('I', len(favourite_ids))
+        for book_id in favourite_ids:
+            writer.number('q', book_id)
+
+    # Reviews are stored oldest first, so they can be added back in the same order
+    writer.number('I', len(reviews))
+    for review in reversed(reviews):
+        writer.number('i', user_numbers[review.user.user_name])
+        writer.number('q', review.book.book_id)
+        writer.string(review.review_text)
+        writer.number('b', review.rating)
+        writer.number('q', (review.timestamp - EPOCH) // MICROSECOND)
+
+    payload = writer.getvalue()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(payload), zlib.crc32(payload))
+
+    # Write to a temporary file first so a partly written snapshot is never loaded
+    # Named for this process, as several worker processes may save the same snapshot at once
+    temporary_path = Path(f'{path}.{os.getpid()}.tmp')
+    # The snapshot is flushed to disk before it replaces the old one, and the replacement before this returns, as
+    # the write-ahead log records folded into it are removed from the log once it is saved
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(payload)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+    sync_directory(Path(path).parent)
+
+
+def _open_snapshot(path: Path) -> Tuple[_Reader, int, List[dict]]:
+    """ Checks the snapshot file, then returns a reader of its contents after the write-ahead log section, and
+    the log sequence and records of that section """
+    with open(path, 'rb') as snapshot_file:
+        header = snapshot_file.read(HEADER.size)
+        payload = snapshot_file.read()
+
+    if len(header) < HEADER.size:
+        raise SnapshotException(f'{path} is not a snapshot')
+    magic, version, length, checksum = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise SnapshotException(f'{path} is not a snapshot')
+    if version not in READABLE_VERSIONS:
+        raise SnapshotException(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise SnapshotException(f'{path} is corrupt')
+
+    reader = _Reader(payload)
+    if version == 1:
+        return reader, 0, []
+    return reader, reader.number('Q'), json.loads(reader.string())
+
+
+def read_snapshot_log(path: Path) -> Tuple[int, List[dict]]:
+    """ Returns the sequence number and records of the write-ahead log records folded into a snapshot file """
+    _, log_sequence, log_records = _open_snapshot(path)
+    return log_sequence, log_records
+
+
+def load_snapshot(path: Path, repo: 'MemoryRepository') -> int:
+    """ Adds everything stored in the snapshot file to repo, and returns the sequence number of the last
+    write-ahead log record folded into it.
+
+    Raises SnapshotException if the file is not a snapshot, was written by a different format version, fails
+    its checksum or has a review of a book it doesn't contain. Nothing is added to repo in that case.
+    """
+    reader, log_sequence, _ = _open_snapshot(path)
+
+    # Snapshots are written from validated domain objects and checksummed, so their values are trusted
+    publishers = [Publisher.from_trusted_record(reader.string()) for _ in range(reader.number('I'))]
+
+    authors = dict()
+    for _ in range(reader.number('I')):
+        author = Author.from_trusted_record(reader.number('q'), reader.string())
+        authors[author.unique_id] = author
+
+    books = dict()
+    for _ in range(reader.number('I')):
+        book_id = reader.number('q')
+        title = reader.string()
+        description = reader.string()
+        publisher_number = reader.number('i')
+        release_year = reader.number('i')
+        ebook = reader.number('b')
+        num_pages = reader.number('i')
+        image_url = reader.string()
+
+        book = Book.from_trusted_record(book_id, title, description,
+                                        None if release_year == MISSING else release_year,
+                                        None if ebook == MISSING else bool(ebook),
+                                        None if num_pages == MISSING else num_pages,
+                                        image_url)
+        if publisher_number != MISSING:
+            book.publisher = publishers[publisher_number]
+            publishers[publisher_number].add_book(book)
+
+        for _ in range(reader.number('I')):
+            author = authors[reader.number('q')]
+            book.add_author(author)
+            author.add_book(book)
+        books[book.book_id] = book
+
+    users = []
+    for _ in range(reader.number('I')):
+        user = User(reader.string(), reader.string())
+        for _ in range(reader.number('I')):
+            book = books[reader.number('q')]
+            user.favourite_a_book(book)
+            book.add_user(user)
+        users.append(user)
+
+    reviews = []
+    for _ in range(reader.number('I')):
+        user = users[reader.number('i')]
+        book_id = reader.number('q')
+        if book_id not in books:
+            # Reviews of books which were not in the repository are saved, but can't be restored
+            raise SnapshotException(f'{path} has a review of book {book_id}, which it does not contain')
+        book = books[book_id]
+        review_text = reader.string()
+        rating = reader.number('b')
+        timestamp = EPOCH + reader.number('q') * MICROSECOND
+        review = Review(user, book, review_text, rating, timestamp)
+        user.add_review(review)
+        book.add_review(review)
+        reviews.append(review)
+
+    with repo.batch():
+        repo.add_books(list(books.values()))
+        repo.add_publishers(publishers)
+        repo.add_authors(list(authors.values()))
+        for user in users:
+            repo.add_user(user)
+        for review in reviews:
+            repo.add_review(review)
+    return log_sequence
+
+
+def snapshot_is_current(path: Path, data_path: Path) -> bool:
+    """ Returns True if the snapshot file exists and is newer than every file in the data directory """
+    path = Path(path)
+    if not path.exists():
+        return False
+
+    snapshot_time = path.stat().st_mtime
+    return all(data_file.stat().st_mtime < snapshot_time for data_file in Path(data_path).iterdir()
+               if data_file.is_file())
@@ -1,11 +1,30 @@
 from sqlalchemy import (
     Table, MetaData, Column, Integer, String, Boolean, Date, DateTime,
-    ForeignKey
+    ForeignKey, TypeDecorator
 )
-from sqlalchemy.orm import mapper, relationship, synonym
+from sqlalchemy.orm import mapper, relationship, synonym, configure_mappers
+from sqlalchemy.orm.instrumentation import manager_of_class
 
 from library.domain import model
 
+
+class RatingHistogram(TypeDecorator):
+    """ Stores a Book's number of ratings from 1 to 5 as comma-separated counts """
+
+    impl = String(64)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return ','.join(str(count) for count in value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return tuple(int(count) for count in value.split(','))
+
+
 # global variable giving access to the MetaData (schema) information of the database
 metadata = MetaData()
 
@@ -48,6 +67,10 @@ books_table = Table(
     Column('ebook', Boolean, default=False),
     Column('num_pages', Integer, nullable=True),
     Column('image_url', String(255), nullable=False),
+    # Rating aggregates, kept up to date as reviews are added
+    Column('rating_count', Integer, nullable=False, server_default='0'),
+    Column('rating_total', Integer, nullable=False, server_default='0'),
+    Column('rating_histogram', RatingHistogram, nullable=False, server_default='0,0,0,0,0'),
 )
 
 book_authors_table = Table(
@@ -65,11 +88,43 @@ user_favourites_table = Table(
 )
 
 
+# Hash of the content each Book was last imported with, so an import can skip the Books which haven't changed
+book_content_hashes_table = Table(
+    'book_content_hashes', metadata,
+    Column('book_id', ForeignKey('books.id'), primary_key=True),
+    Column('content_hash', String(32), nullable=False),
+)
+
+# Progress of a resumable import, which has a single row, see database_import.populate_resumably
+import_checkpoints_table = Table(
+    'import_checkpoints', metadata,
+    Column('id', Integer, primary_key=True),
+    # Hash of the sizes and modification times of the data files being imported
+    Column('source', String(32), nullable=False),
+    Column('stage', String(16), nullable=False),
+    Column('books_offset', Integer, nullable=False),
+    Column('last_author_id', Integer, nullable=True),
+    Column('users_loaded', Integer, nullable=False),
+    Column('reviews_loaded', Integer, nullable=False),
+)
+
+
+def new_instance(cls):
+    # Instances of mapped classes are created by their class manager, which gives them their ORM state
+    manager = manager_of_class(cls)
+    if manager is None:
+        return cls.__new__(cls)
+    return manager.new_instance()
+
+
 def map_model_to_tables():
+    # The trusted constructors of the domain classes create instances without calling __init__
+    model.new_instance = new_instance
     mapper(model.User, users_table, properties={
         '_User__user_name': users_table.c.user_name,
         '_User__password': users_table.c.password,
-        '_User__reviews': relationship(model.Review, backref='_Review__user'),
+        # Reviews are loaded in the order they were added, as the domain model stores them
+        '_User__reviews': relationship(model.Review, backref='_Review__user', order_by=reviews_table.c.id),
         '_User__favourites': relationship(
             model.Book,
             secondary=user_favourites_table,
@@ -100,7 +155,10 @@ def map_model_to_tables():
         '_Book__ebook': books_table.c.ebook,
         '_Book__num_pages': books_table.c.num_pages,
         '_Book__image_url': books_table.c.image_url,
-        '_Book__reviews': relationship(model.Review, backref='_Review__book'),
+        '_Book__rating_count': books_table.c.rating_count,
+        '_Book__rating_total': books_table.c.rating_total,
+        '_Book__rating_histogram': books_table.c.rating_histogram,
+        '_Book__reviews': relationship(model.Review, backref='_Review__book', order_by=reviews_table.c.id),
         '_Book__authors': relationship(
             model.Author,
             secondary=book_authors_table,
@@ -110,4 +168,5 @@ def map_model_to_tables():
             secondary=user_favourites_table,
             back_populates='_User__favourites')
     })
-
+    # Mappers are otherwise configured when the first instance is initialised, which the trusted constructors skip
+    configure_mappers()
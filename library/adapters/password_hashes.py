@@ -0,0 +1,66 @@
+import csv
+import hashlib
+import hmac
+import os
+from pathlib import Path
+from typing import Dict, List
+
+from werkzeug.security import generate_password_hash
+
+from library.adapters.json_data_reader import process_pool
+
+# Header of the password column in a users file whose passwords are already hashed
+PASSWORD_HASH_COLUMN = 'password_hash'
+
+
+def hash_passwords(passwords: List[str], workers: int = 1) -> List[str]:
+    """ Returns the hash of each password, computed by a pool of that many processes when workers is more than 1 """
+    if workers <= 1 or len(passwords) <= 1:
+        return [generate_password_hash(password) for password in passwords]
+
+    with process_pool(workers) as executor:
+        # Several passwords are sent to a process at a time, as each hash takes tens of milliseconds
+        return list(executor.map(generate_password_hash, passwords,
+                                 chunksize=max(1, len(passwords) // (4 * workers))))
+
+
+class PasswordHashCache:
+    """ File of the password hashes computed for users loaded from a users file, reused by later loads.
+
+    Hashes are keyed on an HMAC of the user name and plaintext password, keyed with the application's secret key,
+    so the file doesn't give away anything about the passwords beyond their salted hashes. Each user keeps their own
+    salted hash, and a user whose password changes in the users file is hashed again. Several processes can share
+    the file, which is replaced rather than rewritten in place.
+    """
+
+    def __init__(self, path: Path, secret_key: str):
+        if not secret_key:
+            # Without a secret key, the keys of the file would be plain hashes of the user names and passwords
+            raise ValueError('A secret key is needed to cache password hashes')
+
+        self.__path = Path(path)
+        self.__secret_key = secret_key.encode('utf-8')
+        self.__hashes = dict()
+        if self.__path.exists():
+            with open(self.__path, encoding='utf-8', newline='') as cache_file:
+                self.__hashes = {key: password_hash for key, password_hash in csv.reader(cache_file)}
+
+    def __len__(self):
+        return len(self.__hashes)
+
+    def key(self, user_name: str, password: str) -> str:
+        return hmac.new(self.__secret_key, f'{user_name}\0{password}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, key: str):
+        return self.__hashes.get(key)
+
+    def update(self, hashes: Dict[str, str]):
+        """ Adds the given hashes by key, and saves the file """
+        self.__hashes.update(hashes)
+
+        # Write to a temporary file first so a partly written file is never read
+        # Each process uses its own temporary file, as several workers may save the same file at once
+        temporary_path = Path(f'{self.__path}.{os.getpid()}.tmp')
+        with open(temporary_path, 'w', encoding='utf-8', newline='') as cache_file:
+            csv.writer(cache_file).writerows(self.__hashes.items())
+        os.replace(temporary_path, self.__path)
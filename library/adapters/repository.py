@@ -1,4 +1,5 @@
 import abc
+from contextlib import contextmanager
 from typing import List
 
 from library.domain.model import Publisher, Author, Book, User, Review
@@ -13,6 +14,14 @@ class RepositoryException(Exception):
 
 
 class AbstractRepository(abc.ABC):
+    @contextmanager
+    def batch(self):
+        """ Groups the writes made inside the with block so that they are applied together.
+
+        By default each write is applied as it is made.
+        """
+        yield
+
     @abc.abstractmethod
     def add_user(self, user: User):
         """ Adds a User to the repository. """
@@ -36,6 +45,11 @@ class AbstractRepository(abc.ABC):
         """ Adds a Book to the repository """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def add_books(self, books: List[Book]):
+        """ Adds many Books to the repository at once, as if each was added with add_book """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_book(self, book_id: int) -> Book:
         """ Returns Book with matching id from the repository
@@ -92,11 +106,36 @@ class AbstractRepository(abc.ABC):
         """ Returns id of Book objects in the repository which were published in the given year """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def filter_book_ids(self, book_ids=None, year: int = None, publisher_names: List[str] = None,
+                        min_pages: int = None, max_pages: int = None, ebook: bool = None):
+        """ Returns id of Book objects in the repository which match all of the given filters, in ascending order.
+
+        If book_ids is given, only those Books are considered. Filters which are None are not applied, and Books
+        with an unknown number of pages never match a page filter.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def sort_book_ids(self, book_ids, sort_by: str):
+        """ Returns the ids in book_ids which belong to Books in the repository, ordered by sort_by.
+
+        sort_by is one of 'ascending' or 'descending' (release year, unknown years last), 'best_reviewed'
+        (average rating), 'most_reviewed' (number of reviews) or 'alphabetical' (title), which is also used for
+        any other value. Ties are broken by ascending book id.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def add_author(self, author: Author):
         """ Adds an Author to the repository """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def add_authors(self, authors: List[Author]):
+        """ Adds many Authors to the repository at once, as if each was added with add_author """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_author(self, author_id: int) -> Author:
         """ Returns Author with matching id from the repository
@@ -115,11 +154,29 @@ class AbstractRepository(abc.ABC):
         """ Returns all Author objects in the repository which have names that contain the input string """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_coauthors(self, author_id: int) -> List[Author]:
+        """ Returns the Authors who have written a Book with the Author with the given id, in ascending id order """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_related_authors(self, author_id: int, max_depth: int = 2) -> List[Author]:
+        """ Returns the Authors linked to the Author with the given id by a chain of at most max_depth coauthors
+
+        The nearest Authors come first, and Authors at the same distance are in ascending id order.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def add_publisher(self, publisher: Publisher):
         """ Adds a Publisher to the repository """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def add_publishers(self, publishers: List[Publisher]):
+        """ Adds many Publishers to the repository at once, as if each was added with add_publisher """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_publisher(self, publisher_name: str) -> Publisher:
         """ Returns Publisher with matching name from the repository
@@ -150,6 +207,15 @@ class AbstractRepository(abc.ABC):
         if review.book is None or review not in review.book.reviews:
             raise RepositoryException('Review not correctly attached to a Book')
 
+    @abc.abstractmethod
+    def get_reviews_for_book(self, book_id: int, offset: int = 0, limit: int = None) -> List[Review]:
+        """ Returns the Reviews of the Book with the given id, newest first.
+
+        The first offset Reviews are skipped and at most limit Reviews are returned, or all the remaining Reviews
+        if limit is None. If there is no Book with the given id, this method returns an empty list.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_reviews(self):
         """ Returns the Reviews stored in the repository. """
@@ -1,15 +1,28 @@
 from pathlib import Path
 
+from library.adapters.database_repository import SqlAlchemyRepository
+from library.adapters.password_hashes import PasswordHashCache
 from library.adapters.repository import AbstractRepository
 from library.adapters.json_data_importer import load_reviews, load_users, load_books_authors_and_publishers
 
 
-def populate(data_path: Path, repo: AbstractRepository, database_mode: bool):
-    # Load books, authors and publishers into the repository
-    load_books_authors_and_publishers(data_path, repo, database_mode)
+def populate(data_path: Path, repo: AbstractRepository, database_mode: bool, workers: int = 1,
+             catalog_path: Path = None, password_hashes: PasswordHashCache = None):
+    if database_mode and isinstance(repo, SqlAlchemyRepository):
+        # The database is written with bulk inserts in a single transaction, rather than one object at a time
+        # through the repository's session
+        repo.populate_in_bulk(data_path, workers, catalog_path, password_hashes)
+        return
 
-    # Load users into the repository
-    users = load_users(data_path, repo)
+    with repo.batch():
+        # Load books, authors and publishers into the repository, from a catalog file compiled from the data files
+        # if one is given, otherwise parsing the books file with the given number of processes
+        load_books_authors_and_publishers(data_path, repo, database_mode, workers, catalog_path)
+
+        # Load users into the repository, hashing their passwords with the given number of processes unless they
+        # are in password_hashes
+        users = load_users(data_path, repo, workers, password_hashes)
+
+        # Load reviews into the repository
+        load_reviews(data_path, repo, users)
 
-    # Load reviews into the repository
-    load_reviews(data_path, repo, users)
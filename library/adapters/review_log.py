@@ -0,0 +1,35 @@
+from typing import List
+
+from library.domain.model import Review
+
+
+class ReviewLog:
+    """ Append-only log of Reviews, read newest first.
+
+    Copies share the underlying list and each only reads the Reviews appended before it was made (or appended
+    to it), so copying and appending are both O(1). A copy which appends after another copy has appended
+    discards the other copy's later Reviews, so only the newest copy should be appended to.
+    """
+
+    def __init__(self):
+        self.__reviews: List[Review] = list()
+        self.__length = 0
+
+    def append(self, review: Review):
+        if len(self.__reviews) > self.__length:
+            # Reviews appended by a newer copy which was discarded
+            del self.__reviews[self.__length:]
+        self.__reviews.append(review)
+        self.__length += 1
+
+    def __iter__(self):
+        return reversed(self.__reviews[:self.__length])
+
+    def __len__(self):
+        return self.__length
+
+    def copy(self) -> 'ReviewLog':
+        review_log = ReviewLog()
+        review_log.__reviews = self.__reviews
+        review_log.__length = self.__length
+        return review_log
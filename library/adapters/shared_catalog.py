@@ -0,0 +1,441 @@
+import array
+import mmap
+import os
+import struct
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from library.adapters.json_data_reader import BATCH_SIZE
+from library.adapters.memory_snapshot import snapshot_is_current
+from library.adapters.sort_orders import alphabetical_key, ascending_key, descending_key
+from library.domain.model import Book
+
+# Catalog files start with MAGIC, the format version and the number of sections, followed by a table giving the
+# name, typecode, offset and number of items of each section
+MAGIC = b'SPNCATLG'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sHI')
+SECTION = struct.Struct('<16s1sxxxxxxxQQ')
+
+# Stored in place of None for numbers
+MISSING = -1
+
+# Separates the lowercased strings which are searched, so a match can't run from one string into the next
+SEPARATOR = b'\x00'
+
+# Static sort orders which are stored in the catalog, the review-based ones are kept by each process
+STATIC_SORT_KEYS = {
+    'alphabetical': alphabetical_key,
+    'ascending': ascending_key,
+    'descending': descending_key
+}
+
+
+class _Sections:
+
+    def __init__(self):
+        self.sections = dict()
+
+    def numbers(self, name: str, typecode: str, values):
+        self.sections[name] = (typecode, array.array(typecode, values))
+
+    def strings(self, name: str, values: List[str], lowercase=False, nullable=False):
+        """ Stores values in one byte heap, with an index of n + 1 offsets into it. None is stored as an empty
+        string, and if nullable, the rows whose value is None are also listed in ascending order """
+        offsets = array.array('q', [0])
+        parts = []
+        position = 0
+        for value in values:
+            encoded = (value or '').encode('utf-8')
+            if lowercase:
+                encoded = (value or '').lower().encode('utf-8') + SEPARATOR
+            parts.append(encoded)
+            position += len(encoded)
+            offsets.append(position)
+        self.sections[name] = ('B', b''.join(parts))
+        self.sections[name + '_ix'] = ('q', offsets)
+        if nullable:
+            self.sections[name + '_nul'] = ('q', array.array('q', [row for row, value in enumerate(values)
+                                                                   if value is None]))
+
+    def csr(self, name: str, rows_per_item: List[List[int]]):
+        """ Stores a list of rows for each item as an index of n + 1 offsets into one array of rows """
+        offsets = array.array('q', [0])
+        rows = array.array('i')
+        for item_rows in rows_per_item:
+            rows.extend(item_rows)
+            offsets.append(len(rows))
+        self.sections[name] = ('i', rows)
+        self.sections[name + '_ix'] = ('q', offsets)
+
+
+def write_shared_catalog(path: Path, books, authors, publishers, file_order: List[int] = None):
+    """ Writes the given Books, Authors and Publishers to a catalog file which SharedCatalog can map.
+
+    file_order is the ids of the Books in the order they were read from the books file, which
+    SharedCatalog.read_book_batches yields them in. Without it they are yielded in book id order.
+    """
+    books = sorted(books)
+    authors = sorted(authors)
+    publishers = sorted(publishers)
+    author_rows = {author.unique_id: row for row, author in enumerate(authors)}
+    publisher_rows = {publisher.name: row for row, publisher in enumerate(publishers)}
+
+    sections = _Sections()
+    sections.numbers('book_id', 'q', [book.book_id for book in books])
+    sections.strings('title', [book.title for book in books])
+    sections.strings('ltitle', [book.title for book in books], lowercase=True)
+    sections.strings('descript', [book.description for book in books], nullable=True)
+    sections.strings('image', [book.image_url for book in books])
+    sections.numbers('year', 'i', [MISSING if book.release_year is None else book.release_year for book in books])
+    sections.numbers('pages', 'i', [MISSING if book.num_pages is None else book.num_pages for book in books])
+    sections.numbers('ebook', 'b', [MISSING if book.ebook is None else int(book.ebook) for book in books])
+    sections.numbers('pub', 'i', [MISSING if book.publisher is None else publisher_rows.get(book.publisher.name, MISSING)
+                                  for book in books])
+    sections.csr('b_auth', [[author_rows[author.unique_id] for author in book.authors
+                             if author.unique_id in author_rows] for book in books])
+
+    # Rows in the order of the books file, an id read more than once is at its first place
+    book_rows = {book.book_id: row for row, book in enumerate(books)}
+    file_rows = [book_rows.pop(book_id) for book_id in (file_order or []) if book_id in book_rows]
+    sections.numbers('f_order', 'i', file_rows + sorted(book_rows.values()))
+
+    author_books = [[] for _ in authors]
+    publisher_books = [[] for _ in publishers]
+    for row, book in enumerate(books):
+        for author in book.authors:
+            if author.unique_id in author_rows:
+                author_books[author_rows[author.unique_id]].append(row)
+        if book.publisher is not None and book.publisher.name in publisher_rows:
+            publisher_books[publisher_rows[book.publisher.name]].append(row)
+
+    sections.numbers('a_id', 'q', [author.unique_id for author in authors])
+    sections.strings('a_name', [author.full_name for author in authors])
+    sections.strings('la_name', [author.full_name for author in authors], lowercase=True)
+    sections.csr('a_books', author_books)
+    sections.strings('p_name', [publisher.name for publisher in publishers])
+    sections.strings('lp_name', [publisher.name for publisher in publishers], lowercase=True)
+    sections.csr('p_books', publisher_books)
+
+    for sort_by, sort_key in STATIC_SORT_KEYS.items():
+        order = sorted(range(len(books)), key=lambda row: (sort_key(books[row]), books[row].book_id))
+        ranks = array.array('i', bytes(4 * len(books)))
+        for rank, row in enumerate(order):
+            ranks[row] = rank
+        sections.numbers('o_' + sort_by[:6], 'i', order)
+        sections.sections['r_' + sort_by[:6]] = ('i', ranks)
+
+    # Lay the sections out after the section table, each starting on an 8 byte boundary
+    offset = HEADER.size + SECTION.size * len(sections.sections)
+    table, payloads = [], []
+    for name, (typecode, values) in sections.sections.items():
+        offset += -offset % 8
+        data = values.tobytes() if isinstance(values, array.array) else values
+        table.append(SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, len(values)))
+        payloads.append((offset, data))
+        offset += len(data)
+
+    # Write to a temporary file first so a partly written catalog is never mapped
+    # Each process uses its own temporary file, as several workers may build the same catalog at once
+    temporary_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(temporary_path, 'wb') as catalog_file:
+        catalog_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(table)))
+        catalog_file.write(b''.join(table))
+        for offset, data in payloads:
+            catalog_file.write(b'\0' * (offset - catalog_file.tell()))
+            catalog_file.write(data)
+    os.replace(temporary_path, path)
+
+
+class SharedCatalogException(Exception):
+    pass
+
+
+def catalog_is_current(path: Path, data_path: Path) -> bool:
+    """ Returns True if the catalog file is newer than every file in the data directory and has this format
+    version, otherwise it has to be compiled again """
+    if not snapshot_is_current(path, data_path):
+        return False
+    with open(path, 'rb') as catalog_file:
+        header = catalog_file.read(HEADER.size)
+    return len(header) == HEADER.size and HEADER.unpack(header)[:2] == (MAGIC, FORMAT_VERSION)
+
+
+class _BookRows:
+    """ Read-only mapping of book id to row, found by bisecting the catalog's sorted book ids """
+
+    def __init__(self, catalog: 'SharedCatalog'):
+        self.__catalog = catalog
+
+    def __getitem__(self, book_id):
+        row = self.__catalog.book_row(book_id)
+        if row is None:
+            raise KeyError(book_id)
+        return row
+
+    def __contains__(self, book_id):
+        return self.__catalog.book_row(book_id) is not None
+
+    def __len__(self):
+        return len(self.__catalog)
+
+
+class SharedCatalog:
+    """ Read-only catalog of Books, Authors and Publishers mapped from a file written by write_shared_catalog.
+
+    Every process which maps the same file shares its pages, and nothing is copied out of the mapping until a
+    single record is read. Rows are numbered in ascending book id (or author id, or publisher name) order.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as catalog_file:
+            self.__mmap = mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(self.__mmap)
+        magic, version, section_count = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise SharedCatalogException(f'{path} is not a catalog')
+        if version != FORMAT_VERSION:
+            raise SharedCatalogException(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+
+        self.__sections = dict()
+        self.__heaps = dict()
+        for number in range(section_count):
+            name, typecode, offset, length = SECTION.unpack_from(buffer, HEADER.size + number * SECTION.size)
+            name, typecode = name.rstrip(b'\0').decode('ascii'), typecode.decode('ascii')
+            size = struct.calcsize(typecode)
+            self.__sections[name] = buffer[offset:offset + length * size].cast(typecode)
+            self.__heaps[name] = (offset, offset + length)
+
+        self.__book_ids = self.__sections['book_id']
+        self.__author_ids = self.__sections['a_id']
+        self.__file_order = self.__sections['f_order']
+        self.__rows_without_description = set(self.__sections['descript_nul'].tolist())
+        self.__publisher_rows = {self.publisher_name(row): row for row in range(self.number_of_publishers())}
+
+    def section(self, name: str) -> memoryview:
+        return self.__sections[name]
+
+    # Strings
+    def __string(self, name: str, row: int) -> str:
+        offsets = self.__sections[name + '_ix']
+        return str(self.__sections[name][offsets[row]:offsets[row + 1]], 'utf-8')
+
+    def __strings(self, name: str, rows) -> List[str]:
+        """ Returns the strings of a range of rows, decoding them together, or of a list of rows """
+        if not isinstance(rows, range):
+            return [self.__string(name, row) for row in rows]
+
+        offsets = self.__sections[name + '_ix'][rows.start:rows.stop + 1].tolist()
+        first = offsets[0]
+        data = self.__sections[name][first:offsets[-1]].tobytes()
+        text = data.decode('utf-8')
+        if len(text) == len(data):
+            # Every character is a single byte, so the offsets of the bytes are those of the characters
+            return [text[offset - first:next_offset - first] for offset, next_offset in zip(offsets, offsets[1:])]
+        return [str(data[offset - first:next_offset - first], 'utf-8')
+                for offset, next_offset in zip(offsets, offsets[1:])]
+
+    def __search(self, name: str, query: str) -> List[int]:
+        """ Returns the rows, in ascending order, whose lowercased string contains the lowercased query """
+        query = query.lower().encode('utf-8')
+        start, end = self.__heaps[name]
+        offsets = self.__sections[name + '_ix']
+        rows = []
+
+        position = self.__mmap.find(query, start, end)
+        while position != -1:
+            row = bisect_right(offsets, position - start) - 1
+            row_end = start + offsets[row + 1] - len(SEPARATOR)
+            if position + len(query) <= row_end:
+                rows.append(row)
+                # Continue from the next string, as each row is only returned once
+                position = self.__mmap.find(query, row_end, end)
+            else:
+                position = self.__mmap.find(query, position + 1, end)
+        return rows
+
+    # Books
+    def __len__(self):
+        return len(self.__book_ids)
+
+    def book_row(self, book_id: int):
+        if not isinstance(book_id, int):
+            return None
+        row = bisect_right(self.__book_ids, book_id) - 1
+        if row >= 0 and self.__book_ids[row] == book_id:
+            return row
+        return None
+
+    def book_rows(self) -> _BookRows:
+        return _BookRows(self)
+
+    def book_id(self, row: int) -> int:
+        return self.__book_ids[row]
+
+    def book_ids(self, rows=None) -> List[int]:
+        if rows is None:
+            return self.__book_ids.tolist()
+        return [self.__book_ids[row] for row in rows]
+
+    def title(self, row: int) -> str:
+        return self.__string('title', row)
+
+    def description(self, row: int) -> str:
+        if row in self.__rows_without_description:
+            return None
+        return self.__string('descript', row)
+
+    def image_url(self, row: int) -> str:
+        return self.__string('image', row)
+
+    def release_year(self, row: int):
+        year = self.__sections['year'][row]
+        return None if year == MISSING else year
+
+    def num_pages(self, row: int):
+        num_pages = self.__sections['pages'][row]
+        return None if num_pages == MISSING else num_pages
+
+    def ebook(self, row: int):
+        ebook = self.__sections['ebook'][row]
+        return None if ebook == MISSING else bool(ebook)
+
+    def publisher_row(self, row: int):
+        publisher_row = self.__sections['pub'][row]
+        return None if publisher_row == MISSING else publisher_row
+
+    def book_author_rows(self, row: int) -> List[int]:
+        offsets = self.__sections['b_auth_ix']
+        return self.__sections['b_auth'][offsets[row]:offsets[row + 1]].tolist()
+
+    def read_book_batches(self, batch_size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+        """ Yields the books in lists of at most batch_size (book, publisher name, authors) records, in the order of
+        the books file the catalog was compiled from.
+
+        The records are equal to those which BooksJSONReader.read_book_batches reads from that file, with each Book
+        created by Book.from_trusted_record, except that a book id read more than once is only yielded once, and
+        publisher name is the name of the Book's Publisher. Each column of a batch of consecutive rows is read
+        from the mapping in bulk.
+        """
+        author_ids = [str(author_id) for author_id in self.__author_ids.tolist()]
+        authors = list(zip(author_ids, self.__strings('a_name', range(len(author_ids)))))
+        # Books without a publisher have the row MISSING, which is the last item
+        publisher_names = self.__strings('p_name', range(self.number_of_publishers())) + [""]
+        ebook_values = {MISSING: None, 0: False, 1: True}
+
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            rows = self.__file_order[start:end].tolist()
+            if rows == list(range(rows[0], rows[0] + len(rows))):
+                # Consecutive rows, whose columns are read in bulk
+                rows = range(rows[0], rows[0] + len(rows))
+
+            descriptions = self.__strings('descript', rows)
+            if len(self.__rows_without_description) > 0:
+                descriptions = [None if row in self.__rows_without_description else description
+                                for row, description in zip(rows, descriptions)]
+            books = map(Book.from_trusted_record,
+                        self.__numbers('book_id', rows),
+                        self.__strings('title', rows),
+                        descriptions,
+                        [None if year == MISSING else year for year in self.__numbers('year', rows)],
+                        map(ebook_values.__getitem__, self.__numbers('ebook', rows)),
+                        [None if pages == MISSING else pages for pages in self.__numbers('pages', rows)],
+                        [image_url or None for image_url in self.__strings('image', rows)])
+
+            yield list(zip(books,
+                           map(publisher_names.__getitem__, self.__numbers('pub', rows)),
+                           self.__book_authors(rows, authors)))
+
+    def __numbers(self, name: str, rows) -> list:
+        section = self.__sections[name]
+        if isinstance(rows, range):
+            return section[rows.start:rows.stop].tolist()
+        return [section[row] for row in rows]
+
+    def __book_authors(self, rows, authors: list) -> List[list]:
+        """ Returns the items of authors at the author rows of each of a range or list of book rows """
+        offsets = self.__sections['b_auth_ix']
+        author_rows = self.__sections['b_auth']
+        if not isinstance(rows, range):
+            return [list(map(authors.__getitem__, author_rows[offsets[row]:offsets[row + 1]].tolist())) for row in rows]
+
+        # The authors of every Book in the range are looked up together, and each Book then has a slice of them
+        offsets = offsets[rows.start:rows.stop + 1].tolist()
+        first = offsets[0]
+        all_authors = list(map(authors.__getitem__, author_rows[first:offsets[-1]].tolist()))
+        return [all_authors[offset - first:next_offset - first] for offset, next_offset in zip(offsets, offsets[1:])]
+
+    def search_titles(self, query: str) -> List[int]:
+        return self.__search('ltitle', query)
+
+    def book_rows_by_year(self, year: int) -> List[int]:
+        # Rows in ascending year order, with unknown years at the end
+        order = self.__sections['o_ascend']
+        years = self.__sections['year']
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            middle_year = years[order[middle]]
+            if middle_year != MISSING and middle_year < year:
+                low = middle + 1
+            else:
+                high = middle
+        rows = []
+        while low < len(order) and years[order[low]] == year:
+            rows.append(order[low])
+            low += 1
+        return rows
+
+    def sort_order(self, sort_by: str) -> memoryview:
+        return self.__sections['o_' + sort_by[:6]]
+
+    def sort_ranks(self, sort_by: str) -> memoryview:
+        return self.__sections['r_' + sort_by[:6]]
+
+    # Authors
+    def number_of_authors(self) -> int:
+        return len(self.__author_ids)
+
+    def author_row(self, author_id: int):
+        if not isinstance(author_id, int):
+            return None
+        row = bisect_right(self.__author_ids, author_id) - 1
+        if row >= 0 and self.__author_ids[row] == author_id:
+            return row
+        return None
+
+    def author_id(self, row: int) -> int:
+        return self.__author_ids[row]
+
+    def author_name(self, row: int) -> str:
+        return self.__string('a_name', row)
+
+    def author_book_rows(self, row: int) -> List[int]:
+        offsets = self.__sections['a_books_ix']
+        return self.__sections['a_books'][offsets[row]:offsets[row + 1]].tolist()
+
+    def search_author_names(self, query: str) -> List[int]:
+        return self.__search('la_name', query)
+
+    # Publishers
+    def number_of_publishers(self) -> int:
+        return len(self.__sections['p_name_ix']) - 1
+
+    def publisher_row_by_name(self, name: str):
+        return self.__publisher_rows.get(name)
+
+    def publisher_rows(self) -> Dict[str, int]:
+        return dict(self.__publisher_rows)
+
+    def publisher_name(self, row: int) -> str:
+        return self.__string('p_name', row)
+
+    def publisher_book_rows(self, row: int) -> List[int]:
+        offsets = self.__sections['p_books_ix']
+        return self.__sections['p_books'][offsets[row]:offsets[row + 1]].tolist()
+
+    def search_publisher_names(self, query: str) -> List[int]:
+        return self.__search('lp_name', query)
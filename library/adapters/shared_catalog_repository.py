@@ -0,0 +1,268 @@
+import threading
+from pathlib import Path
+from typing import List
+from weakref import WeakValueDictionary
+
+from library.adapters.catalog_columns import CatalogColumns
+from library.adapters.coauthor_graph import CoauthorGraph
+from library.adapters.json_data_importer import load_books_authors_and_publishers
+from library.adapters.memory_repository import MemoryRepository
+from library.adapters.repository import RepositoryException
+from library.adapters.shared_catalog import SharedCatalog, write_shared_catalog, STATIC_SORT_KEYS
+from library.adapters.sort_orders import SortOrder, SORT_KEYS, REVIEW_SORT_ORDERS
+from library.domain.model import Publisher, Author, Book, Review
+
+
+def build_shared_catalog(path: Path, repo: MemoryRepository, file_order: List[int] = None):
+    """ Writes the Books, Authors and Publishers in a populated MemoryRepository to a shared catalog file, see
+    write_shared_catalog for file_order """
+    publishers = repo.get_publishers()
+    if repo.get_publisher("N/A") is not None:
+        publishers.append(repo.get_publisher("N/A"))
+    write_shared_catalog(path, repo.get_books(repo.get_all_book_ids()), repo.get_authors(), publishers, file_order)
+
+
+def compile_shared_catalog(data_path: Path, path: Path, workers: int = 1):
+    """ Reads the books, authors and publishers in the data files and writes them to a shared catalog file """
+    catalog_repo = MemoryRepository()
+    with catalog_repo.batch():
+        file_order = load_books_authors_and_publishers(Path(data_path), catalog_repo, False, workers)
+    build_shared_catalog(path, catalog_repo, file_order)
+
+
+class SharedCatalogRepository(MemoryRepository):
+    """ Memory repository whose Books, Authors and Publishers are read from a SharedCatalog.
+
+    The catalog is mapped read-only, so every process using the same catalog file shares one copy of it. Domain
+    objects are only created when they are read, and are kept only while something refers to them: a Book stays
+    while it is reviewed, favourited or in use by a request, so this process's Users, Reviews and favourites,
+    which are stored exactly as in MemoryRepository, always refer to the same objects, while reading the whole
+    catalog (to sort it, say) does not keep all of it in this process's memory.
+
+    Authors and Publishers are created without their Books, so author.books and publisher.books are empty. Their
+    Books are looked up in the catalog by get_book_ids_by_author and get_book_ids_by_publisher instead.
+    """
+
+    def __init__(self, catalog_path: Path):
+        super().__init__()
+        self.__catalog = SharedCatalog(catalog_path)
+        self.__books = WeakValueDictionary()
+        self.__authors = WeakValueDictionary()
+        self.__publishers = WeakValueDictionary()
+        # Held while storing a new object, so threads creating the same object at once all use the first stored
+        self.__objects_lock = threading.Lock()
+
+        self.__columns = CatalogColumns.from_buffers(
+            self.__catalog.book_rows(),
+            self.__catalog.section('book_id'),
+            self.__catalog.section('year'),
+            self.__catalog.section('pages'),
+            self.__catalog.section('ebook'),
+            self.__catalog.section('pub'),
+            self.__catalog.publisher_rows()
+        )
+
+        # Review-based sort orders only hold reviewed Books, every other Book sorts after them by id. They are
+        # replaced rather than changed when a review is added, so readers never see a partly updated order
+        self.__review_sort_orders = {sort_by: SortOrder() for sort_by in REVIEW_SORT_ORDERS}
+        self.__review_lock = threading.Lock()
+
+        # The catalog never changes, so its coauthor graph is built once, when first needed
+        self.__coauthor_graph = None
+
+    # Creating domain objects from catalog rows
+    def __book(self, row: int) -> Book:
+        book_id = self.__catalog.book_id(row)
+        book = self.__books.get(book_id)
+        if book is not None:
+            return book
+
+        catalog = self.__catalog
+        book = Book(book_id, catalog.title(row))
+        book.description = catalog.description(row)
+        publisher_row = catalog.publisher_row(row)
+        if publisher_row is not None:
+            book.publisher = self.__publisher(publisher_row)
+        if catalog.release_year(row) is not None:
+            book.release_year = catalog.release_year(row)
+        book.ebook = catalog.ebook(row)
+        book.num_pages = catalog.num_pages(row)
+        book.image_url = catalog.image_url(row)
+        for author_row in catalog.book_author_rows(row):
+            book.add_author(self.__author(author_row))
+
+        with self.__objects_lock:
+            return self.__books.setdefault(book_id, book)
+
+    def __author(self, row: int) -> Author:
+        author_id = self.__catalog.author_id(row)
+        author = self.__authors.get(author_id)
+        if author is None:
+            author = Author(author_id, self.__catalog.author_name(row))
+            with self.__objects_lock:
+                author = self.__authors.setdefault(author_id, author)
+        return author
+
+    def __publisher(self, row: int) -> Publisher:
+        publisher = self.__publishers.get(row)
+        if publisher is None:
+            publisher = Publisher(self.__catalog.publisher_name(row))
+            with self.__objects_lock:
+                publisher = self.__publishers.setdefault(row, publisher)
+        return publisher
+
+    # Book methods
+    def add_book(self, book: Book):
+        raise RepositoryException('Books can not be added to a shared catalog')
+
+    def add_books(self, books: List[Book]):
+        raise RepositoryException('Books can not be added to a shared catalog')
+
+    def get_book(self, book_id: int) -> Book:
+        row = self.__catalog.book_row(book_id)
+        if row is None:
+            return None
+        return self.__book(row)
+
+    def get_books(self, id_list):
+        rows = [self.__catalog.book_row(book_id) for book_id in id_list]
+        return [self.__book(row) for row in rows if row is not None]
+
+    def get_number_of_books(self):
+        return len(self.__catalog)
+
+    def partial_search_books_by_title(self, title_string: str):
+        if not isinstance(title_string, str) or len(title_string.strip()) == 0:
+            return []
+        return self.__catalog.book_ids(self.__catalog.search_titles(title_string.strip()))
+
+    def get_all_book_ids(self):
+        return self.__catalog.book_ids()
+
+    def filter_book_ids(self, book_ids=None, year: int = None, publisher_names: List[str] = None,
+                        min_pages: int = None, max_pages: int = None, ebook: bool = None):
+        if year is not None and not isinstance(year, int):
+            return []
+        return self.__columns.filter(book_ids, year, publisher_names, min_pages, max_pages, ebook)
+
+    def sort_book_ids(self, book_ids, sort_by: str):
+        if sort_by in REVIEW_SORT_ORDERS:
+            book_ids = {book_id for book_id in book_ids if self.__catalog.book_row(book_id) is not None}
+            reviewed_ids = self.__review_sort_orders[sort_by].order(book_ids)
+            return reviewed_ids + sorted(book_ids.difference(reviewed_ids))
+
+        if sort_by not in STATIC_SORT_KEYS:
+            # Sort by title (alphabetical) by default
+            sort_by = 'alphabetical'
+
+        rows = {self.__catalog.book_row(book_id) for book_id in book_ids}
+        rows.discard(None)
+        order = self.__catalog.sort_order(sort_by)
+        if len(rows) * 8 >= len(order):
+            # Large result sets are merged with the stored order in a single pass
+            return [self.__catalog.book_id(row) for row in order if row in rows]
+
+        # Small result sets are ordered by their stored ranks
+        ranks = self.__catalog.sort_ranks(sort_by)
+        return [self.__catalog.book_id(row) for row in sorted(rows, key=ranks.__getitem__)]
+
+    def get_book_ids_by_year(self, year: int):
+        if isinstance(year, int):
+            return self.__catalog.book_ids(self.__catalog.book_rows_by_year(year))
+        return []
+
+    # Author methods
+    def add_author(self, author: Author):
+        raise RepositoryException('Authors can not be added to a shared catalog')
+
+    def add_authors(self, authors: List[Author]):
+        raise RepositoryException('Authors can not be added to a shared catalog')
+
+    def get_author(self, author_id: int):
+        row = self.__catalog.author_row(author_id)
+        if row is None:
+            return None
+        return self.__author(row)
+
+    def get_authors(self):
+        return [self.__author(row) for row in range(self.__catalog.number_of_authors())]
+
+    def get_book_ids_by_author(self, author: Author):
+        if not isinstance(author, Author):
+            return []
+
+        row = self.__catalog.author_row(author.unique_id)
+        if row is None:
+            return []
+        return self.__catalog.book_ids(self.__catalog.author_book_rows(row))
+
+    def partial_search_authors(self, author_string: str):
+        if not isinstance(author_string, str) or len(author_string.strip()) == 0:
+            return []
+        return [self.__author(row) for row in self.__catalog.search_author_names(author_string.strip())]
+
+    def __get_coauthor_graph(self) -> CoauthorGraph:
+        if self.__coauthor_graph is None:
+            catalog = self.__catalog
+            self.__coauthor_graph = CoauthorGraph(
+                [catalog.author_id(author_row) for author_row in catalog.book_author_rows(row)]
+                for row in range(len(catalog)))
+        return self.__coauthor_graph
+
+    def __authors_by_id(self, author_ids: List[int]) -> List[Author]:
+        rows = [self.__catalog.author_row(author_id) for author_id in author_ids]
+        return [self.__author(row) for row in rows if row is not None]
+
+    def get_coauthors(self, author_id: int) -> List[Author]:
+        return self.__authors_by_id(self.__get_coauthor_graph().coauthor_ids(author_id))
+
+    def get_related_authors(self, author_id: int, max_depth: int = 2) -> List[Author]:
+        return self.__authors_by_id(self.__get_coauthor_graph().related_author_ids(author_id, max_depth))
+
+    # Publisher methods
+    def add_publisher(self, publisher: Publisher):
+        raise RepositoryException('Publishers can not be added to a shared catalog')
+
+    def add_publishers(self, publishers: List[Publisher]):
+        raise RepositoryException('Publishers can not be added to a shared catalog')
+
+    def get_publisher(self, publisher_name: str):
+        row = self.__catalog.publisher_row_by_name(publisher_name)
+        if row is None:
+            return None
+        return self.__publisher(row)
+
+    def get_publishers(self):
+        # Do not return publisher with name "N/A"
+        publishers = [self.__publisher(row) for row in range(self.__catalog.number_of_publishers())]
+        return [publisher for publisher in publishers if publisher.name != "N/A"]
+
+    def get_book_ids_by_publisher(self, publisher: Publisher):
+        if not isinstance(publisher, Publisher):
+            return []
+
+        row = self.__catalog.publisher_row_by_name(publisher.name)
+        if row is None:
+            return []
+        return self.__catalog.book_ids(self.__catalog.publisher_book_rows(row))
+
+    def partial_search_publishers(self, publisher_string: str):
+        if not isinstance(publisher_string, str) or len(publisher_string.strip()) == 0:
+            return []
+        return [self.__publisher(row) for row in self.__catalog.search_publisher_names(publisher_string.strip())]
+
+    # Review methods
+    def add_review(self, review: Review):
+        super().add_review(review)
+
+        book = review.book
+        if self.__books.get(book.book_id) is not book:
+            return
+
+        with self.__review_lock:
+            review_sort_orders = dict(self.__review_sort_orders)
+            for sort_by in REVIEW_SORT_ORDERS:
+                sort_order = review_sort_orders[sort_by].copy()
+                sort_order.set(book.book_id, SORT_KEYS[sort_by](book))
+                review_sort_orders[sort_by] = sort_order
+            self.__review_sort_orders = review_sort_orders
@@ -0,0 +1,113 @@
+from typing import Dict, Iterable, List
+
+from library.adapters.layered_dict import LayeredDict
+from library.adapters.sorted_list import SortedList
+from library.domain.model import Book
+
+
+def alphabetical_key(book: Book):
+    return book.title,
+
+
+def ascending_key(book: Book):
+    # Books without a release year always come last
+    return book.release_year is None, book.release_year or 0
+
+
+def descending_key(book: Book):
+    return book.release_year is None, -(book.release_year or 0)
+
+
+def best_reviewed_key(book: Book):
+    return -(book.average_rating or 0),
+
+
+def most_reviewed_key(book: Book):
+    return -book.rating_count,
+
+
+# Sort key for each SortForm option, sort orders which depend on reviews are updated when a review is added
+SORT_KEYS = {
+    'alphabetical': alphabetical_key,
+    'ascending': ascending_key,
+    'descending': descending_key,
+    'best_reviewed': best_reviewed_key,
+    'most_reviewed': most_reviewed_key
+}
+
+REVIEW_SORT_ORDERS = ('best_reviewed', 'most_reviewed')
+
+
+class SortOrder:
+    """ Permutation of book ids ordered by a sort key, with ties broken by ascending book id.
+
+    The permutation is built by prepare(), or when first needed, and is then kept sorted by bisecting each added
+    or changed key into place, so ordering a set of ids never has to compute sort keys. The keys and the permutation
+    are held in a LayeredDict and a SortedList, so a copy shares them with the original and changing one key of
+    the copy copies neither whole.
+    """
+
+    def __init__(self):
+        self.__keys = LayeredDict()
+        self.__order: SortedList = SortedList()
+
+    def set(self, book_id: int, key: tuple):
+        old_key = self.__keys.get(book_id)
+        if old_key == key:
+            return
+
+        self.__keys[book_id] = key
+        if self.__order is not None:
+            if old_key is not None:
+                self.__order.remove((old_key, book_id))
+            self.__order.add((key, book_id))
+
+    def update(self, keys: Dict[int, tuple]):
+        """ Sets the keys of many book ids at once, the permutation is rebuilt when next needed """
+        if self.__order is not None and len(keys) * 8 < len(self.__keys):
+            # A few keys are cheaper to bisect into the existing permutation
+            for book_id, key in keys.items():
+                self.set(book_id, key)
+            return
+
+        self.__keys.update(keys)
+        self.__order = None
+
+    def remove(self, book_id: int):
+        key = self.__keys.pop(book_id, None)
+        if key is not None and self.__order is not None:
+            self.__order.remove((key, book_id))
+
+    def prepare(self):
+        """ Builds the permutation if it was invalidated by update, so that ordering ids doesn't change this
+        SortOrder once it is shared with readers """
+        self.__permutation()
+
+    def __permutation(self) -> SortedList:
+        order = self.__order
+        if order is None:
+            order = SortedList((key, book_id) for book_id, key in self.__keys.items())
+            self.__order = order
+        return order
+
+    def order(self, book_ids: Iterable[int]) -> List[int]:
+        """ Returns the ids in book_ids which have a sort key, in sorted order """
+        book_ids = {book_id for book_id in book_ids if book_id in self.__keys}
+        permutation = self.__permutation()
+
+        if len(book_ids) * 8 >= len(permutation):
+            # Large result sets are merged with the permutation in a single pass
+            return [book_id for _, book_id in permutation if book_id in book_ids]
+
+        # Small result sets are ordered by their precomputed keys
+        keys = self.__keys
+        return sorted(book_ids, key=lambda book_id: (keys[book_id], book_id))
+
+    def copy(self) -> 'SortOrder':
+        sort_order = SortOrder()
+        sort_order.__keys = self.__keys.copy()
+        sort_order.__order = None if self.__order is None else self.__order.copy()
+        return sort_order
+
+    def __len__(self):
+        return len(self.__keys)
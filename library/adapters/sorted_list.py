@@ -0,0 +1,98 @@
+from bisect import bisect_left, insort_left
+from itertools import chain
+from typing import Iterable, List
+
+
+class SortedList:
+    """ Sorted sequence stored as a list of blocks of at most 2 * BLOCK_SIZE items.
+
+    Adding or removing one item only rebuilds the block it falls in, so it costs O(BLOCK_SIZE + n / BLOCK_SIZE)
+    rather than the O(n) of inserting into one list. Blocks are never changed once built, only replaced, so
+    copy() only copies the list of blocks and the copy shares every block with the original.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, items: Iterable = ()):
+        self.__build(sorted(items))
+
+    def __build(self, items: List):
+        size = self.BLOCK_SIZE
+        self.__blocks = [items[start:start + size] for start in range(0, len(items), size)]
+        # Last (largest) item of each block, used to find the block an item belongs in
+        self.__maxes = [block[-1] for block in self.__blocks]
+        self.__length = len(items)
+
+    def update(self, items: Iterable):
+        """ Adds many items at once, rebuilding the blocks in a single pass """
+        items = sorted(items)
+        if len(items) == 0:
+            return
+        # Both runs are already sorted, which sorted() merges in linear time
+        self.__build(sorted(chain(self, items)))
+
+    def add(self, item):
+        if self.__length == 0:
+            self.__build([item])
+            return
+
+        position = min(bisect_left(self.__maxes, item), len(self.__blocks) - 1)
+        block = list(self.__blocks[position])
+        insort_left(block, item)
+        self.__length += 1
+
+        if len(block) > 2 * self.BLOCK_SIZE:
+            half = len(block) // 2
+            self.__blocks[position:position + 1] = [block[:half], block[half:]]
+            self.__maxes[position:position + 1] = [block[half - 1], block[-1]]
+        else:
+            self.__blocks[position] = block
+            self.__maxes[position] = block[-1]
+
+    def remove(self, item):
+        """ Removes an item equal to item, raising ValueError if there is none """
+        position = bisect_left(self.__maxes, item)
+        if position < len(self.__blocks):
+            block = self.__blocks[position]
+            index = bisect_left(block, item)
+            if index < len(block) and block[index] == item:
+                block = block[:index] + block[index + 1:]
+                self.__length -= 1
+                if len(block) == 0:
+                    del self.__blocks[position]
+                    del self.__maxes[position]
+                else:
+                    self.__blocks[position] = block
+                    self.__maxes[position] = block[-1]
+                return
+        raise ValueError(f'{item!r} is not in the list')
+
+    def discard(self, item):
+        try:
+            self.remove(item)
+        except ValueError:
+            pass
+
+    def __contains__(self, item):
+        position = bisect_left(self.__maxes, item)
+        if position == len(self.__blocks):
+            return False
+        block = self.__blocks[position]
+        index = bisect_left(block, item)
+        return index < len(block) and block[index] == item
+
+    def __iter__(self):
+        return chain.from_iterable(self.__blocks)
+
+    def __len__(self):
+        return self.__length
+
+    def copy(self) -> 'SortedList':
+        sorted_list = type(self)()
+        sorted_list.__blocks = list(self.__blocks)
+        sorted_list.__maxes = list(self.__maxes)
+        sorted_list.__length = self.__length
+        return sorted_list
+
+    def __repr__(self):
+        return f'SortedList({list(self)!r})'
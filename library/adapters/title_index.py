@@ -0,0 +1,126 @@
+from typing import Dict, List, Set
+
+from library.adapters.layered_dict import LayeredDict
+from library.adapters.layered_set import LayeredSet
+
+
+class TitleIndex:
+    """ Trigram inverted index over lowercased book titles, used for substring title searches.
+
+    A query can only be contained in a title if every trigram of the query is also a trigram of the title, so
+    the posting lists for the query's trigrams are intersected and only the remaining candidates are checked.
+
+    Copies share their titles and posting lists, which are copied when first written. Posting lists are sets while
+    they are written, and those of more than LayeredSet.MIN_CHANGES ids become LayeredSets when the index is
+    shared, so adding a title to a copy never copies a whole posting list of a common trigram.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        self.__titles = LayeredDict()
+        self.__postings = LayeredDict()
+        # Trigrams whose posting lists were written since this index was created or last copied
+        self.__owned_postings: Set[str] = set()
+
+    @classmethod
+    def grams(cls, text: str) -> Set[str]:
+        return {text[i:i + cls.GRAM_SIZE] for i in range(len(text) - cls.GRAM_SIZE + 1)}
+
+    def add(self, book_id: int, title: str):
+        if book_id in self.__titles:
+            self.remove(book_id)
+
+        # Titles are lowercased (not casefolded) to keep the same matching rules as str.lower() searches
+        title = title.lower()
+        self.__titles[book_id] = title
+        for gram in self.grams(title):
+            self.__writable_posting(gram).add(book_id)
+
+    def update(self, titles: Dict[int, str]):
+        """ Adds the title of each book id in titles, writing each posting list once """
+        for book_id in titles:
+            if book_id in self.__titles:
+                self.remove(book_id)
+
+        titles = {book_id: title.lower() for book_id, title in titles.items()}
+        self.__titles.update(titles)
+        book_ids_by_gram = dict()
+        for book_id, title in titles.items():
+            for gram in self.grams(title):
+                book_ids_by_gram.setdefault(gram, []).append(book_id)
+
+        for gram, book_ids in book_ids_by_gram.items():
+            self.__writable_posting(gram).update(book_ids)
+
+    def share(self):
+        """ Prepares the index to be shared with its copies, making the long posting lists written since it was
+        last copied into LayeredSets, so that adding a title to a copy never copies a whole posting list """
+        for gram in self.__owned_postings:
+            posting = self.__postings.get(gram)
+            if isinstance(posting, set) and len(posting) > LayeredSet.MIN_CHANGES:
+                self.__postings[gram] = LayeredSet(posting)
+
+    def remove(self, book_id: int):
+        title = self.__titles.pop(book_id, None)
+        if title is None:
+            return
+
+        for gram in self.grams(title):
+            posting = self.__writable_posting(gram)
+            posting.discard(book_id)
+            if len(posting) == 0:
+                del self.__postings[gram]
+
+    def __writable_posting(self, gram: str):
+        posting = self.__postings.get(gram)
+        if posting is None:
+            posting = set()
+        elif gram in self.__owned_postings:
+            return posting
+        else:
+            # Shared with a copy of this index
+            posting = posting.copy()
+        self.__postings[gram] = posting
+        self.__owned_postings.add(gram)
+        return posting
+
+    def search(self, query: str) -> List[int]:
+        """ Returns the ids, in ascending order, of all titles which contain query (ignoring case) """
+        query = query.lower()
+        query_grams = self.grams(query)
+
+        if len(query_grams) == 0:
+            # Query is shorter than a trigram, so check every title
+            titles = self.__titles.items()
+        else:
+            postings = []
+            for gram in query_grams:
+                posting = self.__postings.get(gram)
+                if posting is None:
+                    return []
+                postings.append(posting)
+
+            # Intersect starting from the smallest posting list
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if len(posting) > 8 * len(candidates):
+                    # Checking the titles of the few remaining candidates is cheaper than intersecting them with
+                    # this or any later (longer) posting list
+                    break
+                candidates = posting.intersection(candidates)
+            titles = self.__titles.items_of(candidates)
+
+        return sorted(book_id for book_id, title in titles if query in title)
+
+    def copy(self) -> 'TitleIndex':
+        title_index = TitleIndex()
+        title_index.__titles = self.__titles.copy()
+        title_index.__postings = self.__postings.copy()
+        # Both now share every posting list
+        self.__owned_postings = set()
+        return title_index
+
+    def __len__(self):
+        return len(self.__titles)
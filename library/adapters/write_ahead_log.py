@@ -0,0 +1,206 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator, List
+
+from library.adapters.file_lock import hold_file_lock
+from library.adapters.file_sync import sync_directory
+
+# Log files start with MAGIC and the format version. Each record is its payload length, a CRC-32 checksum of
+# the payload and its sequence number, followed by the payload, which is a JSON object
+MAGIC = b'SPNBDLOG'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<8sH')
+RECORD_HEADER = struct.Struct('<IIQ')
+
+# Type of the record a truncated log starts with, carrying the sequence number of the last record removed
+CHECKPOINT = 'checkpoint'
+
+
+class WriteAheadLogException(Exception):
+    pass
+
+
+class WriteAheadLogInUseException(WriteAheadLogException):
+    pass
+
+
+def compact_records(records: List[dict]) -> List[int]:
+    """ Returns the indexes of the records which are not superseded by a later record.
+
+    Records of favourites are superseded by later records for the same user and book.
+    """
+    latest_favourites = dict()
+    for index, record in enumerate(records):
+        if record['type'] == 'favourite':
+            latest_favourites[(record['user_name'], record['book_id'])] = index
+    return [index for index, record in enumerate(records)
+            if record['type'] != 'favourite' or latest_favourites[(record['user_name'], record['book_id'])] == index]
+
+
+class WriteAheadLog:
+    """ Append-only file of the changes made to a repository since it was populated.
+
+    append() writes a record without waiting for it to reach the disk, and sync() waits until it has. Threads
+    which call sync() while another thread's fsync is in progress are covered by a single fsync once it
+    finishes (group commit), so concurrent writers share the cost of flushing.
+
+    Once compact_after records have been appended, compaction_due() is True and the log's owner either folds
+    the records into a snapshot and truncate()s the log, or compact()s the log, rewriting it without the
+    superseded records.
+
+    A log is only written by one process, a second process opening it raises WriteAheadLogInUseException.
+    """
+
+    def __init__(self, path: Path, compact_after: int = 10000):
+        self.__path = Path(path)
+        self.__compact_after = compact_after
+        self.__lock = threading.Lock()
+        self.__sync_lock = threading.Lock()
+
+        # Held until this process exits, as records appended by two processes would be interleaved
+        if not hold_file_lock(f'{self.__path}.lock'):
+            raise WriteAheadLogInUseException(f'{self.__path} is in use by another process')
+
+        if not self.__path.exists() or self.__path.stat().st_size == 0:
+            self.__write_file(self.__path, [])
+
+        self.__file = open(self.__path, 'r+b')
+        header = self.__file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != MAGIC:
+            raise WriteAheadLogException(f'{self.__path} is not a write-ahead log')
+        version = FILE_HEADER.unpack(header)[1]
+        if version != FORMAT_VERSION:
+            raise WriteAheadLogException(f'{self.__path} has format version {version}, expected {FORMAT_VERSION}')
+
+        # Find the end of the last complete record, a record cut short by a crash is discarded
+        self.__sequence = 0
+        self.__appended = 0
+        for sequence, _ in self.__read_records():
+            self.__sequence = sequence
+            self.__appended += 1
+        self.__file.truncate(self.__file.tell())
+        self.__synced = self.__sequence
+
+    def __read_records(self) -> Iterator[tuple]:
+        """ Reads (sequence, payload) records from the current position, stopping after the last valid one """
+        while True:
+            position = self.__file.tell()
+            header = self.__file.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                length, checksum, sequence = RECORD_HEADER.unpack(header)
+                payload = self.__file.read(length)
+                if len(payload) == length and zlib.crc32(payload) == checksum:
+                    yield sequence, payload
+                    continue
+            self.__file.seek(position)
+            return
+
+    @staticmethod
+    def __frame(sequence: int, record: dict) -> bytes:
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload), sequence) + payload
+
+    @classmethod
+    def __write_file(cls, path: Path, frames):
+        # Write to a temporary file first so a partly written log never replaces the current one
+        temporary_path = Path(str(path) + '.tmp')
+        with open(temporary_path, 'wb') as log_file:
+            log_file.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION))
+            for frame in frames:
+                log_file.write(frame)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(temporary_path, path)
+        sync_directory(Path(path).parent)
+
+    def records(self, after: int = 0) -> Iterator[dict]:
+        """ Returns the records in the log with sequence numbers greater than after, oldest first """
+        with self.__lock:
+            with open(self.__path, 'rb') as log_file:
+                log_file.seek(FILE_HEADER.size)
+                data = log_file.read()
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, checksum, sequence = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                return
+            record = json.loads(payload)
+            if sequence > after and record['type'] != CHECKPOINT:
+                yield record
+            offset += RECORD_HEADER.size + length
+
+    def append(self, record: dict) -> int:
+        """ Writes record to the log and returns its sequence number, pass it to sync() to wait for the disk """
+        with self.__lock:
+            self.__sequence += 1
+            self.__file.write(self.__frame(self.__sequence, record))
+            self.__appended += 1
+            return self.__sequence
+
+    def sync(self, sequence: int):
+        """ Returns once the record with the given sequence number, and every record before it, is on disk """
+        with self.__sync_lock:
+            if self.__synced >= sequence:
+                # Covered by the fsync of another thread
+                return
+            with self.__lock:
+                self.__file.flush()
+                sequence = self.__sequence
+                # A duplicate descriptor stays valid if the log is compacted while it is being synced
+                file_number = os.dup(self.__file.fileno())
+            try:
+                os.fsync(file_number)
+            finally:
+                os.close(file_number)
+            self.__synced = max(self.__synced, sequence)
+
+    @property
+    def sequence(self) -> int:
+        """ Sequence number of the last record appended """
+        return self.__sequence
+
+    def compaction_due(self) -> bool:
+        return self.__appended >= self.__compact_after
+
+    def compact(self):
+        """ Rewrites the log without the records superseded by later records """
+        with self.__lock:
+            records = self.__current_records()
+            kept = [records[index] for index in compact_records([record for _, record in records])]
+            self.__replace_records(kept)
+            # Compact again once as many records as were kept have been appended, so the cost stays proportional
+            self.__compact_after = max(self.__compact_after, 2 * len(kept))
+
+    def truncate(self, sequence: int):
+        """ Removes the records up to and including sequence, once they have been folded into a snapshot """
+        with self.__lock:
+            kept = [(record_sequence, record) for record_sequence, record in self.__current_records()
+                    if record_sequence > sequence]
+            # Kept in place of the removed records so the sequence numbers continue from them when reopened
+            self.__replace_records([(sequence, {'type': CHECKPOINT})] + kept)
+
+    def __current_records(self) -> List[tuple]:
+        self.__file.flush()
+        self.__file.seek(FILE_HEADER.size)
+        return [(sequence, json.loads(payload)) for sequence, payload in self.__read_records()]
+
+    def __replace_records(self, records: List[tuple]):
+        self.__write_file(self.__path, (self.__frame(sequence, record) for sequence, record in records))
+        self.__file.close()
+        self.__file = open(self.__path, 'r+b')
+        self.__file.seek(0, os.SEEK_END)
+        self.__appended = len(records)
+        self.__synced = self.__sequence
+
+    def close(self):
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+                self.__file.close()
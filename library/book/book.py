@@ -56,9 +56,11 @@ def book():
         else:
             count = int(count)
 
-        # Get book and reviews to display
+        # Get book and reviews to display, with one extra review to tell whether there is a next page
         book = services.get_book_by_id(book_id, repo.repo_instance)
-        reviews = book['reviews'][count:count + reviews_per_page]
+        reviews = services.get_reviews_for_book(book_id, repo.repo_instance, count, reviews_per_page + 1)
+        has_next_page = len(reviews) > reviews_per_page
+        reviews = reviews[:reviews_per_page]
         stats = services.calculate_rating_stats(int(book_id), repo.repo_instance)
 
         # Creating forward/back buttons for reviews
@@ -68,7 +70,7 @@ def book():
                                     book_id=book_id,
                                     count=count - reviews_per_page)
 
-        if count + reviews_per_page < len(book['reviews']):
+        if has_next_page:
             # There are further pages, so generate URL for the 'next' button
             next_page_url = url_for('book_bp.book',
                                     book_id=book_id,
@@ -37,13 +37,14 @@ def check_if_book_in_favourites(book_id: int, user_name: str, repo: AbstractRepo
     return False
 
 
-def get_reviews_for_book(book_id: int, repo: AbstractRepository):
+def get_reviews_for_book(book_id: int, repo: AbstractRepository, offset: int = 0, limit: int = None):
     book = repo.get_book(book_id)
 
     if book is None:
         raise NonExistentBookException
 
-    return reviews_to_dict(book.reviews)
+    # Newest first, only the requested page of reviews is fetched
+    return reviews_to_dict(repo.get_reviews_for_book(book_id, offset, limit))
 
 
 def add_review(book_id: int, review_text: str, rating: int, user_name: str, repo: AbstractRepository):
@@ -68,17 +69,11 @@ def calculate_rating_stats(book_id: int, repo: AbstractRepository):
     if book is None:
         raise NonExistentBookException
 
-    ratings = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    count = 0
-
-    for review in book.reviews:
-        ratings[review.rating] += 1
-        count += 1
-
-    if count < 1:
+    # The Book keeps its rating aggregates as reviews are added
+    if book.rating_count < 1:
         return {'average': 0, 'stars': 0}
 
-    avg_rating = round((1 * ratings[1] + 2 * ratings[2] + 3 * ratings[3] + 4 * ratings[4] + 5 * ratings[5]) / count, 1)
+    avg_rating = round(book.average_rating, 1)
 
     if avg_rating >= 4.5:
         stars = 5
@@ -114,8 +109,7 @@ def book_to_dict(book: Book):
         'release_year': book.release_year,
         'ebook': book.ebook,
         'num_pages': book.num_pages,
-        'image_url': book.image_url,
-        'reviews': reviews_to_dict(book.reviews)
+        'image_url': book.image_url
     }
     return book_dict
 
@@ -60,8 +60,7 @@ def browse():
     book_ids = services.get_book_ids(repo.repo_instance)
 
     # Sort and retrieve books (default = alphabetical)
-    matching_books = services.sort_books(book_ids, sort_by, repo.repo_instance)
-    books = matching_books[count:count + books_per_page]  # Books to display
+    books = services.sort_books(book_ids, sort_by, repo.repo_instance, count, books_per_page)  # Books to display
 
     next_page_url = None
     prev_page_url = None
@@ -140,8 +139,7 @@ def bookshelf():
     book_ids = services.get_favourite_book_ids(user_name, repo.repo_instance)
 
     # Sort and retrieve books (default = alphabetical)
-    matching_books = services.sort_books(book_ids, sort_by, repo.repo_instance)
-    books = matching_books[count:count + books_per_page]  # Books to display
+    books = services.sort_books(book_ids, sort_by, repo.repo_instance, count, books_per_page)  # Books to display
 
     next_page_url = None
     prev_page_url = None
@@ -233,43 +231,42 @@ def search_result(location: str):
 
     books_per_page = int(books_per_page)
 
-    # Initialise lists
-    book_ids = []
-    title_book_ids = []
-    author_book_ids = []
-    publisher_book_ids = []
-    year_book_ids = []
-
     # Retrieve book ids for books which contain the queries
     # This can be a partial match, i.e. publisher query "Mar" will return "Marvel"
     # Empty string is not included
+    query_book_ids = []
     if title is not None:
-        title_book_ids = services.get_book_ids_by_title(title, repo.repo_instance)
+        query_book_ids.append(set(services.get_book_ids_by_title(title, repo.repo_instance)))
 
     if author is not None:
-        author_book_ids = services.get_book_ids_by_author(author, repo.repo_instance)
+        query_book_ids.append(set(services.get_book_ids_by_author(author, repo.repo_instance)))
 
     if publisher is not None:
-        publisher_book_ids = services.get_book_ids_by_publisher(publisher, repo.repo_instance)
+        query_book_ids.append(set(services.get_book_ids_by_publisher(publisher, repo.repo_instance)))
 
     if year is not None:
         if year.isnumeric():
             year = int(year)
-            year_book_ids = services.get_book_ids_by_year(year, repo.repo_instance)
         else:
             year = None
 
-    favourite_book_ids = services.get_favourite_book_ids(user_name, repo.repo_instance)
-
-    # Only add book_id to list if it matches all queries
-    search_list = max(title_book_ids, author_book_ids, publisher_book_ids, year_book_ids, key=len)
-    for book_id in search_list:
-        if ((book_id in title_book_ids or title is None)
-                and (book_id in author_book_ids or author is None)
-                and (book_id in publisher_book_ids or publisher is None)
-                and (book_id in year_book_ids or year is None)
-                and (book_id in favourite_book_ids or location == 'browse')):
-            book_ids.append(book_id)
+    # Only keep book ids which match all queries - nothing matches if there are no queries
+    book_ids = []
+    if len(query_book_ids) > 0 or year is not None:
+        candidate_book_ids = set.intersection(*query_book_ids) if len(query_book_ids) > 0 else None
+
+        if location != 'browse':
+            favourite_book_ids = set(services.get_favourite_book_ids(user_name, repo.repo_instance))
+            if candidate_book_ids is None:
+                candidate_book_ids = favourite_book_ids
+            else:
+                candidate_book_ids &= favourite_book_ids
+
+        if year is not None:
+            # The year filter runs over the whole candidate set at once
+            book_ids = services.filter_book_ids(candidate_book_ids, repo.repo_instance, year=year)
+        else:
+            book_ids = sorted(candidate_book_ids)
 
     if count is None:
         # Initialise cursor at beginning
@@ -280,8 +277,7 @@ def search_result(location: str):
     # Retrieve the batch of books to display - duplicates are removed inside the function
     # books = services.get_books_by_id(book_ids[count: count + books_per_page], repo.repo_instance)
     # Sort and retrieve books (default = alphabetical)
-    matching_books = services.sort_books(book_ids, sort_by, repo.repo_instance)
-    books = matching_books[count:count + books_per_page]  # Books to display
+    books = services.sort_books(book_ids, sort_by, repo.repo_instance, count, books_per_page)  # Books to display
 
     next_page_url = None
     prev_page_url = None
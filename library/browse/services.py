@@ -2,7 +2,6 @@ from typing import Iterable
 
 from library.adapters.repository import AbstractRepository
 from library.domain.model import Book, Review
-from library.book.services import calculate_rating_stats
 
 
 class NonExistentBookException(Exception):
@@ -48,21 +47,22 @@ def get_book_ids_by_year(year_input: int, repo: AbstractRepository):
     return repo.get_book_ids_by_year(year_input)
 
 
-# Takes list of book ids as input, then fetches the Book objects and sorts them according to sort_by
-def sort_books(book_ids, sort_by: str, repo: AbstractRepository):
-    books = get_books_by_id(book_ids, repo)
-
-    if sort_by == 'ascending':
-        return sorted(books, key=lambda x: (x['release_year'] is None, x['release_year']))
-    elif sort_by == 'descending':
-        return sorted(books, key=lambda x: (x['release_year'] is not None, x['release_year']), reverse=True)
-    elif sort_by == 'best_reviewed':
-        return sorted(books, key=lambda x: calculate_rating_stats(x['id'], repo)['average'], reverse=True)
-    elif sort_by == 'most_reviewed':
-        return sorted(books, key=lambda x: len(x['reviews']), reverse=True)
-    else:
-        # Sort by title (alphabetical) by default
-        return sorted(books, key=lambda x: x['title'])
+# Narrows book_ids (or the whole catalog, if book_ids is None) down to the books matching every given filter
+def filter_book_ids(book_ids, repo: AbstractRepository, year: int = None, publisher_names=None,
+                    min_pages: int = None, max_pages: int = None, ebook: bool = None):
+    return repo.filter_book_ids(book_ids, year=year, publisher_names=publisher_names,
+                                min_pages=min_pages, max_pages=max_pages, ebook=ebook)
+
+
+# Takes list of book ids as input, sorts them according to sort_by, then fetches the Book objects of the limit ids
+# (or all the ids, if limit is None) starting at offset
+def sort_books(book_ids, sort_by: str, repo: AbstractRepository, offset: int = 0, limit: int = None):
+    # Duplicates are removed and the ordering is done by the repository
+    sorted_ids = repo.sort_book_ids(set(book_ids), sort_by)
+    # Only the page of ids is fetched and converted, rather than every matching Book
+    page_ids = sorted_ids[offset:] if limit is None else sorted_ids[offset:offset + limit]
+    books = {book.book_id: book for book in repo.get_books(page_ids)}
+    return [book_to_dict(books[book_id]) for book_id in page_ids]
 
 
 # ============================================
@@ -1,13 +1,104 @@
 from datetime import datetime
-from typing import List, Iterable
+from typing import List, Iterable, Optional, Tuple
+
+# Domain classes use __slots__, so instances have no per-instance __dict__ in the memory repository. '__dict__'
+# and '__weakref__' are still listed because the SQLAlchemy mappings keep mapped attributes, and their instance
+# state, in __dict__ and hold weak references to instances. The dict is only created when something is stored in it
+ORM_SLOTS = ('__dict__', '__weakref__')
+
+# Collections of associations are allocated when their first item is added, until then reading one returns a new
+# empty list, so that empty and populated collections are both lists
+
+# Number of ratings of each value from 1 to 5, of a Book which has not been reviewed
+NO_RATINGS = (0, 0, 0, 0, 0)
+
+
+def new_instance(cls):
+    """ Returns an instance of a domain class without calling __init__, used by the trusted constructors.
+
+    map_model_to_tables replaces this function, so that instances of mapped classes also get their ORM state.
+    """
+    return cls.__new__(cls)
+
+
+class AssociationList(list):
+    """ List of distinct items with a hash index, used for the associations between domain objects.
+
+    Checking membership and adding an item use the index rather than scanning the list, so adding n associations
+    is O(n) rather than O(n^2). Removing an item which isn't present is O(1), removing one which is still shifts
+    the items after it. It is a list, so it reads, compares and prints exactly like the lists it replaces.
+    """
+
+    __slots__ = ('__index',)
+
+    def __init__(self, items: Iterable = ()):
+        super().__init__()
+        self.__index = set()
+        self.extend(items)
+
+    def append(self, item):
+        if item not in self.__index:
+            self.__index.add(item)
+            super().append(item)
+
+    def extend(self, items: Iterable):
+        for item in items:
+            self.append(item)
+
+    def insert(self, position: int, item):
+        if item not in self.__index:
+            self.__index.add(item)
+            super().insert(position, item)
+
+    def remove(self, item):
+        if item not in self.__index:
+            raise ValueError(f'{item!r} is not in the list')
+        super().remove(item)
+        self.__index.discard(item)
+
+    def pop(self, position: int = -1):
+        item = super().pop(position)
+        self.__index.discard(item)
+        return item
+
+    def clear(self):
+        super().clear()
+        self.__index.clear()
+
+    def __contains__(self, item):
+        try:
+            return item in self.__index
+        except TypeError:
+            # Unhashable items can't be in the list
+            return False
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.__index = set(self)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.__index = set(self)
+
+    def __iadd__(self, items: Iterable):
+        self.extend(items)
+        return self
 
 
 class Publisher:
 
+    __slots__ = ('__name', '__books') + ORM_SLOTS
+
     def __init__(self, publisher_name: str):
         # This makes sure the setter is called here in the initializer/constructor as well
         self.name = publisher_name
-        self.__books: List[Book] = list()
+
+    @classmethod
+    def from_trusted_record(cls, publisher_name: str) -> 'Publisher':
+        """ Creates a Publisher without validating its name, which must already be stripped and not empty """
+        publisher = new_instance(cls)
+        publisher.__name = publisher_name
+        return publisher
 
     @property
     def name(self) -> str:
@@ -24,22 +115,28 @@ class Publisher:
 
     @property
     def books(self) -> List['Book']:
-        return self.__books
+        try:
+            return self.__books
+        except AttributeError:
+            return []
 
     def add_book(self, book: 'Book'):
         if not isinstance(book, Book):
             return
 
-        if book in self.__books:
+        if book in self.books:
             return
 
-        self.__books.append(book)
+        if len(self.books) == 0:
+            self.__books = AssociationList([book])
+        else:
+            self.__books.append(book)
 
     def remove_book(self, book: 'Book'):
         if not isinstance(book, Book):
             return
 
-        if book in self.__books:
+        if book in self.books:
             self.__books.remove(book)
 
     def __repr__(self):
@@ -59,6 +156,8 @@ class Publisher:
 
 class Author:
 
+    __slots__ = ('__unique_id', '__full_name', '__books', '__authors_this_one_has_worked_with') + ORM_SLOTS
+
     def __init__(self, author_id: int, author_full_name: str):
         if not isinstance(author_id, int):
             raise ValueError
@@ -71,11 +170,16 @@ class Author:
         # Uses the attribute setter method
         self.full_name = author_full_name
 
-        self.__books = []
+        # The author colleagues data structure is a set, so each unique author is only represented once. It is
+        # created when the first coauthor is added
 
-        # Initialize author colleagues data structure with empty set
-        # We use a set so each unique author is only represented once
-        self.__authors_this_one_has_worked_with = set()
+    @classmethod
+    def from_trusted_record(cls, author_id: int, author_full_name: str) -> 'Author':
+        """ Creates an Author without validating it, the id must be a non-negative int and the name stripped """
+        author = new_instance(cls)
+        author.__unique_id = author_id
+        author.__full_name = author_full_name
+        return author
 
     @property
     def unique_id(self) -> int:
@@ -99,30 +203,42 @@ class Author:
 
     @property
     def books(self) -> List['Book']:
-        return self.__books
+        try:
+            return self.__books
+        except AttributeError:
+            return []
 
     def add_book(self, book: 'Book'):
         if not isinstance(book, Book):
             return
 
-        if book in self.__books:
+        if book in self.books:
             return
 
-        self.__books.append(book)
+        if len(self.books) == 0:
+            self.__books = AssociationList([book])
+        else:
+            self.__books.append(book)
 
     def remove_book(self, book: 'Book'):
         if not isinstance(book, Book):
             return
 
-        if book in self.__books:
+        if book in self.books:
             self.__books.remove(book)
 
     def add_coauthor(self, coauthor):
         if isinstance(coauthor, self.__class__) and coauthor.unique_id != self.unique_id:
-            self.__authors_this_one_has_worked_with.add(coauthor)
+            try:
+                self.__authors_this_one_has_worked_with.add(coauthor)
+            except AttributeError:
+                self.__authors_this_one_has_worked_with = {coauthor}
 
     def check_if_this_author_coauthored_with(self, author):
-        return author in self.__authors_this_one_has_worked_with
+        try:
+            return author in self.__authors_this_one_has_worked_with
+        except AttributeError:
+            return False
 
     def __repr__(self):
         return f'<Author {self.full_name}, author id = {self.unique_id}>'
@@ -141,6 +257,10 @@ class Author:
 
 class Book:
 
+    __slots__ = ('__book_id', '__title', '__description', '__publisher', '__authors', '__release_year', '__ebook',
+                 '__num_pages', '__image_url', '__reviews', '__users_who_favourited', '__rating_count',
+                 '__rating_total', '__rating_histogram') + ORM_SLOTS
+
     def __init__(self, book_id: int, book_title: str):
         if not isinstance(book_id, int):
             raise ValueError
@@ -155,13 +275,36 @@ class Book:
 
         self.__description = None
         self.__publisher = None
-        self.__authors = []
         self.__release_year = None
         self.__ebook = None
         self.__num_pages = None
         self.__image_url = None
-        self.__reviews: List[Review] = list()
-        self.__users_who_favourited: List[User] = list()
+        # Authors, reviews and users who favourited are allocated when the first one is added
+        self.__rating_count = 0
+        self.__rating_total = 0
+        self.__rating_histogram = NO_RATINGS
+
+    @classmethod
+    def from_trusted_record(cls, book_id: int, book_title: str, description: str = None, release_year: int = None,
+                            ebook: bool = None, num_pages: int = None, image_url: str = None) -> 'Book':
+        """ Creates a Book from values which have already been validated, without going through the setters.
+
+        Used to load many Books at once, the values must be what the setters would have stored: a non-negative
+        id, a stripped title which isn't empty, a stripped description, and None for any value which is unknown.
+        """
+        book = new_instance(cls)
+        book.__book_id = book_id
+        book.__title = book_title
+        book.__description = description
+        book.__publisher = None
+        book.__release_year = release_year
+        book.__ebook = ebook
+        book.__num_pages = num_pages
+        book.__image_url = image_url
+        book.__rating_count = 0
+        book.__rating_total = 0
+        book.__rating_histogram = NO_RATINGS
+        return book
 
     @property
     def book_id(self) -> int:
@@ -184,12 +327,45 @@ class Book:
 
     @property
     def reviews(self) -> Iterable['Review']:
-        return iter(self.__reviews)
+        # Reviews are stored oldest first, and read newest first
+        try:
+            return reversed(self.__reviews)
+        except AttributeError:
+            return iter(())
 
     def add_review(self, review: 'Review'):
         if isinstance(review, Review):
             # Review objects are in practice always considered different due to their timestamp
-            self.__reviews.insert(0, review)
+            try:
+                self.__reviews.append(review)
+            except AttributeError:
+                self.__reviews = [review]
+
+            # Keep the rating aggregates up to date, so they never have to be counted from the reviews
+            rating = review.rating
+            self.__rating_count += 1
+            self.__rating_total += rating
+            histogram = self.__rating_histogram
+            self.__rating_histogram = histogram[:rating - 1] + (histogram[rating - 1] + 1,) + histogram[rating:]
+
+    @property
+    def rating_count(self) -> int:
+        return self.__rating_count
+
+    @property
+    def rating_total(self) -> int:
+        return self.__rating_total
+
+    @property
+    def rating_histogram(self) -> Tuple[int, int, int, int, int]:
+        """ Number of reviews with each rating, from 1 to 5 """
+        return self.__rating_histogram
+
+    @property
+    def average_rating(self) -> Optional[float]:
+        if self.__rating_count == 0:
+            return None
+        return self.__rating_total / self.__rating_count
 
     @property
     def release_year(self) -> int:
@@ -224,42 +400,54 @@ class Book:
 
     @property
     def authors(self) -> List[Author]:
-        return self.__authors
+        try:
+            return self.__authors
+        except AttributeError:
+            return []
 
     def add_author(self, author: Author):
         if not isinstance(author, Author):
             return
 
-        if author in self.__authors:
+        if author in self.authors:
             return
 
-        self.__authors.append(author)
+        if len(self.authors) == 0:
+            self.__authors = AssociationList([author])
+        else:
+            self.__authors.append(author)
 
     def remove_author(self, author: Author):
         if not isinstance(author, Author):
             return
 
-        if author in self.__authors:
+        if author in self.authors:
             self.__authors.remove(author)
 
     @property
     def users_who_favourited(self) -> List['User']:
-        return self.__users_who_favourited
+        try:
+            return self.__users_who_favourited
+        except AttributeError:
+            return []
 
     def add_user(self, user: 'User'):
         if not isinstance(user, User):
             return
 
-        if user in self.__users_who_favourited:
+        if user in self.users_who_favourited:
             return
 
-        self.__users_who_favourited.append(user)
+        if len(self.users_who_favourited) == 0:
+            self.__users_who_favourited = AssociationList([user])
+        else:
+            self.__users_who_favourited.append(user)
 
     def remove_user(self, user: 'User'):
         if not isinstance(user, User):
             return
 
-        if user in self.__users_who_favourited:
+        if user in self.users_who_favourited:
             self.__users_who_favourited.remove(user)
 
     @property
@@ -306,6 +494,8 @@ class Book:
 
 class User:
 
+    __slots__ = ('__user_name', '__password', '__favourites', '__read_books', '__reviews', '__pages_read') + ORM_SLOTS
+
     def __init__(self, user_name: str, password: str):
         if user_name == "" or not isinstance(user_name, str):
             self.__user_name = None
@@ -317,7 +507,7 @@ class User:
         else:
             self.__password = password
 
-        self.__favourites = []
+        self.__favourites = AssociationList()
         self.__read_books = []
         self.__reviews = []
         self.__pages_read = 0
@@ -340,7 +530,8 @@ class User:
 
     @property
     def reviews(self) -> Iterable['Review']:
-        return iter(self.__reviews)
+        # Reviews are stored oldest first, and read newest first
+        return reversed(self.__reviews)
 
     @property
     def pages_read(self) -> int:
@@ -363,7 +554,7 @@ class User:
     def add_review(self, review: 'Review'):
         if isinstance(review, Review):
             # Review objects are in practice always considered different due to their timestamp
-            self.__reviews.insert(0, review)
+            self.__reviews.append(review)
 
     def __repr__(self):
         return f'<User {self.user_name}>'
@@ -382,7 +573,9 @@ class User:
 
 class Review:
 
-    def __init__(self, user: User, book: Book, review_text: str, rating: int):
+    __slots__ = ('__user', '__book', '__review_text', '__rating', '__timestamp') + ORM_SLOTS
+
+    def __init__(self, user: User, book: Book, review_text: str, rating: int, timestamp: datetime = None):
         if isinstance(user, User):
             self.__user = user
         else:
@@ -403,7 +596,11 @@ class Review:
         else:
             raise ValueError
 
-        self.__timestamp = datetime.now()
+        # A timestamp is only given when restoring a previously created review
+        if isinstance(timestamp, datetime):
+            self.__timestamp = timestamp
+        else:
+            self.__timestamp = datetime.now()
 
     @property
     def user(self) -> User:
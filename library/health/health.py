@@ -0,0 +1,80 @@
+import threading
+import traceback
+
+from flask import Blueprint, current_app, request
+from werkzeug.exceptions import ServiceUnavailable
+
+# Seconds a client is asked to wait before retrying a request made while the repository is loading
+RETRY_AFTER_SECONDS = 5
+
+# Blueprints whose routes read or write the repository, which can't be served until it is loaded
+REPOSITORY_BLUEPRINTS = ('authentication_bp', 'browse_bp', 'book_bp')
+
+# Configure blueprint
+health_blueprint = Blueprint(
+    'health_bp', __name__)
+
+
+class RepositoryWarmup:
+    """ Loads the repository in a background thread, so the application can accept requests while it loads.
+
+    If loading fails, the error is kept and the repository never becomes ready.
+    """
+
+    def __init__(self, load_repository):
+        self.__load_repository = load_repository
+        self.__loaded = threading.Event()
+        self.error = None
+        self.__thread = threading.Thread(target=self.__run, name='repository-warmup', daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            self.__load_repository()
+        except Exception as error:
+            self.error = error
+            traceback.print_exc()
+        else:
+            self.__loaded.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.__loaded.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Waits until the repository is loaded or loading has failed, returns whether it is loaded """
+        self.__thread.join(timeout)
+        return self.ready
+
+
+def repository_warmup() -> RepositoryWarmup:
+    # None when the repository was loaded before the application started
+    return current_app.extensions.get('repository_warmup')
+
+
+def unavailable_until_ready():
+    """ Refuses requests to the repository's routes with 503 Service Unavailable until the repository is loaded """
+    warmup = repository_warmup()
+    if warmup is None or warmup.ready or request.blueprint not in REPOSITORY_BLUEPRINTS:
+        return None
+    if warmup.error is not None:
+        raise ServiceUnavailable('The catalog could not be loaded.')
+    raise ServiceUnavailable('The catalog is loading, please try again shortly.', retry_after=RETRY_AFTER_SECONDS)
+
+
+@health_blueprint.route('/healthz', methods=['GET'])
+def healthz():
+    # The application is alive as soon as it accepts requests, whether or not the repository is loaded
+    return 'alive'
+
+
+@health_blueprint.route('/readyz', methods=['GET'])
+def readyz():
+    warmup = repository_warmup()
+    if warmup is None or warmup.ready:
+        return 'ready'
+    if warmup.error is not None:
+        return f'failed: {warmup.error}', 503
+    return 'loading', 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
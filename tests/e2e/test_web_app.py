@@ -1,7 +1,17 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
 import pytest
 
 from flask import session
 
+from library import create_app
+import library.adapters.repository as repo
+from library.adapters import repository_populate
+from tests.conftest import TEST_DATA_PATH
+
 
 def test_register(client):
     # Check that we retrieve the register page
@@ -161,3 +171,85 @@ def test_bookshelf(client, auth):
     # Check that we can retrieve the review page
     response = client.get('/bookshelf/')
     assert response.status_code == 200
+
+
+def test_health_and_readiness(client):
+    # Without a background warm-up the repository is loaded before the application starts
+    assert client.get('/healthz').data == b'alive'
+    assert client.get('/readyz').status_code == 200
+
+
+def create_app_warming_up(data_path):
+    return create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': data_path,
+        'WTF_CSRF_ENABLED': False,
+        'BACKGROUND_WARMUP': True
+    })
+
+
+def test_catalog_is_unavailable_until_the_background_warmup_finishes(monkeypatch):
+    # Hold the population until the application has been checked while it loads
+    loading = threading.Event()
+    populate = repository_populate.populate
+
+    def populate_when_allowed(*args, **kwargs):
+        loading.wait(10)
+        populate(*args, **kwargs)
+    monkeypatch.setattr(repository_populate, 'populate', populate_when_allowed)
+
+    app = create_app_warming_up(TEST_DATA_PATH)
+    client = app.test_client()
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert (response.status_code, response.headers['Retry-After']) == (503, '5')
+    for url in ['/browse/', '/book?book_id=12413392', '/authentication/login']:
+        response = client.get(url)
+        assert (response.status_code, response.headers['Retry-After']) == (503, '5')
+    assert client.get('/').status_code == 200
+    # The repository is only published once it is loaded
+    assert repo.repo_instance is None
+
+    loading.set()
+    assert app.extensions['repository_warmup'].wait(10)
+    assert client.get('/readyz').status_code == 200
+    response = client.get('/book?book_id=12413392')
+    assert response.status_code == 200
+    assert b'Washington B.C (Ben 10 Comic Book)' in response.data
+
+
+def test_catalog_stays_unavailable_when_the_background_warmup_fails(tmp_path):
+    # There are no data files to load
+    app = create_app_warming_up(tmp_path)
+    client = app.test_client()
+    assert not app.extensions['repository_warmup'].wait(10)
+    assert client.get('/healthz').status_code == 200
+    for url in ['/readyz', '/browse/']:
+        response = client.get(url)
+        assert response.status_code == 503
+        assert 'Retry-After' not in response.headers
+
+
+def test_a_second_worker_runs_without_the_memory_log(tmp_path, caplog):
+    pytest.importorskip('fcntl')
+    log_path = tmp_path / 'changes.log'
+    snapshot_path = tmp_path / 'repository.snapshot'
+    # Another worker process holds the log until its input is closed
+    worker = subprocess.Popen([sys.executable, '-c', 'import sys\n'
+                               'from library.adapters.write_ahead_log import WriteAheadLog\n'
+                               'WriteAheadLog(sys.argv[1])\n'
+                               'print("ready", flush=True)\n'
+                               'sys.stdin.read()', str(log_path)],
+                              cwd=Path(__file__).parents[2], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert worker.stdout.readline() == 'ready\n'
+        app = create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH,
+                          'MEMORY_LOG': log_path, 'MEMORY_SNAPSHOT': snapshot_path})
+    finally:
+        worker.communicate('')
+
+    assert f'{log_path} is in use by another process' in caplog.text
+    # The snapshot the log is folded into is left to the worker which writes the log
+    assert not snapshot_path.exists()
+    assert app.test_client().get('/book?book_id=12413392').status_code == 200
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from pathlib import Path
 from typing import Iterable
@@ -7,8 +8,9 @@ import pytest
 from utils import get_project_root
 
 from library.domain.model import Publisher, Author, Book, Review, User, make_review, make_author_association, \
-    ModelException, make_publisher_association
-from library.adapters.json_data_reader import BooksJSONReader
+    ModelException, make_publisher_association, AssociationList
+from library.adapters import json_data_reader
+from library.adapters.json_data_reader import BooksJSONReader, FieldProjection, BOOK_FIELDS, split_lines
 
 
 @pytest.fixture()
@@ -270,6 +272,26 @@ class TestBook:
         book = Book(1, "    Harry Potter    ")
         assert str(book) == "<Book Harry Potter, book id = 1>"
 
+    def test_trusted_construction(self):
+        book = Book.from_trusted_record(84765876, "Harry Potter", "A wizard", 1997, False, 223, "https://x.org/1.jpg")
+        assert str(book) == "<Book Harry Potter, book id = 84765876>"
+        assert (book.description, book.release_year, book.ebook, book.num_pages, book.image_url) == \
+               ("A wizard", 1997, False, 223, "https://x.org/1.jpg")
+        assert book.publisher is None
+        assert list(book.authors) == [] and list(book.reviews) == [] and book.rating_count == 0
+
+        book = Book.from_trusted_record(1, "Harry Potter")
+        assert (book.description, book.release_year, book.ebook, book.num_pages, book.image_url) == \
+               (None, None, None, None, None)
+
+        # The setters still validate values set later
+        with pytest.raises(ValueError):
+            book.release_year = -1
+
+        author = Author.from_trusted_record(635, "J.K. Rowling")
+        assert author == Author(635, "J.K. Rowling") and author.full_name == "J.K. Rowling"
+        assert Publisher.from_trusted_record("Bloomsbury") == Publisher("Bloomsbury")
+
     def test_adding_author(self):
         book = Book(84765876, "Harry Potter")
         author = Author(635, "J.K. Rowling")
@@ -283,6 +305,19 @@ class TestBook:
         book.add_author(84)
         assert len(book.authors) == 1
 
+    def test_rating_aggregates(self):
+        book = Book(84765876, "Harry Potter")
+        user = User("lily", "Password1")
+        assert (book.rating_count, book.rating_total, book.rating_histogram) == (0, 0, (0, 0, 0, 0, 0))
+        assert book.average_rating is None
+
+        for rating in [5, 3, 5, 1]:
+            make_review(user, book, "Review text", rating)
+        book.add_review("This is not a review")
+
+        assert (book.rating_count, book.rating_total, book.rating_histogram) == (4, 14, (1, 0, 1, 0, 2))
+        assert book.average_rating == 3.5
+
     def test_adding_review(self):
         book = Book(84765876, "Harry Potter")
         user = User("lily", "Password1")
@@ -658,6 +693,76 @@ class TestBooksJSONReader:
         assert dataset_of_books[4].num_pages == 212
         assert dataset_of_books[6].num_pages == 329
 
+    def test_read_author_names(self):
+        root_folder = get_project_root()
+        reader = BooksJSONReader(str(root_folder / "tests/data/comic_books_excerpt.json"),
+                                 str(root_folder / "tests/data/book_authors_excerpt.json"))
+        author_names = reader.read_author_names()
+        assert author_names['169662'] == "Duncan Rouleau"
+        assert len(author_names) == len({author['author_id'] for author in reader.read_authors_file()})
+
+    def test_read_book_batches(self, read_books_and_authors):
+        root_folder = get_project_root()
+        reader = BooksJSONReader(str(root_folder / "tests/data/comic_books_excerpt.json"),
+                                 str(root_folder / "tests/data/book_authors_excerpt.json"))
+        batches = list(reader.read_book_batches(batch_size=5))
+        assert [len(batch) for batch in batches] == [5, 5, 4]
+
+        records = [record for batch in batches for record in batch]
+        assert [book for book, _, _ in records] == read_books_and_authors[0]
+        book, publisher_name, authors = records[0]
+        assert book.book_id == 12413392
+        assert publisher_name == ""
+        assert authors == [('169662', 'Duncan Rouleau'), ('23519', 'Joe Casey'), ('18119', 'Joe Kelly'),
+                           ('29688', 'Steven T. Seagle')]
+
+    def test_read_book_batches_in_parallel(self, monkeypatch):
+        root_folder = get_project_root()
+        books_file_name = str(root_folder / "tests/data/comic_books_excerpt.json")
+        reader = BooksJSONReader(books_file_name, str(root_folder / "tests/data/book_authors_excerpt.json"))
+
+        # Small ranges, so the file is split between several tasks
+        monkeypatch.setattr(json_data_reader, 'CHUNK_SIZE', 2048)
+        byte_ranges = split_lines(books_file_name, 4)
+        assert byte_ranges[0][0] == 0 and byte_ranges[-1][1] == Path(books_file_name).stat().st_size
+        assert all(end == start for (_, end), (start, _) in zip(byte_ranges, byte_ranges[1:]))
+
+        def records(batches):
+            return [(book.book_id, book.title, book.description, book.release_year, book.ebook, book.num_pages,
+                     book.image_url, publisher_name, authors)
+                    for batch in batches for book, publisher_name, authors in batch]
+
+        assert records(reader.read_book_batches(batch_size=5, workers=2)) == \
+               records(reader.read_book_batches(batch_size=5))
+
+    def test_field_projection(self):
+        project = FieldProjection(BOOK_FIELDS)
+        with open(get_project_root() / "tests/data/comic_books_excerpt.json", encoding='UTF-8') as books_file:
+            for line in books_file:
+                book_json = json.loads(line)
+                assert project(line) == {field: book_json[field] for field in BOOK_FIELDS}
+
+        # Keys inside strings and spacing around the colon don't change the values found
+        line = '{"title": "\\"book_id\\": 1", "book_id" : "12", "authors":[]}'
+        assert FieldProjection(['book_id', 'title', 'authors'])(line) == \
+               {'book_id': '12', 'title': '"book_id": 1', 'authors': []}
+        with pytest.raises(KeyError):
+            FieldProjection(['book_id', 'publisher'])(line)
+
+        books_file_name = str(get_project_root() / "tests/data/comic_books_excerpt.json")
+        full_books = BooksJSONReader(books_file_name, "").read_books_file()
+        assert BooksJSONReader(books_file_name, "", fields=BOOK_FIELDS).read_books_file() == \
+               [{field: book_json[field] for field in BOOK_FIELDS} for book_json in full_books]
+
+    def test_book_record_is_validated(self):
+        book_json = {'book_id': '12', 'title': '  Title ', 'publication_year': '2001', 'is_ebook': 'TRUE',
+                     'description': ' About it ', 'num_pages': '0', 'image_url': ''}
+        assert BooksJSONReader.book_record(book_json) == (12, 'Title', 'About it', 2001, True, None, None)
+
+        for key, value in [('book_id', '-1'), ('title', '  '), ('publication_year', '-5'), ('num_pages', 'x')]:
+            with pytest.raises(ValueError):
+                BooksJSONReader.book_record(dict(book_json, **{key: value}))
+
     def test_read_books_from_file_special_characters(self, read_books_and_authors):
         dataset_of_books = read_books_and_authors[0]
         assert dataset_of_books[13].title == "續．星守犬"
@@ -717,3 +822,36 @@ def test_make_publisher_associations_with_book_already_associated(book, publishe
 
     with pytest.raises(ModelException):
         make_publisher_association(book, publisher)
+
+
+def test_association_list_keeps_distinct_items_in_order():
+    books = [Book(book_id, f'Book {book_id}') for book_id in range(5)]
+    associations = AssociationList(books[:3])
+    associations.append(books[0])
+    associations.append(books[3])
+
+    assert associations == books[:4]
+    assert str(associations) == str(books[:4])
+    assert books[3] in associations
+    assert books[4] not in associations
+    assert [] not in associations
+
+    associations.remove(books[1])
+    assert associations == [books[0], books[2], books[3]]
+    assert books[1] not in associations
+    with pytest.raises(ValueError):
+        associations.remove(books[1])
+
+    del associations[0]
+    assert books[0] not in associations
+    assert associations.pop() == books[3]
+    assert associations == [books[2]]
+
+
+def test_empty_and_populated_associations_are_lists(book, author, publisher, user):
+    assert (book.authors, book.users_who_favourited, author.books, publisher.books, user.favourites) == \
+           ([], [], [], [], [])
+
+    make_author_association(book, author)
+    make_publisher_association(book, publisher)
+    assert (book.authors, author.books, publisher.books) == ([author], [book], [book])
@@ -1,9 +1,32 @@
+import gc
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
 from pathlib import Path
 
 import pytest
-
+from werkzeug.security import check_password_hash
+
+from library.adapters import repository_populate, json_data_importer, sort_orders
+from library.adapters.coauthor_graph import CoauthorGraph
+from library.adapters.file_lock import hold_file_lock
+from library.adapters.json_data_reader import garbage_collection_paused, process_pool
+from library.adapters.layered_dict import LayeredDict
+from library.adapters.layered_set import LayeredSet
+from library.adapters.memory_repository import MemoryRepository
+from library.adapters.memory_snapshot import SnapshotException
+from library.adapters.password_hashes import PasswordHashCache, hash_passwords
 from library.adapters.repository import RepositoryException
-from library.domain.model import Book, Author, Publisher, User, make_review, Review
+from library.adapters.sort_orders import SORT_KEYS
+from library.adapters.sorted_list import SortedList
+from library.adapters.write_ahead_log import WriteAheadLog, WriteAheadLogException
+from library.domain.model import Book, Author, Publisher, User, make_review, Review, make_author_association, \
+    make_publisher_association
+
+from tests.conftest import TEST_DATA_PATH
 
 
 def test_repository_can_add_a_user(in_memory_repo):
@@ -30,6 +53,105 @@ def test_repository_can_add_book(in_memory_repo):
     assert in_memory_repo.get_book(984819) is book
 
 
+def test_repository_can_add_books(in_memory_repo):
+    new_book = Book(984819, "Fruits Basket")
+    new_book.release_year = 2016
+    replacement = Book(13571772, "Captain Victory #7")
+    in_memory_repo.add_books([new_book, replacement])
+
+    assert in_memory_repo.get_book(984819) is new_book
+    assert in_memory_repo.get_book(13571772) is replacement
+    assert in_memory_repo.get_number_of_books() == 15
+    assert in_memory_repo.get_all_book_ids() == sorted(in_memory_repo.get_all_book_ids())
+    assert 984819 in in_memory_repo.get_book_ids_by_year(2016)
+    assert in_memory_repo.partial_search_books_by_title('fruits') == [984819]
+    assert in_memory_repo.partial_search_books_by_title('victory #7') == [13571772]
+
+    book_ids = in_memory_repo.get_all_book_ids()
+    titles = [book.title for book in in_memory_repo.get_books(in_memory_repo.sort_book_ids(book_ids, 'alphabetical'))]
+    assert titles == sorted(titles)
+
+
+def test_repository_can_add_authors_and_publishers(in_memory_repo):
+    in_memory_repo.add_authors([Author(1, 'Ann Author'), Author(2, 'Bo Author')])
+    existing_publisher = in_memory_repo.get_publisher('Marvel')
+    in_memory_repo.add_publishers([Publisher('New Publisher'), Publisher('Marvel')])
+
+    assert in_memory_repo.get_author(2) == Author(2, 'Bo Author')
+    assert in_memory_repo.get_publisher('New Publisher') == Publisher('New Publisher')
+    # Existing publishers are kept
+    assert in_memory_repo.get_publisher('Marvel') is existing_publisher
+
+
+def test_sorted_list_keeps_items_sorted():
+    class SmallBlocksList(SortedList):
+        BLOCK_SIZE = 4
+
+    generator = random.Random(235)
+    items = [generator.randrange(1000) for _ in range(200)]
+    sorted_list = SmallBlocksList(items[:50])
+    for item in items[50:]:
+        sorted_list.add(item)
+    copy = sorted_list.copy()
+    for item in items[:100]:
+        sorted_list.remove(item)
+    sorted_list.update(items[:20])
+
+    expected = sorted(items[100:] + items[:20])
+    assert list(sorted_list) == expected
+    assert len(sorted_list) == len(expected)
+    assert list(copy) == sorted(items)
+    assert items[150] in sorted_list and 1000 not in sorted_list
+    with pytest.raises(ValueError):
+        sorted_list.remove(1000)
+
+
+def test_layered_dict_copies_are_independent():
+    class SmallLayeredDict(LayeredDict):
+        MIN_CHANGES = 4
+
+    layered_dict = SmallLayeredDict((key, str(key)) for key in range(100))
+    copy = layered_dict.copy()
+    for key in range(0, 100, 10):
+        del layered_dict[key]
+    layered_dict[5] = 'five'
+    layered_dict.update({key: str(key) for key in range(100, 110)})
+    layered_dict.setdefault(200, 'two hundred')
+
+    expected = {key: str(key) for key in range(110) if key % 10 != 0 or key >= 100}
+    expected[5] = 'five'
+    expected[200] = 'two hundred'
+    assert dict(layered_dict.items()) == expected
+    assert list(layered_dict) == list(expected)
+    assert len(layered_dict) == len(expected)
+    assert layered_dict.items_of([5, 10, 105, 300]) == [(5, 'five'), (105, '105')]
+    assert 10 not in layered_dict and layered_dict.get(10) is None
+    with pytest.raises(KeyError):
+        layered_dict.pop(10)
+
+    assert dict(copy.items()) == {key: str(key) for key in range(100)}
+    assert len(copy) == 100
+
+
+def test_layered_set_copies_are_independent():
+    class SmallLayeredSet(LayeredSet):
+        MIN_CHANGES = 4
+
+    layered_set = SmallLayeredSet(range(100))
+    copy = layered_set.copy()
+    for item in range(0, 100, 10):
+        layered_set.discard(item)
+    layered_set.update(range(95, 110))
+    layered_set.add(200)
+
+    expected = {item for item in range(110) if item % 10 != 0 or item >= 100} | {200}
+    assert set(layered_set) == expected
+    assert len(layered_set) == len(expected)
+    assert layered_set.intersection({10, 11, 105, 300}) == {11, 105}
+    assert 10 not in layered_set and 200 in layered_set
+    assert set(copy) == set(range(100)) and len(copy) == 100
+
+
 def test_repository_can_retrieve_book(in_memory_repo):
     book = in_memory_repo.get_book(12413392)
 
@@ -122,6 +244,22 @@ def test_repository_can_partially_search_by_title_with_surrounding_whitespace(in
     assert Book(18355356, 'An Historical Introduction to American Education') in matching_books
 
 
+def test_repository_can_partially_search_by_title_shorter_than_a_trigram(in_memory_repo):
+    matching_book_ids = in_memory_repo.partial_search_books_by_title('#7')
+    matching_books = in_memory_repo.get_books(matching_book_ids)
+
+    assert len(matching_books) == 1
+    assert matching_books[0].book_id == 13571772
+
+
+def test_repository_can_partially_search_by_title_of_added_book(in_memory_repo):
+    in_memory_repo.add_book(Book(984819, "Fruits Basket"))
+    in_memory_repo.add_book(Book(984820, "The Basketball Diaries"))
+
+    assert in_memory_repo.partial_search_books_by_title('BASKET') == [984819, 984820]
+    assert in_memory_repo.partial_search_books_by_title('ts bas') == [984819]
+
+
 def test_repository_partial_search_by_title_does_not_return_all_if_empty_string(in_memory_repo):
     title = ""
     matching_book_ids = in_memory_repo.partial_search_books_by_title(title)
@@ -161,6 +299,14 @@ def test_repository_get_book_ids_by_year(in_memory_repo):
     assert books[0].title == "L'isola dell'amore proibito"
 
 
+def test_repository_get_book_ids_by_year_includes_added_book(in_memory_repo):
+    book = Book(984819, "Fruits Basket")
+    book.release_year = 2013
+    in_memory_repo.add_book(book)
+
+    assert in_memory_repo.get_book_ids_by_year(2013) == [984819, 17373671]
+
+
 def test_repository_get_book_ids_by_year_when_year_does_not_exist_or_invalid(in_memory_repo):
     year = 0
     book_ids = in_memory_repo.get_book_ids_by_year(year)
@@ -173,6 +319,63 @@ def test_repository_get_book_ids_by_year_when_year_does_not_exist_or_invalid(in_
     assert len(books) == 0
 
 
+def test_repository_can_filter_book_ids(in_memory_repo):
+    assert in_memory_repo.filter_book_ids(year=2012) == [12349663, 13571772, 16201706]
+    assert in_memory_repo.filter_book_ids(year=2012, min_pages=200) == [12349663, 16201706]
+    assert in_memory_repo.filter_book_ids(min_pages=300) == [10866987, 17373671]
+    assert in_memory_repo.filter_book_ids(max_pages=192, ebook=True) == [18955715]
+    assert in_memory_repo.filter_book_ids(publisher_names=['Marvel', 'Ingram']) == [2168737, 18355356]
+    assert in_memory_repo.filter_book_ids([13571772, 16201706, 1], year=2012) == [13571772, 16201706]
+    assert in_memory_repo.filter_book_ids(year='2012') == []
+
+
+def test_repository_can_sort_book_ids(in_memory_repo):
+    book_ids = [35452242, 12413392, 16201706, 2168737]
+
+    assert in_memory_repo.sort_book_ids(book_ids, 'ascending') == [12413392, 2168737, 16201706, 35452242]
+    assert in_memory_repo.sort_book_ids(book_ids, 'descending') == [16201706, 2168737, 12413392, 35452242]
+    assert in_memory_repo.sort_book_ids(book_ids, 'best_reviewed') == [35452242, 12413392, 2168737, 16201706]
+    assert in_memory_repo.sort_book_ids(book_ids, 'most_reviewed') == [12413392, 35452242, 2168737, 16201706]
+    assert in_memory_repo.sort_book_ids(book_ids, 'alphabetical') == [35452242, 16201706, 2168737, 12413392]
+    assert in_memory_repo.sort_book_ids(book_ids + [1], None) == [35452242, 16201706, 2168737, 12413392]
+
+
+def test_repository_sort_orders_are_built_before_they_are_published(in_memory_repo, monkeypatch):
+    def build_permutation(*args):
+        raise AssertionError('A published sort order was changed by a reader')
+    monkeypatch.setattr(sort_orders, 'SortedList', build_permutation)
+
+    book_ids = in_memory_repo.get_all_book_ids()
+    for sort_by in SORT_KEYS:
+        assert sorted(in_memory_repo.sort_book_ids(book_ids, sort_by)) == book_ids
+
+
+def test_repository_sort_book_ids_includes_new_reviews(in_memory_repo):
+    book_ids = [35452242, 12413392, 16201706]
+    assert in_memory_repo.sort_book_ids(book_ids, 'most_reviewed') == [12413392, 35452242, 16201706]
+
+    user = in_memory_repo.get_user('thorke')
+    for rating in [5, 5, 5]:
+        in_memory_repo.add_review(make_review(user, in_memory_repo.get_book(16201706), "This is a review", rating))
+
+    assert in_memory_repo.sort_book_ids(book_ids, 'most_reviewed') == [16201706, 12413392, 35452242]
+    assert in_memory_repo.sort_book_ids(book_ids, 'best_reviewed') == [16201706, 35452242, 12413392]
+
+
+def test_repository_sort_book_ids_includes_added_books(in_memory_repo):
+    all_book_ids = in_memory_repo.get_all_book_ids()
+    assert in_memory_repo.sort_book_ids(all_book_ids, 'alphabetical')[0] == 18355356
+
+    book = Book(984819, "Akira")
+    book.release_year = 1982
+    in_memory_repo.add_book(book)
+    all_book_ids.append(984819)
+
+    assert in_memory_repo.sort_book_ids(all_book_ids, 'alphabetical')[0] == 984819
+    assert in_memory_repo.sort_book_ids(all_book_ids, 'ascending')[0] == 984819
+    assert in_memory_repo.sort_book_ids([984819, 12413392], 'descending') == [12413392, 984819]
+
+
 def test_repository_can_add_an_author(in_memory_repo):
     author = Author(134, "Nick")
     in_memory_repo.add_author(author)
@@ -204,6 +407,14 @@ def test_repository_get_book_ids_by_author(in_memory_repo):
     assert books[0].title == 'Little Bigfoot Goes to Town'
 
 
+def test_repository_get_book_ids_by_author_includes_new_association(in_memory_repo):
+    book = Book(984819, "Fruits Basket")
+    in_memory_repo.add_book(book)
+    make_author_association(book, in_memory_repo.get_author(6601585))
+
+    assert in_memory_repo.get_book_ids_by_author(Author(6601585, 'Spike Brown')) == [984819, 16201706]
+
+
 def test_repository_get_book_ids_by_author_when_author_does_not_exist(in_memory_repo):
     author = Author(1, 'Jane')
     book_ids = in_memory_repo.get_book_ids_by_author(author)
@@ -212,6 +423,46 @@ def test_repository_get_book_ids_by_author_when_author_does_not_exist(in_memory_
     assert len(books) == 0
 
 
+def test_repository_get_book_ids_by_author_and_publisher_set_on_the_book():
+    repo = MemoryRepository()
+    book = Book(10, 'Book')
+    book.add_author(Author(1, 'Author'))
+    book.publisher = Publisher('Publisher')
+    repo.add_book(book)
+
+    assert repo.get_book_ids_by_author(Author(1, 'Author')) == [10]
+    assert repo.get_book_ids_by_publisher(Publisher('Publisher')) == [10]
+
+
+def test_repository_get_book_ids_by_author_added_after_the_book():
+    repo = MemoryRepository()
+    book = Book(10, 'Book')
+    author = Author(1, 'Author')
+    make_author_association(book, author)
+    repo.add_book(book)
+    repo.add_author(author)
+
+    assert repo.get_book_ids_by_author(Author(1, 'Author')) == [10]
+
+
+def test_repository_get_book_ids_by_author_and_publisher_of_a_replaced_book():
+    repo = MemoryRepository()
+    book = Book(10, 'Book')
+    book.add_author(Author(1, 'Author'))
+    book.publisher = Publisher('Publisher')
+    repo.add_book(book)
+
+    replacement = Book(10, 'Book')
+    replacement.add_author(Author(2, 'Other author'))
+    replacement.publisher = Publisher('Other publisher')
+    repo.add_books([replacement])
+
+    assert repo.get_book_ids_by_author(Author(1, 'Author')) == []
+    assert repo.get_book_ids_by_publisher(Publisher('Publisher')) == []
+    assert repo.get_book_ids_by_author(Author(2, 'Other author')) == [10]
+    assert repo.get_book_ids_by_publisher(Publisher('Other publisher')) == [10]
+
+
 def test_repository_get_all_publishers(in_memory_repo):
     publishers = in_memory_repo.get_publishers()
     assert len(publishers) == 7
@@ -307,6 +558,57 @@ def test_repository_partial_search_by_author_does_not_return_all_if_invalid(in_m
     assert matching_books == []
 
 
+def test_repository_can_get_coauthors(in_memory_repo):
+    coauthors = in_memory_repo.get_coauthors(169662)
+    assert [author.unique_id for author in coauthors] == [18119, 23519, 29688]
+    assert coauthors[0] is in_memory_repo.get_author(18119)
+    assert in_memory_repo.get_author(169662).check_if_this_author_coauthored_with(coauthors[0])
+
+    assert in_memory_repo.get_coauthors(8551671) == []
+    assert in_memory_repo.get_coauthors(1) == []
+
+
+def test_repository_can_get_related_authors(in_memory_repo):
+    first = Author(1, 'First')
+    second = Author(2, 'Second')
+    third = Author(3, 'Third')
+    for book_id, authors in [(1, [first, second]), (2, [second, third])]:
+        book = Book(book_id, f'Book {book_id}')
+        for author in authors:
+            make_author_association(book, author)
+        in_memory_repo.add_book(book)
+    in_memory_repo.add_authors([first, second, third])
+
+    assert in_memory_repo.get_coauthors(1) == [second]
+    assert in_memory_repo.get_related_authors(1, max_depth=1) == [second]
+    assert in_memory_repo.get_related_authors(1) == [second, third]
+    assert in_memory_repo.get_related_authors(3) == [second, first]
+    assert in_memory_repo.get_related_authors(1, max_depth=0) == []
+
+
+def test_coauthor_graph_matches_a_breadth_first_search():
+    rng = random.Random(7)
+    books = [rng.sample(range(40), rng.randint(1, 3)) for _ in range(50)]
+    graph = CoauthorGraph(books)
+
+    neighbours = dict()
+    for author_ids in books:
+        for author_id in author_ids:
+            neighbours.setdefault(author_id, set()).update(set(author_ids) - {author_id})
+
+    for author_id in range(45):
+        assert graph.coauthor_ids(author_id) == sorted(neighbours.get(author_id, ()))
+        for max_depth in [1, 2, 3]:
+            seen = {author_id}
+            level = {author_id} if author_id in neighbours else set()
+            expected = []
+            for _ in range(max_depth):
+                level = set().union(*(neighbours[other] for other in level)) - seen
+                seen |= level
+                expected += sorted(level)
+            assert graph.related_author_ids(author_id, max_depth) == expected
+
+
 def test_repository_can_add_and_retrieve_a_publisher(in_memory_repo):
     publisher = Publisher('Apple')
     in_memory_repo.add_publisher(publisher)
@@ -328,6 +630,14 @@ def test_repository_get_book_ids_by_publisher(in_memory_repo):
     assert books[0].title == 'An Historical Introduction to American Education'
 
 
+def test_repository_get_book_ids_by_publisher_includes_new_association(in_memory_repo):
+    book = Book(984819, "Fruits Basket")
+    in_memory_repo.add_book(book)
+    make_publisher_association(book, in_memory_repo.get_publisher('Ingram'))
+
+    assert in_memory_repo.get_book_ids_by_publisher(Publisher('Ingram')) == [984819, 18355356]
+
+
 def test_repository_get_book_ids_by_publisher_when_publisher_does_not_exist(in_memory_repo):
     publisher = Publisher('Fake Publisher')
     book_ids = in_memory_repo.get_book_ids_by_author(publisher)
@@ -502,3 +812,396 @@ def test_repository_does_not_add_a_review_without_a_book_properly_attached2(in_m
 
 def test_repository_can_retrieve_reviews(in_memory_repo):
     assert len(in_memory_repo.get_reviews()) == 3
+
+
+def test_repository_can_retrieve_reviews_for_a_book_newest_first(in_memory_repo):
+    user = in_memory_repo.get_user('fmercury')
+    book = in_memory_repo.get_book(12413392)
+    for number in range(3, 6):
+        in_memory_repo.add_review(make_review(user, book, f'This is a review {number}', 4))
+
+    texts = [review.review_text for review in in_memory_repo.get_reviews_for_book(12413392)]
+    assert texts == [f'This is a review {number}' for number in range(5, 0, -1)]
+
+    page = in_memory_repo.get_reviews_for_book(12413392, offset=1, limit=2)
+    assert [review.review_text for review in page] == ['This is a review 4', 'This is a review 3']
+    assert in_memory_repo.get_reviews_for_book(12413392, offset=5, limit=2) == []
+    assert in_memory_repo.get_reviews_for_book(1, 0, 10) == []
+
+
+def test_repository_review_log_is_not_changed_by_a_discarded_batch(in_memory_repo):
+    user = in_memory_repo.get_user('fmercury')
+    book = in_memory_repo.get_book(30525379)
+
+    with pytest.raises(RuntimeError):
+        with in_memory_repo.batch():
+            in_memory_repo.add_review(make_review(user, book, 'Discarded', 1))
+            raise RuntimeError
+    review = make_review(user, book, 'Kept', 5)
+    in_memory_repo.add_review(review)
+
+    reviews = list(in_memory_repo.get_reviews())
+    assert len(reviews) == 4
+    assert reviews[0] is review
+
+
+def test_repository_batch_is_not_visible_to_other_threads_until_finished(in_memory_repo):
+    seen_by_other_thread = []
+
+    def read_user():
+        seen_by_other_thread.append(in_memory_repo.get_user('dave'))
+
+    with in_memory_repo.batch():
+        in_memory_repo.add_user(User('dave', '123456789'))
+        in_memory_repo.add_book(Book(984819, "Fruits Basket"))
+
+        # The writing thread sees its own changes
+        assert in_memory_repo.get_user('dave') is not None
+        assert in_memory_repo.get_number_of_books() == 15
+
+        reader = threading.Thread(target=read_user)
+        reader.start()
+        reader.join()
+
+    assert seen_by_other_thread == [None]
+    assert in_memory_repo.get_user('dave') is not None
+    assert in_memory_repo.get_number_of_books() == 15
+
+
+def test_repository_batch_is_discarded_on_error(in_memory_repo):
+    with pytest.raises(ValueError):
+        with in_memory_repo.batch():
+            in_memory_repo.add_book(Book(984819, "Fruits Basket"))
+            raise ValueError
+
+    assert in_memory_repo.get_book(984819) is None
+    assert in_memory_repo.partial_search_books_by_title('Fruits') == []
+
+
+def test_repository_can_be_read_while_other_threads_write(in_memory_repo):
+    errors = []
+
+    def write(thread_number):
+        try:
+            for i in range(50):
+                user = User(f'user{thread_number}x{i}', '123456789')
+                in_memory_repo.add_user(user)
+                book = in_memory_repo.get_book(12413392)
+                in_memory_repo.add_review(make_review(user, book, "This is a review", 1 + i % 5))
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            for i in range(50):
+                in_memory_repo.sort_book_ids(in_memory_repo.get_all_book_ids(), 'best_reviewed')
+                in_memory_repo.partial_search_books_by_title('the')
+                len(in_memory_repo.get_reviews())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    threads += [threading.Thread(target=read) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(in_memory_repo.get_reviews()) == 3 + 4 * 50
+    assert in_memory_repo.sort_book_ids([12413392, 35452242], 'most_reviewed') == [12413392, 35452242]
+
+
+def test_repository_can_save_and_load_a_snapshot(in_memory_repo, tmp_path):
+    user = in_memory_repo.get_user('fmercury')
+    in_memory_repo.update_favourites(user, in_memory_repo.get_book(30525379))
+    in_memory_repo.add_user(User('dave', '123456789'))
+    in_memory_repo.add_review(make_review(user, in_memory_repo.get_book(30525379), "A new review", 4))
+
+    in_memory_repo.save_snapshot(tmp_path / 'repository.snapshot')
+    restored_repo = MemoryRepository()
+    restored_repo.load_snapshot(tmp_path / 'repository.snapshot')
+
+    assert restored_repo.get_all_book_ids() == in_memory_repo.get_all_book_ids()
+    assert len(restored_repo.get_authors()) == len(in_memory_repo.get_authors())
+    assert len(restored_repo.get_publishers()) == len(in_memory_repo.get_publishers())
+
+    book = restored_repo.get_book(12413392)
+    original_book = in_memory_repo.get_book(12413392)
+    assert (book.title, book.description, book.publisher, book.authors, book.release_year, book.ebook,
+            book.num_pages, book.image_url) == \
+           (original_book.title, original_book.description, original_book.publisher, original_book.authors,
+            original_book.release_year, original_book.ebook, original_book.num_pages, original_book.image_url)
+    assert restored_repo.get_book_ids_by_author(Author(18119, 'Joe Kelly')) == [12413392]
+    assert restored_repo.get_book_ids_by_publisher(Publisher('Ingram')) == [18355356]
+
+    assert restored_repo.get_user('dave').password == '123456789'
+    assert restored_repo.get_user('fmercury').favourites == [restored_repo.get_book(30525379)]
+    assert [(review.user, review.book, review.review_text, review.rating, review.timestamp)
+            for review in restored_repo.get_reviews()] == \
+           [(review.user, review.book, review.review_text, review.rating, review.timestamp)
+            for review in in_memory_repo.get_reviews()]
+    assert [review.review_text for review in restored_repo.get_book(12413392).reviews] == \
+           ['This is a review 2', 'This is a review 1']
+
+
+def test_repository_does_not_load_a_corrupt_snapshot(in_memory_repo, tmp_path):
+    snapshot_path = tmp_path / 'repository.snapshot'
+    in_memory_repo.save_snapshot(snapshot_path)
+    data = bytearray(snapshot_path.read_bytes())
+    data[-1] ^= 0xFF
+    snapshot_path.write_bytes(bytes(data))
+
+    restored_repo = MemoryRepository()
+    with pytest.raises(SnapshotException):
+        restored_repo.load_snapshot(snapshot_path)
+
+    assert restored_repo.get_number_of_books() == 0
+
+
+def test_repository_does_not_load_a_snapshot_with_a_review_of_a_missing_book(in_memory_repo, tmp_path):
+    user = in_memory_repo.get_user('fmercury')
+    in_memory_repo.add_review(make_review(user, Book(1, 'Not in the repository'), "A review", 3))
+    snapshot_path = tmp_path / 'repository.snapshot'
+    in_memory_repo.save_snapshot(snapshot_path)
+
+    restored_repo = MemoryRepository()
+    with pytest.raises(SnapshotException):
+        restored_repo.load_snapshot(snapshot_path)
+
+    assert restored_repo.get_number_of_books() == 0
+
+
+def test_file_lock_is_held_until_the_process_exits(tmp_path):
+    fcntl = pytest.importorskip('fcntl')
+    lock_path = tmp_path / 'repository.snapshot.lock'
+    assert hold_file_lock(lock_path)
+    assert hold_file_lock(lock_path)
+
+    # Another process (or open file) can't take the lock
+    file_number = os.open(lock_path, os.O_RDWR)
+    try:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(file_number, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    finally:
+        os.close(file_number)
+
+
+def test_repository_does_not_load_a_snapshot_from_another_format_version(in_memory_repo, tmp_path):
+    snapshot_path = tmp_path / 'repository.snapshot'
+    in_memory_repo.save_snapshot(snapshot_path)
+    data = bytearray(snapshot_path.read_bytes())
+    data[8] += 1
+    snapshot_path.write_bytes(bytes(data))
+
+    with pytest.raises(SnapshotException):
+        MemoryRepository().load_snapshot(snapshot_path)
+
+
+def make_populated_repo():
+    repo = MemoryRepository()
+    repository_populate.populate(TEST_DATA_PATH, repo, False)
+    return repo
+
+
+def test_repository_replays_its_write_ahead_log(in_memory_repo, tmp_path):
+    in_memory_repo.replay_log(WriteAheadLog(tmp_path / 'changes.log'))
+    user = User('dave', '123456789')
+    in_memory_repo.add_user(user)
+    book = in_memory_repo.get_book(30525379)
+    in_memory_repo.add_review(make_review(user, book, 'Logged review', 4))
+    in_memory_repo.update_favourites(user, book)
+    in_memory_repo.update_favourites(user, in_memory_repo.get_book(13571772))
+    in_memory_repo.update_favourites(user, in_memory_repo.get_book(13571772))
+
+    restored_repo = make_populated_repo()
+    restored_repo.replay_log(WriteAheadLog(tmp_path / 'changes.log'))
+
+    restored_user = restored_repo.get_user('dave')
+    assert restored_user.password == '123456789'
+    assert restored_user.favourites == [restored_repo.get_book(30525379)]
+    review = list(restored_repo.get_reviews())[0]
+    assert (review.user, review.book.book_id, review.review_text, review.rating, review.timestamp) == \
+           (restored_user, 30525379, 'Logged review', 4, list(in_memory_repo.get_reviews())[0].timestamp)
+    assert len(restored_repo.get_reviews()) == len(in_memory_repo.get_reviews())
+
+
+def test_repository_write_ahead_log_ignores_a_partly_written_record(in_memory_repo, tmp_path):
+    log_path = tmp_path / 'changes.log'
+    in_memory_repo.replay_log(WriteAheadLog(log_path))
+    in_memory_repo.add_user(User('dave', '123456789'))
+    with open(log_path, 'ab') as log_file:
+        log_file.write(b'\x40\x00\x00\x00partial')
+
+    restored_repo = make_populated_repo()
+    restored_repo.replay_log(WriteAheadLog(log_path))
+    restored_repo.add_user(User('erin', '123456789'))
+
+    assert [record['user_name'] for record in WriteAheadLog(log_path).records()] == ['dave', 'erin']
+
+
+def test_repository_write_ahead_log_is_compacted(in_memory_repo, tmp_path):
+    log_path = tmp_path / 'changes.log'
+    in_memory_repo.replay_log(WriteAheadLog(log_path, compact_after=10))
+    user = in_memory_repo.get_user('fmercury')
+    book = in_memory_repo.get_book(30525379)
+    for _ in range(25):
+        in_memory_repo.update_favourites(user, book)
+
+    assert len(list(WriteAheadLog(log_path).records())) < 10
+
+    restored_repo = make_populated_repo()
+    restored_repo.replay_log(WriteAheadLog(log_path))
+    assert restored_repo.get_book(30525379) in restored_repo.get_user('fmercury').favourites
+
+
+def test_repository_write_ahead_log_is_folded_into_the_snapshot(in_memory_repo, tmp_path):
+    log_path = tmp_path / 'changes.log'
+    snapshot_path = tmp_path / 'repository.snapshot'
+    in_memory_repo.replay_log(WriteAheadLog(log_path, compact_after=10), snapshot_path)
+    user = User('dave', '123456789')
+    in_memory_repo.add_user(user)
+    in_memory_repo.add_review(make_review(user, in_memory_repo.get_book(30525379), 'Folded review', 4))
+    for _ in range(23):
+        in_memory_repo.update_favourites(user, in_memory_repo.get_book(13571772))
+    in_memory_repo.add_review(make_review(user, in_memory_repo.get_book(30525379), 'Logged review', 5))
+
+    # The first 19 records were folded into the snapshot
+    assert [record['type'] for record in WriteAheadLog(log_path).records()] == ['favourite'] * 6 + ['review']
+
+    # Restored from the snapshot, only the changes still in the log are replayed
+    restored_repo = MemoryRepository()
+    restored_repo.load_snapshot(snapshot_path)
+    restored_repo.replay_log(WriteAheadLog(log_path), snapshot_path)
+    # Repopulated from the data files, the changes folded into the snapshot are replayed too
+    repopulated_repo = make_populated_repo()
+    repopulated_repo.replay_log(WriteAheadLog(log_path), snapshot_path)
+
+    for repo in [restored_repo, repopulated_repo]:
+        assert repo.get_user('dave').favourites == [repo.get_book(13571772)]
+        assert [review.review_text for review in repo.get_reviews()] == \
+               [review.review_text for review in in_memory_repo.get_reviews()]
+
+
+def test_repository_snapshot_is_on_disk_before_the_log_is_truncated(in_memory_repo, tmp_path, monkeypatch):
+    if not Path('/proc/self/fd').exists():
+        pytest.skip('The files being flushed are named from /proc')
+    log_path = tmp_path / 'changes.log'
+    snapshot_path = tmp_path / 'repository.snapshot'
+    in_memory_repo.replay_log(WriteAheadLog(log_path), snapshot_path)
+    in_memory_repo.add_user(User('dave', '123456789'))
+
+    events = []
+    fsync, replace, truncate = os.fsync, os.replace, WriteAheadLog.truncate
+
+    def record_fsync(file_number):
+        events.append(('fsync', os.path.basename(os.readlink(f'/proc/self/fd/{file_number}'))))
+        fsync(file_number)
+
+    def record_replace(source, destination):
+        events.append(('replace', os.path.basename(destination)))
+        replace(source, destination)
+
+    def record_truncate(log, sequence):
+        events.append(('truncate', log_path.name))
+        truncate(log, sequence)
+    monkeypatch.setattr(os, 'fsync', record_fsync)
+    monkeypatch.setattr(os, 'replace', record_replace)
+    monkeypatch.setattr(WriteAheadLog, 'truncate', record_truncate)
+    in_memory_repo.fold_log()
+
+    # The snapshot, then the directory it was renamed in, are flushed before the log is truncated
+    assert events[:4] == [('fsync', f'{snapshot_path.name}.{os.getpid()}.tmp'), ('replace', snapshot_path.name),
+                          ('fsync', tmp_path.name), ('truncate', log_path.name)]
+
+
+def test_write_ahead_log_is_only_opened_by_one_process(tmp_path):
+    pytest.importorskip('fcntl')
+    log_path = tmp_path / 'changes.log'
+    WriteAheadLog(log_path)
+
+    result = subprocess.run([sys.executable, '-c', 'import sys\n'
+                             'from library.adapters.write_ahead_log import WriteAheadLog\n'
+                             'WriteAheadLog(sys.argv[1])', str(log_path)],
+                            cwd=Path(__file__).parents[2], capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'is in use by another process' in result.stderr
+
+
+def test_write_ahead_log_does_not_open_other_files(tmp_path):
+    log_path = tmp_path / 'changes.log'
+    log_path.write_bytes(b'not a log file')
+
+    with pytest.raises(WriteAheadLogException):
+        WriteAheadLog(log_path)
+
+
+def test_repository_users_reuse_cached_password_hashes(tmp_path, monkeypatch):
+    cache_path = tmp_path / 'password_hashes.csv'
+    repo = MemoryRepository()
+    users = json_data_importer.load_users(TEST_DATA_PATH, repo, password_hashes=PasswordHashCache(cache_path, 'key'))
+    assert check_password_hash(users['1'].password, 'cLQ^C#oFXloS')
+    assert len(PasswordHashCache(cache_path, 'key')) == 2
+    assert 'cLQ^C#oFXloS' not in cache_path.read_text()
+
+    # Once cached, the passwords aren't hashed again
+    def hash_passwords(passwords, workers=1):
+        raise AssertionError(f'{len(passwords)} passwords hashed')
+    monkeypatch.setattr(json_data_importer, 'hash_passwords', hash_passwords)
+    other_users = json_data_importer.load_users(TEST_DATA_PATH, MemoryRepository(),
+                                                password_hashes=PasswordHashCache(cache_path, 'key'))
+    assert [user.password for user in other_users.values()] == [user.password for user in users.values()]
+
+    # The hashes are keyed with the secret key
+    with pytest.raises(AssertionError):
+        json_data_importer.load_users(TEST_DATA_PATH, MemoryRepository(),
+                                      password_hashes=PasswordHashCache(cache_path, 'other key'))
+
+    # The hashes can't be keyed without a secret key
+    for secret_key in [None, '']:
+        with pytest.raises(ValueError):
+            PasswordHashCache(cache_path, secret_key)
+
+
+def test_garbage_collection_is_only_paused_on_the_main_thread():
+    with garbage_collection_paused():
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+    # An import in a background thread leaves the collector running for the rest of the process
+    enabled = []
+
+    def import_in_background():
+        with garbage_collection_paused():
+            enabled.append(gc.isenabled())
+    thread = threading.Thread(target=import_in_background)
+    thread.start()
+    thread.join()
+    assert enabled == [True]
+
+
+def test_process_pools_are_only_forked_from_the_main_thread():
+    assert process_pool(1)._mp_context.get_start_method() == multiprocessing.get_start_method()
+
+    # A background warm-up's pools spawn their processes, which don't inherit the locks of other threads
+    start_methods = []
+    hashes = []
+
+    def load_in_background():
+        start_methods.append(process_pool(1)._mp_context.get_start_method())
+        hashes.extend(hash_passwords(['first', 'second'], workers=2))
+    thread = threading.Thread(target=load_in_background)
+    thread.start()
+    thread.join()
+    assert start_methods == ['spawn']
+    assert check_password_hash(hashes[0], 'first') and check_password_hash(hashes[1], 'second')
+
+def test_repository_users_can_be_loaded_from_a_hashed_users_file(tmp_path, monkeypatch):
+    json_data_importer.write_hashed_users_file(TEST_DATA_PATH, tmp_path / 'users.csv', workers=2)
+    assert (tmp_path / 'users.csv').read_text().startswith('id,username,password_hash')
+
+    monkeypatch.setattr(json_data_importer, 'hash_passwords', None)
+    repo = MemoryRepository()
+    json_data_importer.load_users(tmp_path, repo)
+    assert check_password_hash(repo.get_user('thorke').password, 'cLQ^C#oFXloS')
+    assert check_password_hash(repo.get_user('fmercury').password, 'mvNNbc1eLA$i')
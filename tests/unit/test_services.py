@@ -342,3 +342,18 @@ class TestBrowseServices:
         assert sorted_books[0]['id'] == 35452242
         assert sorted_books[1]['id'] == 16201706
         assert sorted_books[2]['id'] == 12413392
+
+    def test_sort_books_returns_one_page(self, in_memory_repo, monkeypatch):
+        book_ids = [35452242, 12413392, 16201706]
+        fetched_ids = []
+        get_books = in_memory_repo.get_books
+
+        def record_get_books(id_list):
+            fetched_ids.extend(id_list)
+            return get_books(id_list)
+        monkeypatch.setattr(in_memory_repo, 'get_books', record_get_books)
+
+        sorted_books = browse_services.sort_books(book_ids, 'alphabetical', in_memory_repo, 1, 1)
+        assert [book['id'] for book in sorted_books] == [16201706]
+        # Only the Books of the page are fetched
+        assert fetched_ids == [16201706]
@@ -0,0 +1,227 @@
+import gc
+import weakref
+
+import pytest
+
+from library import create_app
+from library.adapters import repository_populate
+from library.adapters.database_import import books_reader
+from library.adapters.json_data_importer import load_users, load_reviews
+from library.adapters.memory_repository import MemoryRepository
+from library.adapters.repository import RepositoryException
+from library.adapters.shared_catalog import SharedCatalog, SharedCatalogException, catalog_is_current, HEADER, MAGIC
+from library.adapters.shared_catalog_repository import SharedCatalogRepository, build_shared_catalog, \
+    compile_shared_catalog
+from library.domain.model import Book, Author, Publisher, User, make_review
+
+from tests.conftest import TEST_DATA_PATH
+
+
+@pytest.fixture
+def shared_catalog_repo(in_memory_repo, tmp_path):
+    catalog_path = tmp_path / 'catalog.bin'
+    build_shared_catalog(catalog_path, in_memory_repo)
+
+    repo = SharedCatalogRepository(catalog_path)
+    users = load_users(TEST_DATA_PATH, repo)
+    load_reviews(TEST_DATA_PATH, repo, users)
+    return repo
+
+
+def test_shared_catalog_has_the_same_books(in_memory_repo, shared_catalog_repo):
+    assert shared_catalog_repo.get_number_of_books() == in_memory_repo.get_number_of_books()
+    assert shared_catalog_repo.get_all_book_ids() == in_memory_repo.get_all_book_ids()
+
+    for book_id in in_memory_repo.get_all_book_ids():
+        book = shared_catalog_repo.get_book(book_id)
+        expected = in_memory_repo.get_book(book_id)
+        assert (book.title, book.description, book.publisher, book.release_year, book.ebook, book.num_pages,
+                book.image_url, book.authors) == \
+               (expected.title, expected.description, expected.publisher, expected.release_year, expected.ebook,
+                expected.num_pages, expected.image_url, expected.authors)
+        assert [author.full_name for author in book.authors] == [author.full_name for author in expected.authors]
+
+    assert shared_catalog_repo.get_book(1) is None
+    assert shared_catalog_repo.get_book('13571772') is None
+
+
+def test_shared_catalog_returns_the_same_book_object(shared_catalog_repo):
+    assert shared_catalog_repo.get_book(13571772) is shared_catalog_repo.get_book(13571772)
+    assert shared_catalog_repo.get_books([13571772])[0] is shared_catalog_repo.get_book(13571772)
+
+
+def test_shared_catalog_keeps_only_the_books_in_use(shared_catalog_repo):
+    user = shared_catalog_repo.get_user('thorke')
+    shared_catalog_repo.update_favourites(user, shared_catalog_repo.get_book(13571772))
+    reviewed_book = shared_catalog_repo.get_reviews()[0].book
+    unused_book = weakref.ref(shared_catalog_repo.get_book(18955715))
+    gc.collect()
+
+    assert unused_book() is None
+    assert shared_catalog_repo.get_book(13571772) is user.favourites[0]
+    assert shared_catalog_repo.get_book(reviewed_book.book_id) is reviewed_book
+
+    # Authors and Publishers are not linked to their Books, which are looked up in the catalog instead
+    author = shared_catalog_repo.get_book(13571772).authors[0]
+    assert author.books == []
+    assert shared_catalog_repo.get_book_ids_by_author(author) != []
+
+
+def test_shared_catalog_can_look_up_books(in_memory_repo, shared_catalog_repo):
+    for query in ['the', '#7', 'Avengers', 'zzz', '']:
+        assert shared_catalog_repo.partial_search_books_by_title(query) == \
+               in_memory_repo.partial_search_books_by_title(query)
+
+    for year in [2012, 2013, 2016, 1900]:
+        assert shared_catalog_repo.get_book_ids_by_year(year) == in_memory_repo.get_book_ids_by_year(year)
+
+    for author in in_memory_repo.get_authors():
+        assert shared_catalog_repo.get_book_ids_by_author(author) == in_memory_repo.get_book_ids_by_author(author)
+        assert shared_catalog_repo.get_author(author.unique_id).full_name == author.full_name
+
+    for publisher in in_memory_repo.get_publishers():
+        assert shared_catalog_repo.get_book_ids_by_publisher(publisher) == \
+               in_memory_repo.get_book_ids_by_publisher(publisher)
+    assert sorted(shared_catalog_repo.get_publishers()) == sorted(in_memory_repo.get_publishers())
+
+    for query in ['a', 'Marvel', 'nobody']:
+        assert sorted(shared_catalog_repo.partial_search_authors(query)) == \
+               sorted(in_memory_repo.partial_search_authors(query))
+        assert sorted(shared_catalog_repo.partial_search_publishers(query)) == \
+               sorted(in_memory_repo.partial_search_publishers(query))
+
+
+def test_shared_catalog_can_filter_and_sort_book_ids(in_memory_repo, shared_catalog_repo):
+    book_ids = in_memory_repo.get_all_book_ids()
+    publisher_names = [publisher.name for publisher in in_memory_repo.get_publishers()][:3]
+
+    assert shared_catalog_repo.filter_book_ids(publisher_names=publisher_names, min_pages=50) == \
+           in_memory_repo.filter_book_ids(publisher_names=publisher_names, min_pages=50)
+    assert shared_catalog_repo.filter_book_ids(book_ids[:5], ebook=False) == \
+           in_memory_repo.filter_book_ids(book_ids[:5], ebook=False)
+
+    for sort_by in ['alphabetical', 'ascending', 'descending', 'best_reviewed', 'most_reviewed', 'other']:
+        assert shared_catalog_repo.sort_book_ids(book_ids, sort_by) == in_memory_repo.sort_book_ids(book_ids, sort_by)
+        assert shared_catalog_repo.sort_book_ids(book_ids[:1], sort_by) == \
+               in_memory_repo.sort_book_ids(book_ids[:1], sort_by)
+
+
+def test_shared_catalog_has_the_same_coauthors(in_memory_repo, shared_catalog_repo):
+    for author in in_memory_repo.get_authors():
+        assert shared_catalog_repo.get_coauthors(author.unique_id) == in_memory_repo.get_coauthors(author.unique_id)
+        assert shared_catalog_repo.get_related_authors(author.unique_id) == \
+               in_memory_repo.get_related_authors(author.unique_id)
+
+
+def test_shared_catalog_keeps_reviews_and_favourites_private(in_memory_repo, shared_catalog_repo, tmp_path):
+    user = shared_catalog_repo.get_user('thorke')
+    book = shared_catalog_repo.get_book(13571772)
+    shared_catalog_repo.update_favourites(user, book)
+    review = make_review(user, book, 'Great', 5)
+    shared_catalog_repo.add_review(review)
+
+    assert book in user.favourites
+    assert review in shared_catalog_repo.get_reviews()
+    assert shared_catalog_repo.sort_book_ids(shared_catalog_repo.get_all_book_ids(), 'best_reviewed')[0] == 13571772
+
+    # Another repository mapping the same catalog doesn't see them
+    other_repo = SharedCatalogRepository(tmp_path / 'catalog.bin')
+    other_repo.add_user(User('thorke', 'cLQ^C#oFXloS'))
+    assert other_repo.get_reviews() == []
+    assert list(other_repo.get_book(13571772).reviews) == []
+    assert other_repo.get_user('thorke').favourites == []
+
+
+def test_shared_catalog_is_read_only(shared_catalog_repo):
+    with pytest.raises(RepositoryException):
+        shared_catalog_repo.add_book(Book(1, 'New book'))
+    with pytest.raises(RepositoryException):
+        shared_catalog_repo.add_author(Author(1, 'New author'))
+    with pytest.raises(RepositoryException):
+        shared_catalog_repo.add_publisher(Publisher('New publisher'))
+
+
+def test_shared_catalog_does_not_map_other_files(tmp_path):
+    path = tmp_path / 'catalog.bin'
+    path.write_bytes(b'not a catalog' * 10)
+
+    with pytest.raises(SharedCatalogException):
+        SharedCatalog(path)
+
+
+def test_repository_can_be_populated_from_a_compiled_catalog(in_memory_repo, tmp_path):
+    catalog_path = tmp_path / 'catalog.bin'
+    compile_shared_catalog(TEST_DATA_PATH, catalog_path)
+    repo = MemoryRepository()
+    repository_populate.populate(TEST_DATA_PATH, repo, False, catalog_path=catalog_path)
+
+    assert repo.get_all_book_ids() == in_memory_repo.get_all_book_ids()
+    for book_id in in_memory_repo.get_all_book_ids():
+        book = repo.get_book(book_id)
+        expected = in_memory_repo.get_book(book_id)
+        assert (book.title, book.description, book.publisher.name, book.release_year, book.ebook, book.num_pages,
+                book.image_url, book.rating_histogram) == \
+               (expected.title, expected.description, expected.publisher.name, expected.release_year,
+                expected.ebook, expected.num_pages, expected.image_url, expected.rating_histogram)
+        assert [(author.unique_id, author.full_name) for author in book.authors] == \
+               [(author.unique_id, author.full_name) for author in expected.authors]
+
+    assert sorted(repo.get_publishers()) == sorted(in_memory_repo.get_publishers())
+    for author in in_memory_repo.get_authors():
+        assert repo.get_coauthors(author.unique_id) == in_memory_repo.get_coauthors(author.unique_id)
+
+
+def test_compiled_catalog_reads_the_books_of_the_data_files(tmp_path):
+    catalog_path = tmp_path / 'catalog.bin'
+    compile_shared_catalog(TEST_DATA_PATH, catalog_path)
+
+    def records(batches):
+        return [((book.book_id, book.title, book.description, book.release_year, book.ebook, book.num_pages,
+                  book.image_url), list(authors))
+                for batch in batches for book, _, authors in batch]
+
+    # In the order of the books file, not that of the book ids
+    assert records(SharedCatalog(catalog_path).read_book_batches(batch_size=4)) == \
+           records(books_reader(TEST_DATA_PATH).read_book_batches())
+
+
+def test_shared_catalog_keeps_books_without_a_description(tmp_path):
+    catalog_path = tmp_path / 'catalog.bin'
+    repo = MemoryRepository()
+    book = Book(1, 'No description')
+    book.publisher = Publisher('Publisher')
+    repo.add_book(book)
+    build_shared_catalog(catalog_path, repo)
+
+    catalog = SharedCatalog(catalog_path)
+    assert catalog.description(catalog.book_row(1)) is None
+    assert [book.description for batch in catalog.read_book_batches() for book, _, _ in batch] == [None]
+
+
+def test_catalog_is_compiled_by_a_command(tmp_path):
+    app = create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH})
+    catalog_path = tmp_path / 'catalog.bin'
+
+    result = app.test_cli_runner().invoke(args=['compile-catalog', str(catalog_path)])
+    assert result.exit_code == 0
+    assert f'Compiled {catalog_path}' in result.output
+    assert len(SharedCatalog(catalog_path)) == 14
+
+
+def test_catalog_in_an_older_format_is_compiled_again(tmp_path):
+    catalog_path = tmp_path / 'catalog.bin'
+    compile_shared_catalog(TEST_DATA_PATH, catalog_path)
+    assert catalog_is_current(catalog_path, TEST_DATA_PATH)
+
+    # Written by an older version, which stored fewer sections
+    with open(catalog_path, 'r+b') as catalog_file:
+        section_count = HEADER.unpack(catalog_file.read(HEADER.size))[2]
+        catalog_file.seek(0)
+        catalog_file.write(HEADER.pack(MAGIC, 1, section_count))
+    assert not catalog_is_current(catalog_path, TEST_DATA_PATH)
+    with pytest.raises(SharedCatalogException):
+        SharedCatalog(catalog_path)
+
+    create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH,
+                'SHARED_CATALOG': catalog_path})
+    assert catalog_is_current(catalog_path, TEST_DATA_PATH)
@@ -3,6 +3,7 @@ from datetime import date, datetime
 import pytest
 
 import library.adapters.repository as repo
+from library.adapters import database_repository
 from library.adapters.database_repository import SqlAlchemyRepository
 from library.domain.model import User, Book, Author, Publisher, Review, make_review
 from library.adapters.repository import RepositoryException
@@ -63,6 +64,19 @@ def test_repository_can_add_book(session_factory):
     assert repo.get_book(1) == book
 
 
+def test_repository_can_add_books(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    book = make_book()
+    other_book = Book(2, "Fruits Basket 2")
+    other_book.description = "Second test description"
+    other_book.image_url = "https://cdn.myanimelist.net/images/manga/2/155964.jpg"
+    repo.add_books([book, other_book])
+
+    assert repo.get_book(1) == book
+    assert repo.get_book(2) == other_book
+
+
 def test_repository_can_retrieve_book(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -418,6 +432,14 @@ def test_repository_partial_search_by_author_does_not_return_all_if_invalid(sess
     assert matching_books == []
 
 
+def test_repository_can_get_coauthors_and_related_authors(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    assert [author.unique_id for author in repo.get_coauthors(14965)] == [131836, 3188368, 7507599]
+    assert [author.unique_id for author in repo.get_related_authors(14965, 3)] == [131836, 3188368, 7507599]
+    assert repo.get_coauthors(1) == []
+
+
 def test_repository_can_add_and_retrieve_a_publisher(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -582,6 +604,21 @@ def test_repository_can_add_a_review(session_factory):
     assert review in repo.get_reviews()
 
 
+def test_repository_persists_rating_aggregates(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    book = repo.get_book(18955715)
+    assert book.rating_count == 8
+    histogram = book.rating_histogram
+    repo.add_review(make_review(repo.get_user('thorke'), book, "This is a review", 2))
+
+    # A new repository reads the aggregates back from the database
+    book = SqlAlchemyRepository(session_factory).get_book(18955715)
+    assert book.rating_count == 9
+    assert book.rating_total == sum(review.rating for review in book.reviews)
+    assert book.rating_histogram == histogram[:1] + (histogram[1] + 1,) + histogram[2:]
+
+
 def test_repository_does_not_add_a_review_without_a_user(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -663,3 +700,68 @@ def test_repository_can_retrieve_reviews(session_factory):
 
     assert len(repo.get_reviews()) == 8
 
+
+def test_repository_can_retrieve_reviews_for_a_book_newest_first(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    reviews = repo.get_reviews_for_book(18955715)
+    assert [review.review_text for review in reviews] == [review.review_text
+                                                          for review in repo.get_book(18955715).reviews]
+    assert reviews[0].review_text == 'Awesome!'
+    assert reviews[-1].review_text == 'Could have been better'
+
+    page = repo.get_reviews_for_book(18955715, offset=1, limit=3)
+    assert page == reviews[1:4]
+    assert repo.get_reviews_for_book(1, 0, 10) == []
+
+
+
+def test_repository_can_filter_book_ids(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    year_book_ids = sorted(repo.get_book_ids_by_year(2012))
+    assert repo.filter_book_ids(year=2012) == year_book_ids
+    assert repo.filter_book_ids(year_book_ids[:2], year=2012) == year_book_ids[:2]
+    assert repo.filter_book_ids(year='2012') == []
+
+    for book_id in repo.filter_book_ids(min_pages=200, max_pages=300, ebook=False):
+        book = repo.get_book(book_id)
+        assert 200 <= book.num_pages <= 300 and book.ebook is False
+
+    marvel_book_ids = sorted(repo.get_book_ids_by_publisher(Publisher('Marvel')))
+    assert repo.filter_book_ids(publisher_names=['Marvel']) == marvel_book_ids
+
+
+def test_repository_can_sort_book_ids(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    books = repo.get_books(repo.get_all_book_ids())
+    book_ids = [book.book_id for book in books]
+
+    def average_rating(book):
+        ratings = [review.rating for review in book.reviews]
+        return sum(ratings) / len(ratings) if len(ratings) > 0 else 0
+
+    assert repo.sort_book_ids(book_ids, 'ascending') == [book.book_id for book in sorted(
+        books, key=lambda book: (book.release_year is None, book.release_year or 0, book.book_id))]
+    assert repo.sort_book_ids(book_ids, 'descending') == [book.book_id for book in sorted(
+        books, key=lambda book: (book.release_year is None, -(book.release_year or 0), book.book_id))]
+    assert repo.sort_book_ids(book_ids, 'best_reviewed') == [book.book_id for book in sorted(
+        books, key=lambda book: (-average_rating(book), book.book_id))]
+    assert repo.sort_book_ids(book_ids, 'most_reviewed') == [book.book_id for book in sorted(
+        books, key=lambda book: (-len(list(book.reviews)), book.book_id))]
+    assert repo.sort_book_ids(book_ids, 'alphabetical') == [book.book_id for book in sorted(
+        books, key=lambda book: (book.title, book.book_id))]
+
+
+def test_repository_can_sort_and_filter_more_book_ids_than_fit_in_a_query(session_factory, monkeypatch):
+    repo = SqlAlchemyRepository(session_factory)
+    book_ids = repo.get_all_book_ids()
+    sorted_book_ids = {sort_by: repo.sort_book_ids(book_ids, sort_by)
+                       for sort_by in ['ascending', 'descending', 'best_reviewed', 'most_reviewed', 'alphabetical']}
+    filtered_book_ids = repo.filter_book_ids(book_ids, min_pages=100)
+
+    # The ids are queried a few at a time
+    monkeypatch.setattr(database_repository, 'MAX_IN_VALUES', 3)
+    for sort_by, expected in sorted_book_ids.items():
+        assert repo.sort_book_ids(book_ids + book_ids[:2], sort_by) == expected
+    assert repo.filter_book_ids(book_ids, min_pages=100) == filtered_book_ids
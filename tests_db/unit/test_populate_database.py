@@ -1,19 +1,31 @@
-from sqlalchemy import select, inspect
+import json
 
-from library.adapters.orm import metadata
+import pytest
+from sqlalchemy import create_engine, select, inspect
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from library.adapters.database_repository import SqlAlchemyRepository
+
+from library.adapters.database_import import import_changed_books, import_in_progress, populate_resumably, \
+    read_checkpoint, add_rating_aggregate_columns
+from library.adapters.json_data_importer import load_books_authors_and_publishers, load_users, load_reviews
+from library.adapters.orm import metadata, map_model_to_tables, books_table, authors_table, publishers_table, \
+    book_authors_table, book_content_hashes_table, reviews_table, users_table
+
+from tests_db.conftest import TEST_DATA_PATH_DATABASE_LIMITED
 
 
 def test_database_populate_inspect_table_names(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    assert inspector.get_table_names() == ['authors', 'book_authors', 'books',
-                                           'publishers', 'reviews', 'user_favourites', 'users']
+    assert inspector.get_table_names() == ['authors', 'book_authors', 'book_content_hashes', 'books',
+                                           'import_checkpoints', 'publishers', 'reviews', 'user_favourites', 'users']
 
 
 def test_database_populate_select_all_publishers(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    name_of_publishers_table = inspector.get_table_names()[3]
+    name_of_publishers_table = inspector.get_table_names()[5]
 
     with database_engine.connect() as connection:
         # query for records in table publishers
@@ -51,7 +63,7 @@ def test_database_populate_select_all_authors(database_engine):
 def test_database_populate_select_all_users(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    name_of_users_table = inspector.get_table_names()[6]
+    name_of_users_table = inspector.get_table_names()[8]
 
     with database_engine.connect() as connection:
         # query for records in table users
@@ -68,7 +80,7 @@ def test_database_populate_select_all_users(database_engine):
 def test_database_populate_select_all_reviews(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    name_of_reviews_table = inspector.get_table_names()[4]
+    name_of_reviews_table = inspector.get_table_names()[6]
 
     with database_engine.connect() as connection:
         # query for records in table reviews
@@ -87,7 +99,7 @@ def test_database_populate_select_all_reviews(database_engine):
 def test_database_populate_select_all_books(database_engine):
     # Get table information
     inspector = inspect(database_engine)
-    name_of_books_table = inspector.get_table_names()[2]
+    name_of_books_table = inspector.get_table_names()[3]
 
     with database_engine.connect() as connection:
         # query for records in table books
@@ -102,3 +114,168 @@ def test_database_populate_select_all_books(database_engine):
         assert nr_books == 14
 
         assert all_books[0] == (780918, 'Rite of Conquest (William the Conqueror, #1)')
+
+
+def test_database_import_writes_only_changed_books(database_engine, tmp_path):
+    # The content hashes of the populated books are recorded, but books imported before them are all written once
+    assert import_changed_books(TEST_DATA_PATH_DATABASE_LIMITED, database_engine) == (0, 0, 14)
+    database_engine.execute(book_content_hashes_table.delete())
+    assert import_changed_books(TEST_DATA_PATH_DATABASE_LIMITED, database_engine) == (0, 14, 0)
+    assert import_changed_books(TEST_DATA_PATH_DATABASE_LIMITED, database_engine) == (0, 0, 14)
+
+    # Change a Book and the name of its Author, and add a Book with a new Author and Publisher
+    books_json = [json.loads(line) for line in
+                  (TEST_DATA_PATH_DATABASE_LIMITED / "comic_books_excerpt.json").read_text('UTF-8').splitlines()]
+    books_json[0]['title'] = 'Washington B.C.'
+    books_json[0]['authors'] = books_json[0]['authors'][:2]
+    books_json.append(dict(books_json[1], book_id='1', title='New book', publisher='New publisher',
+                           authors=[{'author_id': '1', 'role': ''}]))
+    authors_json = [json.loads(line) for line in
+                    (TEST_DATA_PATH_DATABASE_LIMITED / "book_authors_excerpt.json").read_text('UTF-8').splitlines()]
+    for author_json in authors_json:
+        if author_json['author_id'] == '169662':
+            author_json['name'] = 'D. Rouleau'
+    authors_json.append({'author_id': '1', 'name': 'New author'})
+    for file_name, rows in [("comic_books_excerpt.json", books_json), ("book_authors_excerpt.json", authors_json)]:
+        (tmp_path / file_name).write_text(''.join(json.dumps(row) + '\n' for row in rows), encoding='UTF-8')
+
+    with database_engine.connect() as connection:
+        reviews_before = connection.execute(select([reviews_table])).fetchall()
+        users_before = connection.execute(select([users_table])).fetchall()
+
+    assert import_changed_books(tmp_path, database_engine, batch_size=5) == (1, 1, 13)
+    assert import_changed_books(tmp_path, database_engine) == (0, 0, 15)
+
+    with database_engine.connect() as connection:
+        book = connection.execute(select([books_table]).where(books_table.c.id == 12413392)).fetchone()
+        assert (book['title'], book['rating_count'], book['rating_total']) == ('Washington B.C.', 2, 5)
+        assert connection.execute(select([book_authors_table.c.author_id])
+                                  .where(book_authors_table.c.book_id == 12413392)
+                                  .order_by(book_authors_table.c.author_id)).fetchall() == [(23519,), (169662,)]
+        assert connection.execute(select([authors_table.c.full_name])
+                                  .where(authors_table.c.id == 169662)).scalar() == 'D. Rouleau'
+
+        book = connection.execute(select([books_table]).where(books_table.c.id == 1)).fetchone()
+        assert (book['title'], book['publisher_name']) == ('New book', 'New publisher')
+        assert connection.execute(select([authors_table.c.full_name])
+                                  .where(authors_table.c.id == 1)).scalar() == 'New author'
+        assert connection.execute(select([publishers_table.c.name])
+                                  .where(publishers_table.c.name == 'New publisher')).scalar() == 'New publisher'
+
+        assert connection.execute(select([reviews_table])).fetchall() == reviews_before
+        assert connection.execute(select([users_table])).fetchall() == users_before
+
+
+class ImportStopped(Exception):
+    pass
+
+
+def stop_after(number_of_reports: int):
+    reports = []
+
+    def report(message: str):
+        reports.append(message)
+        if len(reports) == number_of_reports:
+            raise ImportStopped
+    return report, reports
+
+
+def select_all(engine, table):
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(select([table]).order_by(*table.primary_key.columns))]
+
+
+def test_database_created_without_rating_aggregates_gets_them_from_its_reviews(database_engine):
+    rating_columns = [books_table.c.id, books_table.c.rating_count, books_table.c.rating_total,
+                      books_table.c.rating_histogram]
+    expected = database_engine.execute(select(rating_columns).order_by(books_table.c.id)).fetchall()
+    assert any(count > 0 for _, count, _, _ in expected)
+    for column in ['rating_count', 'rating_total', 'rating_histogram']:
+        database_engine.execute(f'ALTER TABLE books DROP COLUMN {column}')
+
+    add_rating_aggregate_columns(database_engine)
+    assert database_engine.execute(select(rating_columns).order_by(books_table.c.id)).fetchall() == expected
+
+    # Once added, they are left as they are
+    add_rating_aggregate_columns(database_engine)
+    assert database_engine.execute(select(rating_columns).order_by(books_table.c.id)).fetchall() == expected
+
+
+def test_database_import_resumes_from_its_checkpoint(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "resumable.db"}')
+
+    # Stop after the first of the three batches of books has been committed
+    report, reports = stop_after(1)
+    with pytest.raises(ImportStopped):
+        populate_resumably(TEST_DATA_PATH_DATABASE_LIMITED, engine, batch_size=5, report=report)
+    assert import_in_progress(engine)
+    checkpoint = read_checkpoint(engine)
+    assert (checkpoint['stage'], checkpoint['users_loaded'], checkpoint['reviews_loaded']) == ('books', 0, 0)
+    books_file_size = (TEST_DATA_PATH_DATABASE_LIMITED / "comic_books_excerpt.json").stat().st_size
+    assert 0 < checkpoint['books_offset'] < books_file_size
+    assert len(select_all(engine, books_table)) == 5
+    assert reports[0].startswith('books: 5 loaded')
+
+    # Resume with batches of one row, and stop after the remaining 9 books and the first user have been committed
+    report, reports = stop_after(11)
+    with pytest.raises(ImportStopped):
+        populate_resumably(TEST_DATA_PATH_DATABASE_LIMITED, engine, batch_size=1, report=report)
+    assert reports[0].startswith('Resuming the import at the books stage')
+    assert reports[-1].startswith('users: 1 loaded')
+    checkpoint = read_checkpoint(engine)
+    assert (checkpoint['stage'], checkpoint['users_loaded'], checkpoint['reviews_loaded']) == ('users', 1, 0)
+    assert checkpoint['last_author_id'] is not None
+    populate_resumably(TEST_DATA_PATH_DATABASE_LIMITED, engine, batch_size=1, report=lambda message: None)
+    assert read_checkpoint(engine)['stage'] == 'finished'
+    assert not import_in_progress(engine)
+
+    # The database is the same as one populated in a single run
+    other_engine = create_engine(f'sqlite:///{tmp_path / "other.db"}')
+    populate_resumably(TEST_DATA_PATH_DATABASE_LIMITED, other_engine, report=lambda message: None)
+    for table in [books_table, authors_table, publishers_table, book_authors_table, users_table]:
+        assert len(select_all(engine, table)) > 0
+        if table is book_authors_table:
+            assert sorted(row[1:] for row in select_all(engine, table)) == \
+                   sorted(row[1:] for row in select_all(other_engine, table))
+        elif table is users_table:
+            assert [row[:2] for row in select_all(engine, table)] == [(1, 'thorke'), (2, 'fmercury')]
+            assert [row[:2] for row in select_all(other_engine, table)] == [(1, 'thorke'), (2, 'fmercury')]
+        else:
+            assert select_all(engine, table) == select_all(other_engine, table)
+    assert [row[:5] for row in select_all(engine, reviews_table)] == [(1, 1, 12413392, 'This is a review 1', 3),
+                                                                      (2, 1, 12413392, 'This is a review 2', 2),
+                                                                      (3, 2, 35452242, 'Great book', 5)]
+    with engine.connect() as connection:
+        assert connection.execute(select([books_table.c.rating_count, books_table.c.rating_total,
+                                          books_table.c.rating_histogram])
+                                  .where(books_table.c.id == 12413392)).fetchone() == (2, 5, (0, 1, 1, 0, 0))
+
+    # Once finished, a new import starts again from the beginning
+    report, reports = stop_after(1)
+    with pytest.raises(ImportStopped):
+        populate_resumably(TEST_DATA_PATH_DATABASE_LIMITED, engine, batch_size=5, report=report)
+    assert len(select_all(engine, books_table)) == 5
+    assert len(select_all(engine, users_table)) == 0
+
+
+def test_database_populated_in_bulk_is_the_same_as_one_populated_one_object_at_a_time(database_engine, tmp_path):
+    # database_engine is populated in bulk, the other database through the repository's session
+    clear_mappers()
+    engine = create_engine(f'sqlite:///{tmp_path / "per_object.db"}')
+    metadata.create_all(engine)
+    map_model_to_tables()
+    repo = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    load_books_authors_and_publishers(TEST_DATA_PATH_DATABASE_LIMITED, repo, True)
+    load_reviews(TEST_DATA_PATH_DATABASE_LIMITED, repo, load_users(TEST_DATA_PATH_DATABASE_LIMITED, repo))
+    repo.close_session()
+
+    for table in [books_table, authors_table, publishers_table, book_authors_table]:
+        assert len(select_all(database_engine, table)) > 0
+        assert sorted(row[-2:] if table is book_authors_table else row for row in select_all(database_engine, table)) \
+               == sorted(row[-2:] if table is book_authors_table else row for row in select_all(engine, table))
+    # Passwords are salted and reviews timestamped differently each time
+    assert [row[:2] for row in select_all(database_engine, users_table)] == \
+           [row[:2] for row in select_all(engine, users_table)]
+    assert [row[:5] for row in select_all(database_engine, reviews_table)] == \
+           [row[:5] for row in select_all(engine, reviews_table)]
+    assert len(select_all(database_engine, book_content_hashes_table)) == len(select_all(database_engine, books_table))